@@ -1,15 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-from sqlalchemy.orm import Session
-from database import get_db
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
+from ids import new_id
 from models import User
+from rate_limit import limiter
+from services.google_auth_service import google_token_verifier
 from pydantic import BaseModel
-import uuid
 import os
 
 router = APIRouter()
-limiter = Limiter(key_func=get_remote_address)
 
 class GoogleAuthRequest(BaseModel):
     token: str
@@ -22,7 +23,7 @@ class GoogleAuthRequest(BaseModel):
 async def google_auth(
     request: Request,  # Add Request parameter for rate limiting
     auth_request: GoogleAuthRequest, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Verify Google token
     try:
@@ -34,14 +35,11 @@ async def google_auth(
             else:
                 raise HTTPException(status_code=500, detail="Google client ID not configured")
         else:
-            # Verify token
-            from google.oauth2 import id_token
-            from google.auth.transport import requests as google_requests
-            
-            idinfo = id_token.verify_oauth2_token(
-                auth_request.token, 
-                google_requests.Request(), 
-                GOOGLE_CLIENT_ID
+            # Verify token (cached certs + verified-token cache; off the event loop)
+            idinfo = await run_in_threadpool(
+                google_token_verifier.verify,
+                auth_request.token,
+                GOOGLE_CLIENT_ID,
             )
             
             # Verify email matches
@@ -61,7 +59,7 @@ async def google_auth(
         pass
     
     # Create/update user
-    user = db.query(User).filter(User.email == auth_request.email).first()
+    user = (await db.execute(select(User).where(User.email == auth_request.email))).scalars().first()
     
     if user:
         user.name = auth_request.name
@@ -69,7 +67,7 @@ async def google_auth(
             user.picture = auth_request.avatar_url
     else:
         user = User(
-            id=str(uuid.uuid4()),
+            id=new_id(),
             email=auth_request.email,
             name=auth_request.name,
             picture=auth_request.avatar_url,
@@ -77,14 +75,14 @@ async def google_auth(
         )
         db.add(user)
     
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
 
     # Ensure user has a referral_code for sharing
     try:
         from services.referral_service import ReferralService
 
-        ReferralService.ensure_referral_code(user, db)
+        await db.run_sync(lambda session: ReferralService.ensure_referral_code(user, session))
     except Exception:
         # Don't block login if referral code generation fails
         pass
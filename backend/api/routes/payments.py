@@ -1,15 +1,51 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Header
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+import asyncio
+import io
+import json
+import os
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Header, Query, UploadFile, File, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 
-from database import get_db
+from database import get_db, get_async_db, AsyncSessionLocal
+from rate_limit import limiter
+from services.payment_events import payment_status_broker, TooManyWaitersError
 from services.payment_service import PaymentService
+from services.reconciliation_service import ReconciliationService
+from services.vietqr_service import VietQRService
 
 
 router = APIRouter()
-limiter = Limiter(key_func=get_remote_address)
+
+# Long-poll / SSE tuning (seconds)
+STATUS_WAIT_MAX = float(os.getenv("PAYMENT_STATUS_WAIT_MAX", "30"))
+STATUS_SSE_HEARTBEAT = float(os.getenv("PAYMENT_STATUS_SSE_HEARTBEAT", "15"))
+STATUS_SSE_MAX_DURATION = float(os.getenv("PAYMENT_STATUS_SSE_MAX_DURATION", "900"))
+# Only COMPLETED is final: a late transfer can still settle a FAILED or EXPIRED payment
+TERMINAL_STATUSES = {"completed"}
+
+
+def _status_response(data: dict) -> dict:
+    # Return keys similar to the doc
+    return {
+        "transaction_id": data.get("transaction_id"),
+        "status": (data.get("status") or "").strip().lower(),
+        "amount": data.get("amount_vnd"),
+        "coins": data.get("coins"),
+        "credits": data.get("user_credits"),
+        "user_id": data.get("user_id"),
+    }
+
+
+async def _read_status(db: AsyncSession, transaction_id: str) -> dict:
+    data = await db.run_sync(
+        lambda session: PaymentService.get_payment_status(db=session, transaction_id=transaction_id)
+    )
+    # End the read transaction so the pooled connection isn't held while waiting
+    await db.rollback()
+    return _status_response(data)
 
 
 class CreateOrderRequest(BaseModel):
@@ -51,32 +87,144 @@ def payment_status(
 ):
     try:
         data = PaymentService.get_payment_status(db=db, transaction_id=transaction_id)
-        status = (data.get("status") or "").strip().lower()
-        # Return keys similar to the doc
-        return {
-            "transaction_id": data.get("transaction_id"),
-            "status": status,
-            "amount": data.get("amount_vnd"),
-            "coins": data.get("coins"),
-            "credits": data.get("user_credits"),
-            "user_id": data.get("user_id"),
-        }
+        return _status_response(data)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/{transaction_id}/qr")
+@limiter.limit("120/minute")
+def payment_qr(
+    request: Request,
+    transaction_id: str,
+    format: str = Query(default="png", pattern="^(png|svg)$"),
+    if_none_match: str | None = Header(default=None),
+    db: Session = Depends(get_db),
+):
+    """
+    VietQR image for the order, rendered in-process. Immutable per
+    transaction, so it is sent with a long Cache-Control and an ETag.
+    """
+    try:
+        image, etag = PaymentService.get_payment_qr(db=db, transaction_id=transaction_id, fmt=format)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    headers = {
+        "Cache-Control": f"public, max-age={VietQRService.CACHE_MAX_AGE}, immutable",
+        "ETag": etag,
+    }
+    if if_none_match and etag in {tag.strip() for tag in if_none_match.split(",")}:
+        return Response(status_code=304, headers=headers)
+    return Response(content=image, media_type=VietQRService.FORMATS[format], headers=headers)
+
+
+@router.get("/{transaction_id}/wait")
+@limiter.limit("60/minute")
+async def payment_status_wait(
+    request: Request,
+    transaction_id: str,
+    timeout: float = Query(default=25.0, ge=0),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Long-poll: returns as soon as the payment status changes (woken by the
+    webhook), right away once it is COMPLETED, or the current status after
+    `timeout` seconds.
+    """
+    timeout = min(timeout, STATUS_WAIT_MAX)
+    try:
+        # Subscribe before reading so a webhook landing in between isn't missed
+        with payment_status_broker.subscribe(transaction_id) as changed:
+            data = await _read_status(db, transaction_id)
+            if data["status"] in TERMINAL_STATUSES or timeout == 0:
+                return data
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        return await _read_status(db, transaction_id)
+    except TooManyWaitersError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/{transaction_id}/events")
+@limiter.limit("20/minute")
+async def payment_status_events(
+    request: Request,
+    transaction_id: str,
+):
+    """
+    Server-Sent Events: one `status` event now and on every change, until the
+    payment is COMPLETED (a FAILED or EXPIRED one may still settle, so the
+    stream stays open). Heartbeats re-check the DB in case the webhook was
+    handled by another worker.
+    """
+    # Dependency sessions are closed before a streaming body runs, so the
+    # stream owns its session
+    async with AsyncSessionLocal() as db:
+        try:
+            data = await _read_status(db, transaction_id)
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+
+    async def stream():
+        nonlocal data
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + STATUS_SSE_MAX_DURATION
+        yield f"event: status\ndata: {json.dumps(data)}\n\n"
+        try:
+            with payment_status_broker.subscribe(transaction_id) as changed:
+                # Re-check once after subscribing in case the status changed in between
+                changed.set()
+                async with AsyncSessionLocal() as db:
+                    while data["status"] not in TERMINAL_STATUSES and loop.time() < deadline:
+                        if await request.is_disconnected():
+                            return
+                        try:
+                            await asyncio.wait_for(changed.wait(), timeout=STATUS_SSE_HEARTBEAT)
+                        except asyncio.TimeoutError:
+                            yield ": heartbeat\n\n"
+                        changed.clear()
+                        latest = await _read_status(db, transaction_id)
+                        if latest != data:
+                            data = latest
+                            yield f"event: status\ndata: {json.dumps(data)}\n\n"
+        except TooManyWaitersError as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post("/webhook")
 @limiter.limit("120/minute")
 async def payment_webhook(
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     x_webhook_secret: str | None = Header(default=None, alias="X-Webhook-Secret"),
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"),
 ):
     try:
         payload = await request.json()
-        result = PaymentService.process_webhook(db=db, payload=payload, signature=x_webhook_secret)
+        # Run the sync service code on the async connection (no blocking I/O on the loop)
+        result = await db.run_sync(
+            lambda session: PaymentService.process_webhook(
+                db=session,
+                payload=payload,
+                signature=x_webhook_secret,
+                idempotency_key=idempotency_key,
+            )
+        )
         return result
     except ValueError as e:
         msg = str(e)
@@ -88,3 +236,68 @@ async def payment_webhook(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@router.post("/webhook/batch")
+@limiter.limit("30/minute")
+async def payment_webhook_batch(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    x_webhook_secret: str | None = Header(default=None, alias="X-Webhook-Secret"),
+):
+    """
+    Body: [ {webhook payload}, ... ] or { "notifications": [ ... ] }
+    Settles all notifications in one transaction; returns one result per item.
+    """
+    try:
+        body = await request.json()
+        payloads = body.get("notifications") if isinstance(body, dict) else body
+        if not isinstance(payloads, list):
+            raise ValueError("Expected a list of notifications")
+        if len(payloads) > PaymentService.WEBHOOK_BATCH_MAX:
+            raise ValueError(f"Batch too large (max {PaymentService.WEBHOOK_BATCH_MAX})")
+        results = await db.run_sync(
+            lambda session: PaymentService.process_webhook_batch(
+                db=session, payloads=payloads, signature=x_webhook_secret
+            )
+        )
+        return {"results": results}
+    except ValueError as e:
+        msg = str(e)
+        if "signature" in msg.lower():
+            raise HTTPException(status_code=401, detail=msg)
+        raise HTTPException(status_code=400, detail=msg)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/reconcile")
+@limiter.limit("5/minute")
+def reconcile_statement(
+    request: Request,
+    file: UploadFile = File(...),
+    format: str | None = Query(default=None, pattern="^(csv|json)$"),
+    db: Session = Depends(get_db),
+    x_webhook_secret: str | None = Header(default=None, alias="X-Webhook-Secret"),
+):
+    """
+    Upload a bank statement export (CSV, JSON array or JSON Lines).
+    Settles payments whose NAPCOIN reference and amount match; returns
+    counts plus the mismatched and unmatched (leftover) rows.
+    """
+    try:
+        PaymentService.require_secret(x_webhook_secret)
+        # Sync route: the spooled upload is read row by row in the threadpool
+        stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+        try:
+            return ReconciliationService.reconcile(db, ReconciliationService.iter_statement(stream, format))
+        finally:
+            stream.detach()
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=f"Statement import is disabled: {e}")
+    except ValueError as e:
+        msg = str(e)
+        if "signature" in msg.lower():
+            raise HTTPException(status_code=401, detail=msg)
+        raise HTTPException(status_code=400, detail=msg)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
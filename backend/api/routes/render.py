@@ -0,0 +1,73 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database import get_async_db, get_db
+from models import RenderJob
+from rate_limit import limiter
+from services.credit_service import InsufficientCreditsError
+from services.render_jobs import JobStateError, QueueFullError, RenderJobService, render_scheduler
+
+router = APIRouter()
+
+
+class SubmitRenderJobRequest(BaseModel):
+    user_id: str
+    params: dict = {}
+    # low | normal | high (costs RENDER_PRIORITY_COST x RENDER_JOB_COST credits)
+    priority: str = "normal"
+
+
+@router.post("/jobs", status_code=201)
+@limiter.limit("30/minute")
+def submit_render_job(
+    request: Request,
+    body: SubmitRenderJobRequest,
+    db: Session = Depends(get_db),
+):
+    """
+    Reserve the job's credits and queue it. Poll GET /jobs/{job_id} for the result;
+    a failed or cancelled job's credits are refunded.
+    """
+    try:
+        job = RenderJobService.submit(db, body.user_id, body.params, body.priority)
+    except InsufficientCreditsError as e:
+        raise HTTPException(status_code=402, detail=str(e))
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    render_scheduler.notify()
+    return job
+
+
+@router.get("/jobs/{job_id}")
+@limiter.limit("120/minute")
+async def get_render_job(
+    request: Request,
+    job_id: str,
+    db: AsyncSession = Depends(get_async_db),
+):
+    job = await db.get(RenderJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Render job not found")
+    return RenderJobService.to_dict(job)
+
+
+@router.post("/jobs/{job_id}/cancel")
+@limiter.limit("30/minute")
+def cancel_render_job(
+    request: Request,
+    job_id: str,
+    user_id: str = Query(...),
+    db: Session = Depends(get_db),
+):
+    """Cancel a job that hasn't started yet and refund its credits"""
+    try:
+        return RenderJobService.cancel(db, job_id, user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except JobStateError as e:
+        raise HTTPException(status_code=409, detail=str(e))
@@ -1,14 +1,17 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-from services.zipline_service import ZiplineService
+from fastapi import APIRouter, HTTPException, UploadFile, File, Request, Header, Response
+from pydantic import BaseModel
+from starlette.requests import ClientDisconnect
+from rate_limit import limiter
+from services.resilience import CircuitOpenError
+from services.resumable_upload import ResumableUploadService, UploadConflictError, UploadSessionNotFound
+from services.zipline_service import ZiplineService, UploadTooLargeError
 
 router = APIRouter()
-limiter = Limiter(key_func=get_remote_address)
 
 @router.post("/")
 @limiter.limit("20/minute")
 async def upload_file(
+    request: Request,
     file: UploadFile = File(...)
 ):
     """
@@ -20,8 +23,155 @@ async def upload_file(
             "url": result["url"],
             "name": result["name"]
         }
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
     except ValueError as e:
         raise HTTPException(status_code=500, detail=f"Configuration error: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
+
+@router.post("/batch")
+@limiter.limit("20/minute")
+async def upload_files(
+    request: Request,
+    files: list[UploadFile] = File(...)
+):
+    """
+    Upload nhiều file trong một request multipart (field `files` lặp lại),
+    gửi song song lên Zipline (tối đa ZIPLINE_BATCH_CONCURRENCY file cùng lúc).
+    Lỗi của từng file nằm trong kết quả, không làm hỏng cả batch.
+    """
+    if len(files) > ZiplineService.BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files: {len(files)} (max {ZiplineService.BATCH_MAX_FILES})",
+        )
+
+    try:
+        results = await ZiplineService.upload_files(files)
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=f"Configuration error: {str(e)}")
+
+    uploaded = sum(1 for item in results if item["ok"])
+    return {
+        "uploaded": uploaded,
+        "failed": len(results) - uploaded,
+        "results": results,
+    }
+
+
+# Resumable uploads (tus-style): POST /sessions -> PUT chunks with Upload-Offset
+# -> HEAD/GET to find the offset after a dropped connection -> POST /finalize
+
+class CreateUploadSessionRequest(BaseModel):
+    filename: str
+    size: int
+    content_type: str | None = None
+
+
+def _session_headers(state: dict) -> dict:
+    return {
+        "Upload-Offset": str(state["offset"]),
+        "Upload-Length": str(state["size"]),
+        "Cache-Control": "no-store",
+    }
+
+
+def _session_error(e: Exception) -> HTTPException:
+    if isinstance(e, UploadSessionNotFound):
+        return HTTPException(status_code=404, detail=str(e))
+    if isinstance(e, UploadConflictError):
+        headers = {"Upload-Offset": str(e.offset)} if e.offset is not None else None
+        return HTTPException(status_code=409, detail=str(e), headers=headers)
+    if isinstance(e, UploadTooLargeError):
+        return HTTPException(status_code=413, detail=str(e))
+    return HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/sessions", status_code=201)
+@limiter.limit("20/minute")
+async def create_upload_session(request: Request, payload: CreateUploadSessionRequest, response: Response):
+    """
+    Tạo phiên upload resumable, trả về upload_id (offset bắt đầu = 0)
+    """
+    try:
+        state = ResumableUploadService.create(payload.filename, payload.size, payload.content_type)
+    except (UploadTooLargeError, ValueError) as e:
+        raise _session_error(e)
+    response.headers.update(_session_headers(state))
+    response.headers["Location"] = f"{request.url.path.rstrip('/')}/{state['upload_id']}"
+    return state
+
+
+@router.api_route("/sessions/{upload_id}", methods=["GET", "HEAD"])
+@limiter.limit("300/minute")
+async def get_upload_session(request: Request, upload_id: str, response: Response):
+    """
+    Offset hiện tại của phiên (client gọi sau khi mất kết nối để upload tiếp)
+    """
+    try:
+        state = ResumableUploadService.status(upload_id)
+    except UploadSessionNotFound as e:
+        raise _session_error(e)
+    response.headers.update(_session_headers(state))
+    return state
+
+
+@router.put("/sessions/{upload_id}")
+@limiter.limit("300/minute")
+async def upload_session_chunk(
+    request: Request,
+    upload_id: str,
+    response: Response,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    content_length: int | None = Header(None),
+):
+    """
+    Ghi body (raw bytes) vào cuối file tạm tại Upload-Offset.
+    Upload-Offset phải bằng offset hiện tại, nếu không trả 409 kèm offset đúng.
+    """
+    try:
+        state = await ResumableUploadService.append(
+            upload_id, upload_offset, request.stream(), content_length
+        )
+    except ClientDisconnect:
+        # Phần đã nhận vẫn được giữ; client hỏi lại offset rồi gửi tiếp
+        return Response(status_code=400)
+    except (UploadSessionNotFound, UploadConflictError, UploadTooLargeError) as e:
+        raise _session_error(e)
+    response.headers.update(_session_headers(state))
+    return state
+
+
+@router.post("/sessions/{upload_id}/finalize")
+@limiter.limit("20/minute")
+async def finalize_upload_session(request: Request, upload_id: str):
+    """
+    Gửi file đã ghép đủ lên Zipline và trả về URL (gọi lại nhiều lần vẫn trả cùng kết quả)
+    """
+    try:
+        return await ResumableUploadService.finalize(upload_id)
+    except (UploadSessionNotFound, UploadConflictError, UploadTooLargeError) as e:
+        raise _session_error(e)
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=f"Configuration error: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+
+@router.delete("/sessions/{upload_id}", status_code=204)
+@limiter.limit("20/minute")
+async def abort_upload_session(request: Request, upload_id: str):
+    """
+    Hủy phiên upload và xóa file tạm
+    """
+    try:
+        ResumableUploadService.abort(upload_id)
+    except (UploadSessionNotFound, UploadConflictError) as e:
+        raise _session_error(e)
+    return Response(status_code=204)
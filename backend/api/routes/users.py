@@ -1,13 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-from sqlalchemy.orm import Session
-from database import get_db
-from models import User
-from services.zipline_service import ZiplineService
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request, Query, Header
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
+from models import User, UserAvatar
+from rate_limit import limiter
+from services.history_service import HistoryService
+from services.image_service import ImageService, InvalidImageError
+from services.payment_service import PaymentService
+from services.resilience import CircuitOpenError
+from services.zipline_service import UploadTooLargeError
 
 router = APIRouter()
-limiter = Limiter(key_func=get_remote_address)
+
+
+def _require_secret(x_webhook_secret: str | None) -> None:
+    # Financial history is admin-only, behind the same secret as /api/payments/reconcile
+    try:
+        PaymentService.require_secret(x_webhook_secret)
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=f"History is disabled: {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+
 
 @router.post("/avatar")
 @limiter.limit("20/minute")
@@ -15,30 +30,90 @@ async def upload_user_avatar(
     request: Request,
     user_id: str = Form(...),
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
-    Upload avatar lên Zipline và lưu URL vào DB (users.picture)
+    Resize the avatar (ImageService), upload the small renditions to Zipline
+    and save their URLs (users.picture = the PICTURE_SIZE one)
     """
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     try:
-        result = await ZiplineService.upload_file(file)
+        renditions = await ImageService.upload_avatar(file)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
     except ValueError as e:
         raise HTTPException(status_code=500, detail=f"Configuration error: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
-    user.picture = result["url"]
-    db.commit()
-    db.refresh(user)
+    user.picture = ImageService.picture_url(renditions)
+    avatar = await db.get(UserAvatar, user_id)
+    if avatar is None:
+        db.add(UserAvatar(user_id=user_id, renditions=json.dumps(renditions)))
+    else:
+        avatar.renditions = json.dumps(renditions)
+    await db.commit()
+    await db.refresh(user)
 
     return {
         "user_id": user.id,
         "picture": user.picture,
+        "renditions": renditions,
         "name": user.name,
         "email": user.email,
     }
 
+
+@router.get("/{user_id}/payments")
+@limiter.limit("60/minute")
+async def list_user_payments(
+    request: Request,
+    user_id: str,
+    limit: int = Query(default=HistoryService.DEFAULT_LIMIT, ge=1, le=HistoryService.MAX_LIMIT),
+    cursor: str | None = Query(default=None),
+    status: str | None = Query(default=None),
+    db: AsyncSession = Depends(get_async_db),
+    x_webhook_secret: str | None = Header(default=None, alias="X-Webhook-Secret"),
+):
+    """
+    Payment history, newest first. Pass `next_cursor` back as `cursor` for the next page.
+    Requires X-Webhook-Secret.
+    """
+    _require_secret(x_webhook_secret)
+    try:
+        return await db.run_sync(
+            lambda session: HistoryService.list_payments(session, user_id, limit, cursor, status)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/{user_id}/credit-transactions")
+@limiter.limit("60/minute")
+async def list_user_credit_transactions(
+    request: Request,
+    user_id: str,
+    limit: int = Query(default=HistoryService.DEFAULT_LIMIT, ge=1, le=HistoryService.MAX_LIMIT),
+    cursor: str | None = Query(default=None),
+    type: str | None = Query(default=None),
+    db: AsyncSession = Depends(get_async_db),
+    x_webhook_secret: str | None = Header(default=None, alias="X-Webhook-Secret"),
+):
+    """
+    Credit ledger (ADDITION / DEDUCTION), newest first, keyset-paginated like /payments.
+    Requires X-Webhook-Secret.
+    """
+    _require_secret(x_webhook_secret)
+    try:
+        return await db.run_sync(
+            lambda session: HistoryService.list_credit_transactions(session, user_id, limit, cursor, type)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,47 @@
+"""Helpers shared by the benchmark scripts: free ports, peak RSS, percentiles and a local Zipline stub."""
+import asyncio
+import resource
+import socket
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100.0 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+async def _start_zipline_stub(port: int, latency_ms: float):
+    from aiohttp import web
+
+    async def upload(request: web.Request) -> web.Response:
+        reader = await request.multipart()
+        part = await reader.next()
+        size = 0
+        while True:
+            chunk = await part.read_chunk()
+            if not chunk:
+                break
+            size += len(chunk)
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000.0)
+        name = part.filename or "file"
+        return web.json_response({"files": [{"name": name, "url": f"http://zipline.local/u/{size}-{name}"}]})
+
+    app = web.Application(client_max_size=1024 ** 3)
+    app.router.add_post("/api/upload", upload)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
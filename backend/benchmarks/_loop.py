@@ -0,0 +1,31 @@
+"""Event-loop stall measurement shared by the async benchmarks."""
+import asyncio
+import time
+
+
+class _LoopStallTicker:
+    """
+    Sleeps `interval` (10 ms) at a time on the running event loop and records how
+    late each wake-up is: the stall every other coroutine on the loop sees at that moment
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.stalls: list[float] = []
+        self._stop = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._tick())
+
+    async def _tick(self) -> None:
+        while not self._stop.is_set():
+            before = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.stalls.append(time.perf_counter() - before - self.interval)
+
+    async def stop(self) -> float:
+        """Stops the ticker; returns the worst stall in seconds"""
+        self._stop.set()
+        await self._task
+        return max(self.stalls, default=0.0)
@@ -0,0 +1,144 @@
+"""
+Throughput and latency of the avatar pipeline (ImageService) per pool size.
+
+Generates a phone-sized JPEG (--width x --height, EXIF orientation + ICC
+profile), then pushes --requests renders through ImageService with
+--concurrency in flight, once per pool size in --pools. Pool size 0 renders
+inline on the event loop for comparison. Reports images/s, per-request
+latency (including the wait for a pool slot) and the worst event-loop stall
+seen by a 10 ms ticker. Inline latency counts only the render itself; the
+stall column is what it costs every other request on the loop. Zipline is
+not involved.
+
+    cd backend
+    python -m benchmarks.avatar_pipeline --pools 0,1,2,4 --requests 64
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def _photo(width: int, height: int, quality: int) -> bytes:
+    from PIL import Image, ImageCms
+
+    # Gradient plus sensor-like noise compresses roughly like a real photo
+    base = Image.linear_gradient("L").resize((width, height))
+    channels = [Image.blend(base, Image.effect_noise((width, height), sigma), 0.35) for sigma in (40, 55, 70)]
+    image = Image.merge("RGB", channels)
+    exif = Image.Exif()
+    exif[0x0112] = 6  # orientation: rotate 90 CW
+    icc = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality, exif=exif, icc_profile=icc)
+    return buffer.getvalue()
+
+
+def _percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+async def _run(data: bytes, pool_size: int, requests: int, concurrency: int) -> dict:
+    from services.image_service import ImageService
+
+    ImageService.shutdown()
+    if pool_size:
+        ImageService.POOL_WORKERS = pool_size
+        ImageService.POOL_QUEUE = pool_size * 2
+        ImageService.startup()
+        # Spawn and warm every worker (imports, codec init) outside the timing
+        await asyncio.gather(*(ImageService.render(data) for _ in range(pool_size)))
+
+    async def render() -> list[dict]:
+        if not pool_size:
+            return ImageService.render_renditions(
+                data, ImageService.SIZES, ImageService.FORMATS, ImageService.QUALITY, ImageService.MAX_PIXELS
+            )
+        async with ImageService._slots:
+            return await ImageService.render(data)
+
+    stall = 0.0
+    stop = asyncio.Event()
+
+    async def ticker() -> None:
+        nonlocal stall
+        while not stop.is_set():
+            before = time.perf_counter()
+            await asyncio.sleep(0.01)
+            stall = max(stall, time.perf_counter() - before - 0.01)
+
+    latencies: list[float] = []
+    outputs: list[dict] = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with gate:
+            started = time.perf_counter()
+            renditions = await render()
+            latencies.append((time.perf_counter() - started) * 1000.0)
+            if not outputs:
+                outputs.extend({"size": r["size"], "format": r["format"], "bytes": len(r["data"])} for r in renditions)
+
+    tick = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+    ImageService.shutdown()
+
+    return {
+        "pool_size": pool_size,
+        "images_per_second": round(requests / elapsed, 2),
+        "latency_ms": {
+            "p50": round(statistics.median(latencies), 1),
+            "p95": round(_percentile(latencies, 0.95), 1),
+            "max": round(max(latencies), 1),
+        },
+        "max_event_loop_stall_ms": round(stall * 1000.0, 1),
+        "renditions": outputs,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pools", default="0,1,2,4", help="pool sizes to compare (0 = inline)")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--quality", type=int, default=92)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(BACKEND_DIR))
+    data = _photo(args.width, args.height, args.quality)
+    report = {
+        "input_bytes": len(data),
+        "input_size": [args.width, args.height],
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "cpu_count": os.cpu_count(),
+        "runs": [],
+    }
+    for pool_size in (int(p) for p in args.pools.split(",")):
+        row = asyncio.run(_run(data, pool_size, args.requests, args.concurrency))
+        report["runs"].append(row)
+        print({k: v for k, v in row.items() if k != "renditions"}, file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Wall-clock time of uploading --files files through /api/upload/ one request
+at a time vs a single /api/upload/batch request at several concurrency
+limits, against the local Zipline stub from benchmarks._common (with
+--zipline-latency-ms per upload). Dedup is off so every file really goes out.
+
+    cd backend
+    python -m benchmarks.batch_upload --files 32 --file-kb 512 --concurrency 1,4,8,16
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks._common import _free_port, _peak_rss_mb, _start_zipline_stub
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def _configure_env(zipline_port: int, workdir: str) -> None:
+    # Must run before the app modules are imported: they read config at import time
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/batch_upload.db"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    os.environ["RATE_LIMIT_STORAGE_URI"] = "memory://"
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ["PAYMENT_SWEEP_INTERVAL"] = "0"
+    os.environ["ZIPLINE_API_URL"] = f"http://127.0.0.1:{zipline_port}"
+    os.environ["ZIPLINE_API_KEY"] = "bench"
+    os.environ["ZIPLINE_DEDUP_ENABLED"] = "false"
+    os.environ["ZIPLINE_BATCH_MAX_FILES"] = "1000"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+async def _run(args: argparse.Namespace) -> dict:
+    import httpx
+
+    import main
+    from services.zipline_service import ZiplineService
+
+    payloads = [(f"frame-{i:04d}.bin", os.urandom(args.file_kb * 1024)) for i in range(args.files)]
+    runs = []
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+            started = time.perf_counter()
+            failed = 0
+            for name, data in payloads:
+                response = await client.post("/api/upload/", files={"file": (name, data, "application/octet-stream")})
+                failed += response.status_code != 200
+            sequential = time.perf_counter() - started
+            runs.append({"mode": "sequential", "seconds": round(sequential, 3), "failed": failed})
+            print(runs[-1], file=sys.stderr)
+
+            for concurrency in (int(c) for c in args.concurrency.split(",")):
+                ZiplineService.BATCH_CONCURRENCY = concurrency
+                started = time.perf_counter()
+                response = await client.post(
+                    "/api/upload/batch",
+                    files=[("files", (name, data, "application/octet-stream")) for name, data in payloads],
+                )
+                elapsed = time.perf_counter() - started
+                body = response.json()
+                runs.append({
+                    "mode": "batch",
+                    "concurrency": concurrency,
+                    "seconds": round(elapsed, 3),
+                    "speedup": round(sequential / elapsed, 2),
+                    "failed": body.get("failed") if response.status_code == 200 else args.files,
+                    "peak_rss_mb": round(_peak_rss_mb(), 1),
+                })
+                print(runs[-1], file=sys.stderr)
+    return {"runs": runs}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=32)
+    parser.add_argument("--file-kb", type=int, default=512)
+    parser.add_argument("--concurrency", default="1,4,8,16", help="batch concurrency limits to compare")
+    parser.add_argument("--zipline-latency-ms", type=float, default=50.0)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        zipline_port = _free_port()
+        _configure_env(zipline_port, workdir)
+
+        async def run() -> dict:
+            stub = await _start_zipline_stub(zipline_port, args.zipline_latency_ms)
+            try:
+                return await _run(args)
+            finally:
+                await stub.cleanup()
+
+        results = asyncio.run(run())
+
+    report = {
+        "files": args.files,
+        "file_kb": args.file_kb,
+        "zipline_latency_ms": args.zipline_latency_ms,
+        **results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+Stress test for CreditService under concurrency.
+
+--threads workers fire --ops operations at --users users at once: single
+grants (add_credits), single deductions (deduct_credits, may be refused
+for lack of balance) and bulk batches (apply_ledger_entries, mixed grants
+and deductions over several users). Afterwards every user's balance must
+equal both the expected value (initial + accepted grants - accepted
+deductions) and the sum of their ledger, and never be negative.
+
+The same grants are also run through the old load-modify-save pattern
+(SELECT the user, add in Python, commit) as a baseline: its lost updates
+show that the check is sensitive to the race.
+
+Exits 1 if any check fails.
+
+    cd backend
+    python -m benchmarks.credit_ledger --threads 32 --ops 2000
+    python -m benchmarks.credit_ledger --database-url postgresql://scratch... --threads 64 --ops 20000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def _configure_env(args: argparse.Namespace, workdir: str) -> None:
+    # Must run before the app modules are imported: they read config at import time
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir}/credit_ledger.db"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ["DB_POOL_SIZE"] = str(args.threads)
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _create_users(prefix: str, count: int, credits: float) -> list[str]:
+    from database import SessionLocal
+    from ids import new_id
+    from models import User
+
+    ids = [new_id() for _ in range(count)]
+    db = SessionLocal()
+    try:
+        db.add_all(User(id=user_id, email=f"{prefix}-{user_id}@bench.local", credits=credits) for user_id in ids)
+        db.commit()
+    finally:
+        db.close()
+    return ids
+
+
+def _balances(user_ids: list[str]) -> dict[str, tuple[float, float]]:
+    """user_id -> (users.credits, ledger sum)"""
+    from sqlalchemy import case, func, select
+
+    from database import SessionLocal
+    from models import CreditTransaction, User
+
+    db = SessionLocal()
+    try:
+        credits = dict(db.execute(select(User.id, User.credits).where(User.id.in_(user_ids))).all())
+        signed = case((CreditTransaction.type == "DEDUCTION", -CreditTransaction.amount), else_=CreditTransaction.amount)
+        ledger = dict(
+            db.execute(
+                select(CreditTransaction.user_id, func.sum(signed))
+                .where(CreditTransaction.user_id.in_(user_ids))
+                .group_by(CreditTransaction.user_id)
+            ).all()
+        )
+        return {user_id: (float(credits[user_id] or 0.0), float(ledger.get(user_id) or 0.0)) for user_id in user_ids}
+    finally:
+        db.close()
+
+
+def _legacy_add_credits(db, user_id: str, coins: float) -> None:
+    """The pre-ledger add_credits: read, add in Python, write back"""
+    from ids import new_id
+    from models import CreditTransaction, User
+
+    user = db.query(User).filter(User.id == user_id).first()
+    user.credits = float(user.credits or 0.0) + coins
+    db.add(CreditTransaction(id=new_id(), user_id=user_id, type="ADDITION", amount=coins))
+    db.commit()
+
+
+def _run(args: argparse.Namespace, mode: str) -> dict:
+    from database import SessionLocal
+    from services.credit_service import CreditService
+
+    initial = args.initial_credits
+    user_ids = _create_users(mode, args.users, initial)
+    rng = random.Random(6)
+    # Whole-number amounts: float sums stay exact, so balances must match to the cent
+    ops = []
+    for _ in range(args.ops):
+        roll = rng.random()
+        if mode == "legacy" or roll < 0.45:
+            ops.append(("grant", rng.choice(user_ids), float(rng.randint(1, 20))))
+        elif roll < 0.9:
+            ops.append(("deduct", rng.choice(user_ids), float(rng.randint(1, 30))))
+        else:
+            entries = [
+                {
+                    "user_id": user_id,
+                    "amount": float(rng.randint(1, 10)),
+                    "type": rng.choice([CreditService.ADDITION, CreditService.DEDUCTION]),
+                }
+                for user_id in rng.sample(user_ids, min(4, len(user_ids)))
+            ]
+            ops.append(("batch", None, entries))
+
+    expected = {user_id: initial for user_id in user_ids}
+    counts = {"grant": 0, "deduct": 0, "deduct_refused": 0, "batch": 0, "batch_refused": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def apply(op) -> None:
+        kind, user_id, payload = op
+        db = SessionLocal()
+        try:
+            if kind == "grant":
+                if mode == "legacy":
+                    _legacy_add_credits(db, user_id, payload)
+                else:
+                    CreditService.add_credits(db, user_id, payload)
+                deltas = {user_id: payload}
+            elif kind == "deduct":
+                try:
+                    CreditService.deduct_credits(db, user_id, payload)
+                except ValueError:
+                    with lock:
+                        counts["deduct_refused"] += 1
+                    return
+                deltas = {user_id: -payload}
+            else:
+                try:
+                    CreditService.apply_ledger_entries(db, payload)
+                except ValueError:
+                    with lock:
+                        counts["batch_refused"] += 1
+                    return
+                deltas = {}
+                for entry in payload:
+                    sign = 1.0 if entry["type"] == CreditService.ADDITION else -1.0
+                    deltas[entry["user_id"]] = deltas.get(entry["user_id"], 0.0) + sign * entry["amount"]
+            with lock:
+                counts[kind] += 1
+                for delta_user, delta in deltas.items():
+                    expected[delta_user] += delta
+        except Exception:
+            db.rollback()
+            with lock:
+                counts["errors"] += 1
+        finally:
+            db.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(apply, ops))
+    elapsed = time.perf_counter() - started
+
+    balances = _balances(user_ids)
+    lost = sum(abs(balances[user_id][0] - expected[user_id]) for user_id in user_ids)
+    return {
+        "mode": mode,
+        "ops": len(ops),
+        "seconds": round(elapsed, 3),
+        "ops_per_s": round(len(ops) / elapsed, 1),
+        "counts": counts,
+        "balance_off_by": round(lost, 6),
+        "balance_exact": all(abs(balances[user_id][0] - expected[user_id]) < 1e-6 for user_id in user_ids),
+        "matches_ledger": all(
+            abs(credits - (initial + ledger)) < 1e-6 for credits, ledger in balances.values()
+        ),
+        "never_negative": all(credits >= 0 for credits, _ in balances.values()),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=10, help="few users = many concurrent writers per row")
+    parser.add_argument("--initial-credits", type=float, default=50.0)
+    parser.add_argument("--no-baseline", action="store_true", help="skip the load-modify-save baseline")
+    parser.add_argument("--database-url", help="scratch database (default: temporary SQLite)")
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        _configure_env(args, workdir)
+        from database import Base, engine
+        import models  # noqa: F401
+
+        Base.metadata.create_all(bind=engine)
+        ledger = _run(args, "ledger")
+        baseline = None if args.no_baseline else _run(args, "legacy")
+
+    checks = {
+        "balance_exact": ledger["balance_exact"],
+        "matches_ledger": ledger["matches_ledger"],
+        "never_negative": ledger["never_negative"],
+        "no_errors": ledger["counts"]["errors"] == 0,
+    }
+    report = {
+        "database": "sqlite" if not args.database_url else args.database_url.split(":", 1)[0],
+        "threads": args.threads,
+        "users": args.users,
+        "ledger": ledger,
+        "load_modify_save_baseline": baseline,
+        "checks": checks,
+        "ok": all(checks.values()),
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Event-loop stalls caused by database work in async routes.
+
+Drives POST /api/auth/google (user lookup, upsert, commit, refresh; AsyncSession
+via get_async_db) and, for comparison, a copy of the route as it was before
+the async session: the same `async def` with a sync Session from get_db, so
+every query and commit blocks the event loop. Both run in-process through
+httpx.ASGITransport with --concurrency requests in flight, half of them new
+users (INSERT) and half returning, pre-seeded ones (UPDATE), while the 10 ms ticker from
+benchmarks._loop measures how late the loop wakes up. The stall is
+what every other request on the worker waits behind.
+
+SQLite (default) answers in microseconds; pass --database-url to see network
+round trips to a real server add to the blocking numbers. Keep --concurrency
+below the sync pool (DB_POOL_SIZE + DB_MAX_OVERFLOW, 15 by default): past it
+the blocking route waits for a connection on the event loop thread, while
+connections only go back to the pool through that same loop, so every
+request hangs for the pool timeout.
+
+Exits 1 if the async route stalls the loop as long as the blocking one.
+
+    cd backend
+    python -m benchmarks.db_loop_stall --requests 1000 --concurrency 10
+    python -m benchmarks.db_loop_stall --database-url postgresql://scratch...
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks._common import _percentile
+from benchmarks._loop import _LoopStallTicker
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def _configure_env(args: argparse.Namespace, workdir: str) -> None:
+    # Must run before the app modules are imported: they read config at import time
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir}/db_loop_stall.db"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ["PAYMENT_SWEEP_INTERVAL"] = "0"
+    os.environ["ENV"] = "development"
+    os.environ["GOOGLE_CLIENT_ID"] = ""
+    # slowapi's own switch: the route allows 5 logins/minute per IP
+    os.environ["RATELIMIT_ENABLED"] = "false"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _mount_blocking_route(app) -> None:
+    """The google_auth user upsert as it was on the sync Session, inside an async def"""
+    from fastapi import Depends
+    from sqlalchemy.orm import Session
+
+    from api.routes.auth import GoogleAuthRequest
+    from database import get_db
+    from ids import new_id
+    from models import User
+
+    @app.post("/bench/blocking-google-auth")
+    async def blocking_google_auth(auth_request: GoogleAuthRequest, db: Session = Depends(get_db)):
+        user = db.query(User).filter(User.email == auth_request.email).first()
+        if user:
+            user.name = auth_request.name
+        else:
+            user = User(id=new_id(), email=auth_request.email, name=auth_request.name, credits=0.0)
+            db.add(user)
+        db.commit()
+        db.refresh(user)
+        return {"user_id": user.id, "email": user.email, "name": user.name, "credits": user.credits}
+
+
+def _seed_users(mode: str, count: int) -> None:
+    from database import SessionLocal
+    from ids import new_id
+    from models import User
+
+    db = SessionLocal()
+    try:
+        db.add_all(
+            User(id=new_id(), email=f"{mode}-returning-{i}@bench.local", name="Seeded", credits=0.0)
+            for i in range(count)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _drive(client, path: str, mode: str, requests: int, concurrency: int) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        # Even requests sign up a new user, odd ones log a seeded one back in
+        email = f"{mode}-new-{i}@bench.local" if i % 2 == 0 else f"{mode}-returning-{i // 2}@bench.local"
+        async with gate:
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, json={"token": "dev", "email": email, "name": f"User {i}"})
+                errors += response.status_code != 200
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000.0)
+
+    _seed_users(mode, requests // 2)
+    ticker = _LoopStallTicker()
+    ticker.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    worst = await ticker.stop()
+
+    latencies.sort()
+    stalls = sorted(ticker.stalls)
+    return {
+        "mode": mode,
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 50), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+        "loop_stall_p99_ms": round(_percentile(stalls, 99) * 1000.0, 2),
+        "loop_stall_max_ms": round(worst * 1000.0, 2),
+    }
+
+
+async def _run(args: argparse.Namespace) -> list[dict]:
+    import httpx
+
+    import main
+
+    _mount_blocking_route(main.app)
+    runs = []
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            # Warm both paths (pools, statement caches) outside the measurement
+            for path in ("/api/auth/google", "/bench/blocking-google-auth"):
+                await client.post(path, json={"token": "dev", "email": "warmup@bench.local", "name": "Warm"})
+            for mode, path in (("blocking_sync_session", "/bench/blocking-google-auth"),
+                               ("async_session", "/api/auth/google")):
+                runs.append(await _drive(client, path, mode, args.requests, args.concurrency))
+                print(runs[-1], file=sys.stderr)
+    return runs
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=10, help="stay below the sync pool size, see above")
+    parser.add_argument("--database-url", help="scratch database (default: temporary SQLite)")
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        _configure_env(args, workdir)
+        runs = asyncio.run(_run(args))
+
+    blocking, async_ = runs
+    checks = {
+        "no_errors": blocking["errors"] == 0 and async_["errors"] == 0,
+        "async_stalls_less": async_["loop_stall_p99_ms"] < blocking["loop_stall_p99_ms"],
+    }
+    report = {
+        "database": "sqlite" if not args.database_url else args.database_url.split(":", 1)[0],
+        "concurrency": args.concurrency,
+        "runs": runs,
+        "checks": checks,
+        "ok": all(checks.values()),
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""
+Checks GoogleTokenVerifier against a local stub of Google's certs endpoint
+(GOOGLE_CERTS_URL format: {kid: PEM certificate}) serving self-signed keys,
+with ID tokens signed locally:
+
+  cert_max_age     certs are fetched once, reused while the Cache-Control
+                   max-age lasts, and fetched again after it passes
+  unknown_kid      a token signed with a key the cached certs don't have yet
+                   (Google rotated early) forces exactly one refresh and
+                   verifies; a kid the endpoint doesn't serve either costs one
+                   refresh and is rejected
+  token_cache_exp  a verified token is served from the token cache until its
+                   `exp`, then dropped and rejected as expired, even though
+                   GOOGLE_TOKEN_CACHE_TTL is longer
+  latency          verify() p50/p95 with a cold cert cache (fetch on every
+                   call), warm certs (signature check only) and token cache hits
+
+Needs `cryptography` (to mint the self-signed certs). Exits 1 if any check fails.
+
+    cd backend
+    python -m benchmarks.google_auth --certs-latency-ms 50 --iterations 200
+"""
+import argparse
+import datetime
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from benchmarks._common import _free_port, _percentile
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+AUDIENCE = "bench-client-id.apps.googleusercontent.com"
+
+
+def _make_key(kid: str) -> tuple[str, str]:
+    """(private key PEM, self-signed certificate PEM)"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, kid)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    return private_pem, cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+class _CertsStub:
+    """Serves {kid: cert} with a configurable max-age and latency; counts requests"""
+
+    def __init__(self, port: int, latency_ms: float):
+        self.certs: dict[str, str] = {}
+        self.max_age = 3600
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                if latency_ms:
+                    time.sleep(latency_ms / 1000.0)
+                body = json.dumps(stub.certs).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Cache-Control", f"public, max-age={stub.max_age}, must-revalidate, no-transform")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _sign(private_pem: str, kid: str, subject: str, lifetime: float) -> str:
+    from google.auth import crypt, jwt
+
+    now = int(time.time())
+    payload = {
+        "iss": "https://accounts.google.com",
+        "aud": AUDIENCE,
+        "sub": subject,
+        "email": f"{subject}@bench.local",
+        "iat": now,
+        "exp": now + int(lifetime),
+    }
+    return jwt.encode(crypt.RSASigner.from_string(private_pem, kid), payload).decode()
+
+
+def _verifier(certs_url: str, token_cache_ttl: float = 300.0):
+    from services.google_auth_service import GoogleTokenVerifier
+
+    return GoogleTokenVerifier(
+        certs_url=certs_url,
+        default_certs_ttl=3600.0,
+        token_cache_ttl=token_cache_ttl,
+        token_cache_max_entries=10000,
+        http_timeout=5.0,
+    )
+
+
+def _rejected(verifier, token: str) -> bool:
+    try:
+        verifier.verify(token, AUDIENCE)
+    except ValueError:
+        return True
+    return False
+
+
+def _check_cert_max_age(stub: _CertsStub, url: str, key: tuple[str, str], max_age: int) -> dict:
+    stub.max_age = max_age
+    verifier = _verifier(url)
+    for i in range(5):
+        verifier.verify(_sign(key[0], "k1", f"age-{i}", 600), AUDIENCE)
+    fetches_within_max_age = verifier.cert_fetches
+    time.sleep(max_age + 0.2)
+    verifier.verify(_sign(key[0], "k1", "age-late", 600), AUDIENCE)
+    stub.max_age = 3600
+    return {
+        "max_age_s": max_age,
+        "fetches_within_max_age": fetches_within_max_age,
+        "fetches_after_max_age": verifier.cert_fetches,
+        "ok": fetches_within_max_age == 1 and verifier.cert_fetches == 2,
+    }
+
+
+def _check_unknown_kid(stub: _CertsStub, url: str, key1: tuple[str, str], key2: tuple[str, str]) -> dict:
+    stub.certs = {"k1": key1[1]}
+    verifier = _verifier(url)
+    verifier.verify(_sign(key1[0], "k1", "kid-a", 600), AUDIENCE)
+    # Google starts signing with k2 while our copy (max-age 3600) only has k1
+    stub.certs = {"k1": key1[1], "k2": key2[1]}
+    before = verifier.cert_fetches
+    rotated_ok = verifier.verify(_sign(key2[0], "k2", "kid-b", 600), AUDIENCE)["sub"] == "kid-b"
+    refreshes_for_rotation = verifier.cert_fetches - before
+    # Once refreshed, k2 tokens verify from the cached certs
+    verifier.verify(_sign(key2[0], "k2", "kid-c", 600), AUDIENCE)
+    refreshes_after = verifier.cert_fetches - before - refreshes_for_rotation
+
+    before = verifier.cert_fetches
+    bogus_rejected = _rejected(verifier, _sign(key2[0], "k9", "kid-d", 600))
+    refreshes_for_bogus = verifier.cert_fetches - before
+    stub.certs = {"k1": key1[1]}
+    return {
+        "rotated_key_verified": rotated_ok,
+        "refreshes_for_rotation": refreshes_for_rotation,
+        "refreshes_after_rotation": refreshes_after,
+        "unknown_kid_rejected": bogus_rejected,
+        "refreshes_for_unknown_kid": refreshes_for_bogus,
+        "ok": rotated_ok and refreshes_for_rotation == 1 and refreshes_after == 0
+        and bogus_rejected and refreshes_for_bogus == 1,
+    }
+
+
+def _check_token_cache_exp(url: str, key: tuple[str, str], lifetime: int) -> dict:
+    verifier = _verifier(url, token_cache_ttl=300.0)
+    token = _sign(key[0], "k1", "exp-a", lifetime)
+    verifier.verify(token, AUDIENCE)
+    verifier.verify(token, AUDIENCE)
+    hits_before_exp = verifier.token_cache.hits
+    time.sleep(lifetime + 1.1)
+    rejected = _rejected(verifier, token)
+    return {
+        "token_lifetime_s": lifetime,
+        "cache_hits_before_exp": hits_before_exp,
+        "rejected_after_exp": rejected,
+        "cache_size_after_exp": verifier.token_cache.stats()["size"],
+        "ok": hits_before_exp == 1 and rejected and verifier.token_cache.stats()["size"] == 0,
+    }
+
+
+def _timed(samples: list[float], fn) -> None:
+    started = time.perf_counter()
+    fn()
+    samples.append((time.perf_counter() - started) * 1000.0)
+
+
+def _summary(samples: list[float]) -> dict:
+    samples.sort()
+    return {
+        "p50_ms": round(_percentile(samples, 50), 3),
+        "p95_ms": round(_percentile(samples, 95), 3),
+    }
+
+
+def _latency(url: str, key: tuple[str, str], iterations: int) -> dict:
+    tokens = [_sign(key[0], "k1", f"lat-{i}", 600) for i in range(iterations)]
+
+    cold = []
+    for token in tokens:
+        verifier = _verifier(url)
+        _timed(cold, lambda: verifier.verify(token, AUDIENCE))
+
+    verifier = _verifier(url)
+    verifier.get_certs()
+    warm = []
+    for token in tokens:
+        _timed(warm, lambda: verifier.verify(token, AUDIENCE))
+
+    cached = []
+    for token in tokens:
+        _timed(cached, lambda: verifier.verify(token, AUDIENCE))
+
+    return {"cold_certs": _summary(cold), "warm_certs": _summary(warm), "token_cache_hit": _summary(cached)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--certs-latency-ms", type=float, default=50.0, help="stub certs endpoint latency")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--max-age", type=int, default=1, help="max-age (s) served in the cert expiry check")
+    parser.add_argument("--token-lifetime", type=int, default=2, help="exp - iat (s) in the token expiry check")
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(BACKEND_DIR))
+    key1, key2 = _make_key("k1"), _make_key("k2")
+    port = _free_port()
+    stub = _CertsStub(port, args.certs_latency_ms)
+    stub.certs = {"k1": key1[1]}
+    url = f"http://127.0.0.1:{port}/oauth2/v1/certs"
+    try:
+        cert_max_age = _check_cert_max_age(stub, url, key1, args.max_age)
+        unknown_kid = _check_unknown_kid(stub, url, key1, key2)
+        token_cache_exp = _check_token_cache_exp(url, key1, args.token_lifetime)
+        latency = _latency(url, key1, args.iterations)
+    finally:
+        stub.close()
+
+    checks = {
+        "cert_max_age": cert_max_age["ok"],
+        "unknown_kid": unknown_kid["ok"],
+        "token_cache_exp": token_cache_exp["ok"],
+        "cached_faster_than_cold": latency["token_cache_hit"]["p50_ms"] < latency["cold_certs"]["p50_ms"],
+    }
+    report = {
+        "certs_latency_ms": args.certs_latency_ms,
+        "iterations": args.iterations,
+        "cert_max_age": cert_max_age,
+        "unknown_kid": unknown_kid,
+        "token_cache_exp": token_cache_exp,
+        "latency": latency,
+        "stub_requests": stub.requests,
+        "checks": checks,
+        "ok": all(checks.values()),
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
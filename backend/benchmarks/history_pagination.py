@@ -0,0 +1,142 @@
+"""
+Page latency vs page depth for the history endpoints: keyset (HistoryService)
+vs the OFFSET queries support tools used before.
+
+Builds a synthetic ledger where one heavy user owns --heavy-rows credit
+transactions among --other-rows from other users, then times a page at
+increasing depths both ways (median of --repeat runs).
+
+    cd backend
+    python -m benchmarks.history_pagination
+    # A 1M-row user, paged 800k rows deep (under a minute on SQLite)
+    python -m benchmarks.history_pagination --heavy-rows 1000000 --other-rows 200000 --depths 0,10,100,1000,10000,40000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+INSERT_CHUNK = 20000
+
+
+def _configure_env(args: argparse.Namespace, workdir: str) -> None:
+    # Must run before the app modules are imported: they read config at import time
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir}/history.db"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["METRICS_ENABLED"] = "false"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _fill(engine, heavy_user: str, heavy_rows: int, other_rows: int) -> None:
+    from ids import new_id
+    from models import CreditTransaction
+
+    start = datetime.now(timezone.utc) - timedelta(days=365)
+    total = heavy_rows + other_rows
+    batch = []
+    for i in range(total):
+        # Spread exactly heavy_rows of the heavy user's rows among everyone else's
+        heavy = (i * heavy_rows) // total != ((i + 1) * heavy_rows) // total
+        batch.append({
+            "id": new_id(),
+            "user_id": heavy_user if heavy else f"user-{i % 10000}",
+            "type": "ADDITION" if i % 3 else "DEDUCTION",
+            "amount": 20.0,
+            "created_at": start + timedelta(seconds=i * 10),
+        })
+        if len(batch) == INSERT_CHUNK:
+            with engine.begin() as conn:
+                conn.execute(CreditTransaction.__table__.insert(), batch)
+            batch = []
+    if batch:
+        with engine.begin() as conn:
+            conn.execute(CreditTransaction.__table__.insert(), batch)
+
+
+def _time(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return round(statistics.median(samples), 3)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="sync DB URL (default: fresh SQLite file in a temp dir)")
+    parser.add_argument("--heavy-rows", type=int, default=100_000)
+    parser.add_argument("--other-rows", type=int, default=20_000)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--depths", default="0,10,100,1000,4000", help="page numbers to time")
+    parser.add_argument("--repeat", type=int, default=15)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        _configure_env(args, workdir)
+        from sqlalchemy import select
+        from sqlalchemy.orm import Session
+
+        from database import Base, engine, ensure_indexes
+        from models import CreditTransaction
+        from services.history_service import HistoryService
+
+        Base.metadata.create_all(bind=engine)
+        ensure_indexes(engine)
+        heavy_user = "heavy-user"
+
+        started = time.perf_counter()
+        _fill(engine, heavy_user, args.heavy_rows, args.other_rows)
+        report = {
+            "heavy_rows": args.heavy_rows,
+            "other_rows": args.other_rows,
+            "page_size": args.page_size,
+            "fill_seconds": round(time.perf_counter() - started, 1),
+            "pages": [],
+        }
+
+        ordered = (
+            select(CreditTransaction)
+            .where(CreditTransaction.user_id == heavy_user)
+            .order_by(CreditTransaction.created_at.desc(), CreditTransaction.id.desc())
+        )
+        with Session(engine) as db:
+            for depth in (int(d) for d in args.depths.split(",")):
+                offset = depth * args.page_size
+                if offset >= args.heavy_rows:
+                    break
+                cursor = None
+                if offset:
+                    # Cursor a client would hold after `depth` pages (built untimed)
+                    last = db.execute(ordered.offset(offset - 1).limit(1)).scalars().one()
+                    cursor = HistoryService._encode_cursor(last.created_at, last.id)
+
+                def keyset():
+                    db.expunge_all()
+                    HistoryService.list_credit_transactions(db, heavy_user, args.page_size, cursor)
+
+                def offset_query():
+                    db.expunge_all()
+                    db.execute(ordered.offset(offset).limit(args.page_size + 1)).scalars().all()
+
+                row = {"page": depth, "keyset_ms": _time(keyset, args.repeat), "offset_ms": _time(offset_query, args.repeat)}
+                report["pages"].append(row)
+                print(row, file=sys.stderr)
+        engine.dispose()
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+Insert throughput and primary-key index size: uuid4 vs UUIDv7 (ids.new_id).
+
+Inserts --rows credit_transactions-shaped rows per key type into a scratch
+table, --batch rows per transaction, and reports rows/s (overall and for the
+last 10% of rows, where random keys hurt most), plus the size of the PK
+index (SQLite dbstat / Postgres pg_relation_size).
+
+    cd backend
+    python -m benchmarks.id_locality
+    # Where the random-key slowdown shows (a few minutes on SQLite)
+    python -m benchmarks.id_locality --rows 3000000
+    python -m benchmarks.id_locality --database-url postgresql://scratch... --rows 3000000
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def _table(metadata, name: str):
+    from sqlalchemy import Column, DateTime, Float, String, Table, func
+
+    return Table(
+        name,
+        metadata,
+        Column("id", String, primary_key=True),
+        Column("user_id", String, nullable=False),
+        Column("type", String, nullable=False),
+        Column("amount", Float, nullable=False),
+        Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    )
+
+
+def _index_bytes(engine, table) -> int | None:
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            # Text primary keys live in sqlite_autoindex_<table>_1
+            return conn.execute(
+                text("SELECT SUM(pgsize) FROM dbstat WHERE name = :name"),
+                {"name": f"sqlite_autoindex_{table.name}_1"},
+            ).scalar()
+        if engine.dialect.name == "postgresql":
+            return conn.execute(text(f"SELECT pg_relation_size('{table.name}_pkey')")).scalar()
+    return None
+
+
+def _run(engine, table, make_id, rows: int, batch: int) -> dict:
+    table.drop(engine, checkfirst=True)
+    table.create(engine)
+
+    started = time.perf_counter()
+    tail_from = int(rows * 0.9)
+    tail_started = None
+    for start in range(0, rows, batch):
+        if tail_started is None and start >= tail_from:
+            tail_started = time.perf_counter()
+        values = [
+            {"id": make_id(), "user_id": f"user-{i % 5000}", "type": "ADDITION", "amount": 20.0}
+            for i in range(start, min(rows, start + batch))
+        ]
+        with engine.begin() as conn:
+            conn.execute(table.insert(), values)
+    finished = time.perf_counter()
+
+    size = _index_bytes(engine, table)
+    table.drop(engine)
+    tail_rows = rows - tail_from
+    return {
+        "rows_per_second": round(rows / (finished - started), 1),
+        "tail_rows_per_second": round(tail_rows / (finished - tail_started), 1) if tail_started else None,
+        "pk_index_mb": round(size / 1024 ** 2, 1) if size else None,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="sync DB URL (default: fresh SQLite file in a temp dir)")
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--batch", type=int, default=10_000)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        sys.path.insert(0, str(BACKEND_DIR))
+        from sqlalchemy import MetaData, create_engine
+
+        from ids import new_id
+
+        engine = create_engine(args.database_url or f"sqlite:///{workdir}/ids.db")
+        metadata = MetaData()
+        report = {"rows": args.rows, "database": engine.dialect.name}
+        for name, make_id in (("uuid4", lambda: str(uuid.uuid4())), ("uuid7", new_id)):
+            report[name] = _run(engine, _table(metadata, f"bench_ids_{name}"), make_id, args.rows, args.batch)
+            print(name, report[name], file=sys.stderr)
+        engine.dispose()
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
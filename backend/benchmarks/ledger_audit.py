@@ -0,0 +1,155 @@
+"""
+Time and memory of LedgerAuditService on a synthetic ledger.
+
+Fills --rows credit transactions over --users users (balances consistent
+except --drift users), then runs a full audit, a snapshot, and an
+incremental audit after --new-rows more transactions. Peak RSS is sampled
+before and after each phase; a constant-memory audit leaves it flat.
+
+    cd backend
+    python -m benchmarks.ledger_audit
+    # Where constant memory matters (tens of minutes on SQLite)
+    python -m benchmarks.ledger_audit --rows 20000000 --users 200000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from benchmarks._common import _peak_rss_mb
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+INSERT_CHUNK = 20000
+
+
+def _configure_env(args: argparse.Namespace, workdir: str) -> None:
+    # Must run before the app modules are imported: they read config at import time
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir}/ledger.db"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["METRICS_ENABLED"] = "false"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _fill(engine, user_ids: list, rows: int, start: datetime, step: timedelta, rng: random.Random) -> dict:
+    from ids import new_id
+    from models import CreditTransaction
+
+    deltas: dict[str, float] = {}
+    batch = []
+    for i in range(rows):
+        user_id = user_ids[rng.randrange(len(user_ids))]
+        deduction = i % 4 == 0
+        amount = float(rng.choice((5, 10, 20, 50)))
+        deltas[user_id] = deltas.get(user_id, 0.0) + (-amount if deduction else amount)
+        batch.append({
+            "id": new_id(),
+            "user_id": user_id,
+            "type": "DEDUCTION" if deduction else "ADDITION",
+            "amount": amount,
+            "created_at": start + step * i,
+        })
+        if len(batch) == INSERT_CHUNK:
+            with engine.begin() as conn:
+                conn.execute(CreditTransaction.__table__.insert(), batch)
+            batch = []
+    if batch:
+        with engine.begin() as conn:
+            conn.execute(CreditTransaction.__table__.insert(), batch)
+    return deltas
+
+
+def _apply_credits(engine, deltas: dict) -> None:
+    from sqlalchemy import bindparam, update
+
+    from models import User
+
+    users = User.__table__
+    items = [{"b_id": user_id, "b_delta": delta} for user_id, delta in deltas.items()]
+    with engine.begin() as conn:
+        for i in range(0, len(items), INSERT_CHUNK):
+            conn.execute(
+                update(users).where(users.c.id == bindparam("b_id")).values(credits=users.c.credits + bindparam("b_delta")),
+                items[i:i + INSERT_CHUNK],
+            )
+
+
+def _phase(engine, name: str, **kwargs) -> dict:
+    from sqlalchemy.orm import Session
+
+    from services.ledger_audit import LedgerAuditService
+
+    rss_before = round(_peak_rss_mb(), 1)
+    with Session(engine) as db:
+        report = LedgerAuditService.audit(db, **kwargs)
+    summary = {k: v for k, v in report.items() if k != "drift"}
+    summary["rows_per_second"] = round(report["ledger_rows"] / report["seconds"], 1) if report["seconds"] else None
+    summary["peak_rss_mb"] = {"before": rss_before, "after": round(_peak_rss_mb(), 1)}
+    print(name, summary, file=sys.stderr)
+    return summary
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="sync DB URL (default: fresh SQLite file in a temp dir)")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--new-rows", type=int, default=10_000)
+    parser.add_argument("--drift", type=int, default=25, help="users whose credits are corrupted")
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    rng = random.Random(19)
+    with tempfile.TemporaryDirectory() as workdir:
+        _configure_env(args, workdir)
+        from sqlalchemy import update
+
+        from database import Base, engine, ensure_indexes
+        from ids import new_id
+        from models import User
+
+        Base.metadata.create_all(bind=engine)
+        ensure_indexes(engine)
+
+        started = time.perf_counter()
+        user_ids = [new_id() for _ in range(args.users)]
+        with engine.begin() as conn:
+            for i in range(0, len(user_ids), INSERT_CHUNK):
+                conn.execute(User.__table__.insert(), [
+                    {"id": uid, "email": f"{uid}@bench.local", "name": "Bench", "credits": 0.0}
+                    for uid in user_ids[i:i + INSERT_CHUNK]
+                ])
+        now = datetime.now(timezone.utc)
+        history = timedelta(days=365)
+        _apply_credits(engine, _fill(engine, user_ids, args.rows, now - history, history / max(args.rows, 1), rng))
+        drifted = rng.sample(user_ids, min(args.drift, len(user_ids)))
+        with engine.begin() as conn:
+            conn.execute(update(User).where(User.id.in_(drifted)).values(credits=User.credits + 1.0))
+        report = {
+            "rows": args.rows,
+            "users": args.users,
+            "drift_injected": len(drifted),
+            "fill_seconds": round(time.perf_counter() - started, 1),
+        }
+
+        report["full_audit"] = _phase(engine, "full_audit", full=True, chunk_size=args.chunk_size)
+        report["snapshot"] = _phase(engine, "snapshot", snapshot=True, chunk_size=args.chunk_size, lag_seconds=0)
+        # New activity after the watermark
+        _apply_credits(engine, _fill(engine, user_ids, args.new_rows, datetime.now(timezone.utc), timedelta(milliseconds=1), rng))
+        report["incremental_audit"] = _phase(engine, "incremental_audit", chunk_size=args.chunk_size)
+        engine.dispose()
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""
+Load test / latency benchmark for the RenderTool API.
+
+Boots `main.app` in-process against SQLite (default) or --database-url, with
+a local Zipline stub and a fake bank webhook sender, then drives:
+  auth (POST /api/auth/google), create-order, status polling, single and
+  batched webhook bursts, uploads.
+Run once with and once without --no-metrics to measure the instrumentation
+overhead (budget: p50 within 50 µs).
+For each endpoint it reports p50/p95/p99 latency, throughput, DB queries per
+request and peak RSS, and writes a JSON baseline that later runs can be
+compared against.
+
+    cd backend
+    python -m benchmarks.loadtest --requests 500 --concurrency 25 --out baseline.json
+    python -m benchmarks.loadtest --compare baseline.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks._common import _free_port, _peak_rss_mb, _percentile, _start_zipline_stub
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Per-request SQL statement counter (set by the runner, bumped by engine events)
+_query_counter: contextvars.ContextVar[list | None] = contextvars.ContextVar("loadtest_queries", default=None)
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def _configure_env(args: argparse.Namespace, zipline_port: int, workdir: str) -> None:
+    # Must run before the app modules are imported: they read config at import time
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir}/loadtest.db"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["ENV"] = "development"
+    os.environ["GOOGLE_CLIENT_ID"] = ""
+    os.environ["PAYMENT_WEBHOOK_SECRET"] = ""
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    os.environ["RATE_LIMIT_STORAGE_URI"] = "memory://"
+    os.environ["METRICS_ENABLED"] = "false" if args.no_metrics else "true"
+    os.environ["ZIPLINE_API_URL"] = f"http://127.0.0.1:{zipline_port}"
+    os.environ["ZIPLINE_API_KEY"] = "loadtest"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _install_query_counter() -> None:
+    from sqlalchemy import event
+
+    from database import async_engine, engine
+
+    def count(*_args, **_kwargs):
+        counter = _query_counter.get()
+        if counter is not None:
+            counter[0] += 1
+
+    for target in (engine, async_engine.sync_engine):
+        event.listen(target, "before_cursor_execute", count)
+
+
+async def _run_endpoint(total: int, concurrency: int, send) -> dict:
+    """
+    Calls `send(i)` (an awaitable returning an httpx.Response) `total` times,
+    at most `concurrency` at once.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    queries: list[int] = []
+    errors = 0
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            counter = [0]
+            _query_counter.set(counter)
+            started = time.perf_counter()
+            try:
+                response = await send(i)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000.0)
+            queries.append(counter[0])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "concurrency": concurrency,
+        "p50_ms": round(_percentile(latencies, 50), 3),
+        "p95_ms": round(_percentile(latencies, 95), 3),
+        "p99_ms": round(_percentile(latencies, 99), 3),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "queries_per_request": round(sum(queries) / len(queries), 3) if queries else 0.0,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+async def _run(args: argparse.Namespace) -> dict:
+    import httpx
+
+    import main
+    from services import payment_cache
+
+    _install_query_counter()
+    n, c = args.requests, args.concurrency
+    package = {"coins": 20.0, "amount_vnd": 52000.0}
+    results: dict[str, dict] = {}
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=60) as client:
+            user_ids: list[str] = []
+            transaction_ids: list[str] = []
+            single_ids: list[str] = []
+            batch_ids: list[str] = []
+
+            async def auth(i: int):
+                response = await client.post(
+                    "/api/auth/google",
+                    json={"token": "dev", "email": f"load{i}@test.local", "name": f"Load {i}"},
+                )
+                if response.status_code == 200:
+                    user_ids.append(response.json()["user_id"])
+                return response
+
+            async def create_order(i: int):
+                response = await client.post(
+                    "/api/payments/create-order",
+                    json={"user_id": user_ids[i % len(user_ids)], **package},
+                )
+                if response.status_code == 200:
+                    transaction_ids.append(response.json()["transaction_id"])
+                return response
+
+            async def status(i: int):
+                return await client.get(f"/api/payments/{transaction_ids[i % len(transaction_ids)]}/status")
+
+            async def webhook(i: int):
+                return await client.post(
+                    "/api/payments/webhook",
+                    json={"transaction_id": single_ids[i], "status": "success", "amount": package["amount_vnd"]},
+                )
+
+            async def webhook_batch(i: int):
+                chunk = batch_ids[i * args.batch_size:(i + 1) * args.batch_size]
+                return await client.post(
+                    "/api/payments/webhook/batch",
+                    json=[{"transaction_id": t, "status": "success", "amount": package["amount_vnd"]} for t in chunk],
+                )
+
+            async def upload(i: int):
+                return await client.post(
+                    "/api/upload/",
+                    files={"file": (f"load-{i}.bin", os.urandom(args.upload_kb * 1024), "application/octet-stream")},
+                )
+
+            results["auth_google"] = await _run_endpoint(n, c, auth)
+            results["create_order"] = await _run_endpoint(n, c, create_order)
+            before = payment_cache.payment_status_cache.stats()
+            results["status_poll"] = await _run_endpoint(n * args.polls_per_order, c, status)
+            after = payment_cache.payment_status_cache.stats()
+            results["status_poll"]["cache_hits"] = after["hits"] - before["hits"]
+            results["status_poll"]["cache_misses"] = after["misses"] - before["misses"]
+
+            # Fake bank: half the orders settle one notification at a time, half in batches
+            half = len(transaction_ids) // 2
+            single_ids.extend(transaction_ids[:half])
+            batch_ids.extend(transaction_ids[half:])
+            results["webhook"] = await _run_endpoint(len(single_ids), c, webhook)
+            batches = (len(batch_ids) + args.batch_size - 1) // args.batch_size
+            results["webhook_batch"] = await _run_endpoint(batches, c, webhook_batch)
+            results["webhook_batch"]["notifications_per_second"] = round(
+                results["webhook_batch"]["throughput_rps"] * args.batch_size, 2
+            )
+
+            results["upload"] = await _run_endpoint(args.uploads, c, upload)
+
+    return results
+
+
+def _compare(baseline: dict, current: dict, max_regression: float) -> bool:
+    """
+    Prints a per-endpoint comparison. Returns False if any endpoint's p95
+    grew, or throughput dropped, by more than max_regression.
+    """
+    ok = True
+    print(f"\n{'endpoint':<16}{'p95 base':>12}{'p95 now':>12}{'rps base':>12}{'rps now':>12}  verdict")
+    for name, now in current["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(name)
+        if not base:
+            print(f"{name:<16}{'-':>12}{now['p95_ms']:>12}{'-':>12}{now['throughput_rps']:>12}  new")
+            continue
+        slower = base["p95_ms"] and (now["p95_ms"] - base["p95_ms"]) / base["p95_ms"] > max_regression
+        fewer = base["throughput_rps"] and (base["throughput_rps"] - now["throughput_rps"]) / base["throughput_rps"] > max_regression
+        verdict = "REGRESSION" if (slower or fewer) else "ok"
+        ok = ok and verdict == "ok"
+        print(
+            f"{name:<16}{base['p95_ms']:>12}{now['p95_ms']:>12}"
+            f"{base['throughput_rps']:>12}{now['throughput_rps']:>12}  {verdict}"
+        )
+    return ok
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="sync DB URL (default: fresh SQLite file in a temp dir)")
+    parser.add_argument("--requests", type=int, default=200, help="auth / create-order requests")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--polls-per-order", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=50, help="notifications per /webhook/batch call")
+    parser.add_argument("--uploads", type=int, default=50)
+    parser.add_argument("--upload-kb", type=int, default=256)
+    parser.add_argument("--zipline-latency-ms", type=float, default=5.0)
+    parser.add_argument("--no-metrics", action="store_true", help="disable /metrics instrumentation (overhead check)")
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed p95/throughput change (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        zipline_port = _free_port()
+        _configure_env(args, zipline_port, workdir)
+
+        async def run() -> dict:
+            stub = await _start_zipline_stub(zipline_port, args.zipline_latency_ms)
+            try:
+                return await _run(args)
+            finally:
+                await stub.cleanup()
+
+        endpoints = asyncio.run(run())
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": int(time.time()),
+            "database": "sqlite" if not args.database_url else args.database_url.split("://", 1)[0],
+            "python": sys.version.split()[0],
+            "args": {k: v for k, v in vars(args).items() if k not in {"out", "compare", "database_url"}},
+        },
+        "endpoints": endpoints,
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        if not _compare(baseline, report, args.max_regression):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
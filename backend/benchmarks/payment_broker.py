@@ -0,0 +1,233 @@
+"""
+Memory and wake-up behaviour of PaymentStatusBroker waiters.
+
+Starts the app under uvicorn in a subprocess (SSE needs a real streaming
+server) with PAYMENT_STATUS_MAX_WAITERS = --waiters, creates --orders
+payment orders, then:
+
+  open      --waiters clients, half long-polling GET /{id}/wait and half on
+            GET /{id}/events (SSE), spread over the orders; server RSS is
+            read from /proc before and after, giving RSS per open waiter
+  overflow  --overflow more of each while the broker is full: long polls must
+            get 503 and SSE streams an `event: error`, both without waiting
+  wake      one webhook per order settles it; every waiter must see
+            `completed`, timed from its order's webhook
+  drain     server RSS once every client is gone
+
+Linux only (reads /proc/<pid>/status). Exits 1 if any check fails.
+
+    cd backend
+    python -m benchmarks.payment_broker --waiters 2000 --orders 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks._common import _free_port, _percentile
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+PACKAGE = {"coins": 20.0, "amount_vnd": 52000.0}
+
+
+def _configure_env(args: argparse.Namespace, workdir: str) -> None:
+    # Inherited by the server process, which imports the app after this is set
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/payment_broker.db"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ["PAYMENT_SWEEP_INTERVAL"] = "0"
+    os.environ["PAYMENT_WEBHOOK_SECRET"] = ""
+    # slowapi's own switch: every client comes from 127.0.0.1
+    os.environ["RATELIMIT_ENABLED"] = "false"
+    os.environ["PAYMENT_STATUS_MAX_WAITERS"] = str(args.waiters)
+    os.environ["PAYMENT_STATUS_WAIT_MAX"] = "300"
+    os.environ["PAYMENT_STATUS_SSE_HEARTBEAT"] = "300"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024.0
+    return 0.0
+
+
+def _start_server(port: int) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--limit-concurrency", "100000"],
+        cwd=BACKEND_DIR,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("server did not start")
+
+
+async def _long_poll(session, base: str, transaction_id: str) -> dict:
+    started = time.perf_counter()
+    async with session.get(f"{base}/api/payments/{transaction_id}/wait", params={"timeout": "300"}) as response:
+        body = await response.json()
+        return {"status": response.status, "state": body.get("status"), "at": time.perf_counter(),
+                "seconds": time.perf_counter() - started}
+
+
+async def _sse(session, base: str, transaction_id: str, subscribed: asyncio.Event | None = None) -> dict:
+    """Reads events until `completed` or `error`; sets `subscribed` after the first one"""
+    started = time.perf_counter()
+    async with session.get(f"{base}/api/payments/{transaction_id}/events") as response:
+        event = None
+        async for raw in response.content:
+            line = raw.decode().strip()
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event == "error":
+                    return {"status": response.status, "state": "error", "at": time.perf_counter(),
+                            "seconds": time.perf_counter() - started}
+                if subscribed is not None and not subscribed.is_set():
+                    subscribed.set()
+                if data.get("status") == "completed":
+                    return {"status": response.status, "state": "completed", "at": time.perf_counter(),
+                            "seconds": time.perf_counter() - started}
+        return {"status": response.status, "state": "closed", "at": time.perf_counter(),
+                "seconds": time.perf_counter() - started}
+
+
+async def _run(args: argparse.Namespace, port: int, pid: int) -> dict:
+    import aiohttp
+
+    base = f"http://127.0.0.1:{port}"
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=None)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        orders = []
+        for _ in range(args.orders):
+            async with session.post(f"{base}/api/payments/create-order", json=PACKAGE) as response:
+                orders.append((await response.json())["transaction_id"])
+        # Warm both handlers once so imports and pools don't count as waiter memory
+        async with session.get(f"{base}/api/payments/{orders[0]}/wait", params={"timeout": "0"}) as response:
+            await response.read()
+        await asyncio.sleep(0.5)
+        rss_idle = _rss_mb(pid)
+
+        # open
+        waiters = []
+        subscribed = []
+        for i in range(args.waiters):
+            transaction_id = orders[i % len(orders)]
+            if i % 2 == 0:
+                waiters.append((transaction_id, asyncio.create_task(_long_poll(session, base, transaction_id))))
+            else:
+                event = asyncio.Event()
+                subscribed.append(event)
+                waiters.append((transaction_id, asyncio.create_task(_sse(session, base, transaction_id, event))))
+        started = time.perf_counter()
+        await asyncio.gather(*(event.wait() for event in subscribed))
+        # Long polls have no first byte to wait for; give the stragglers a moment to subscribe
+        await asyncio.sleep(args.settle_s)
+        open_seconds = time.perf_counter() - started
+        rss_open = _rss_mb(pid)
+
+        # overflow
+        transaction_id = orders[0]
+        overflow_started = time.perf_counter()
+        extra = await asyncio.gather(
+            *(_long_poll(session, base, transaction_id) for _ in range(args.overflow)),
+            *(_sse(session, base, transaction_id) for _ in range(args.overflow)),
+        )
+        overflow = {
+            "long_poll_503": sum(1 for r in extra[:args.overflow] if r["status"] == 503),
+            "sse_error_events": sum(1 for r in extra[args.overflow:] if r["state"] == "error"),
+            "slowest_rejection_ms": round(max(r["seconds"] for r in extra) * 1000.0, 1),
+            "seconds": round(time.perf_counter() - overflow_started, 3),
+        }
+        all_pending = not any(task.done() for _, task in waiters)
+
+        # wake
+        settled_at = {}
+        for transaction_id in orders:
+            settled_at[transaction_id] = time.perf_counter()
+            async with session.post(
+                f"{base}/api/payments/webhook",
+                json={"transaction_id": transaction_id, "status": "success", "amount": PACKAGE["amount_vnd"]},
+            ) as response:
+                await response.read()
+        results = await asyncio.gather(*(task for _, task in waiters))
+        wake_ms = sorted(
+            (result["at"] - settled_at[transaction_id]) * 1000.0
+            for (transaction_id, _), result in zip(waiters, results)
+        )
+        completed = sum(1 for result in results if result["state"] == "completed")
+
+    await asyncio.sleep(0.5)
+    rss_drained = _rss_mb(pid)
+    return {
+        "waiters": args.waiters,
+        "orders": args.orders,
+        "open_seconds": round(open_seconds, 2),
+        "rss_idle_mb": round(rss_idle, 1),
+        "rss_open_mb": round(rss_open, 1),
+        "rss_per_waiter_kb": round((rss_open - rss_idle) * 1024.0 / args.waiters, 1),
+        "rss_drained_mb": round(rss_drained, 1),
+        "waiters_held_while_full": all_pending,
+        "overflow": overflow,
+        "wake": {
+            "completed": completed,
+            "p50_ms": round(_percentile(wake_ms, 50), 1),
+            "p99_ms": round(_percentile(wake_ms, 99), 1),
+            "max_ms": round(wake_ms[-1], 1),
+        },
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--waiters", type=int, default=2000, help="open waiters, also PAYMENT_STATUS_MAX_WAITERS")
+    parser.add_argument("--orders", type=int, default=50)
+    parser.add_argument("--overflow", type=int, default=20, help="extra long polls and SSE clients once full")
+    parser.add_argument("--settle-s", type=float, default=2.0)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        _configure_env(args, workdir)
+        port = _free_port()
+        process = _start_server(port)
+        try:
+            report = asyncio.run(_run(args, port, process.pid))
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    checks = {
+        "overflow_rejected": report["overflow"]["long_poll_503"] == args.overflow
+        and report["overflow"]["sse_error_events"] == args.overflow,
+        "existing_waiters_kept": report["waiters_held_while_full"],
+        "all_woken": report["wake"]["completed"] == args.waiters,
+    }
+    report["checks"] = checks
+    report["ok"] = all(checks.values())
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+Benchmark for PaymentExpiryService on a large payments table.
+
+Fills `payments` with --rows orders (default 50k; --stale-ratio of them are
+old PENDING orders, the rest recent PENDING or settled), then runs the keyset
+sweep with and without ix_payments_status_created_at and reports rows/s,
+per-batch latency and the batch query plan.
+
+    cd backend
+    python -m benchmarks.payment_sweep
+    # The table size the index matters at (several minutes on SQLite)
+    python -m benchmarks.payment_sweep --rows 2000000 --batch-size 1000
+    python -m benchmarks.payment_sweep --database-url postgresql://scratch... --rows 5000000
+
+Use a scratch database with --database-url: the sweep expires every stale
+PENDING payment in it, not only the generated ones.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+INSERT_CHUNK = 20000
+
+
+def _configure_env(args: argparse.Namespace, workdir: str) -> None:
+    # Must run before the app modules are imported: they read config at import time
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir}/sweep.db"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["METRICS_ENABLED"] = "false"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _fill(engine, rows: int, stale_ratio: float, ttl: float) -> None:
+    from models import Payment
+
+    table = Payment.__table__
+    now = datetime.now(timezone.utc)
+    rng = random.Random(42)
+    with engine.begin() as conn:
+        conn.execute(table.delete().where(table.c.id.like("bench-%")))
+    for start in range(0, rows, INSERT_CHUNK):
+        batch = []
+        for i in range(start, min(rows, start + INSERT_CHUNK)):
+            if rng.random() < stale_ratio:
+                status = "PENDING"
+                created_at = now - timedelta(seconds=ttl + rng.uniform(1, 30 * 86400))
+            else:
+                status = rng.choice(["PENDING", "COMPLETED", "FAILED"])
+                created_at = now - timedelta(seconds=rng.uniform(0, ttl * 0.9))
+            batch.append({
+                "id": f"bench-{i:010d}",
+                "user_id": f"user-{i % 5000}",
+                "transaction_id": f"TXN-BENCH-{i:010d}",
+                "status": status,
+                "coins": 20.0,
+                "amount_vnd": 52000.0,
+                "transfer_content": f"NAPCOINTXN-BENCH-{i:010d}",
+                "created_at": created_at,
+            })
+        with engine.begin() as conn:
+            conn.execute(table.insert(), batch)
+
+
+def _reset_expired(engine) -> None:
+    from sqlalchemy import update
+
+    from models import Payment
+
+    with engine.begin() as conn:
+        conn.execute(update(Payment).where(Payment.status == "EXPIRED").values(status="PENDING"))
+
+
+def _plan(engine, batch_size: int, ttl: float) -> list[str]:
+    from sqlalchemy import text
+
+    from services.payment_expiry import PaymentExpiryService
+
+    # The page query as issued mid-sweep (with a keyset cursor)
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=ttl)
+    query = PaymentExpiryService._batch_query(cutoff, (cutoff - timedelta(days=1), "bench-"), batch_size)
+    statement = query.compile(engine, compile_kwargs={"literal_binds": True})
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    with engine.connect() as conn:
+        return [" ".join(str(col) for col in row) for row in conn.execute(text(prefix + str(statement)))]
+
+
+def _sweep(engine, batch_size: int, ttl: float) -> dict:
+    from sqlalchemy.orm import Session
+
+    from services.payment_expiry import PaymentExpiryService
+
+    batch_ms = []
+    with Session(engine) as db:
+        total = 0
+        started = time.perf_counter()
+        while True:
+            t = time.perf_counter()
+            result = PaymentExpiryService.expire_stale(db, ttl_seconds=ttl, batch_size=batch_size, max_batches=1)
+            batch_ms.append((time.perf_counter() - t) * 1000.0)
+            total += result["expired"]
+            if result["expired"] == 0:
+                break
+        elapsed = time.perf_counter() - started
+    batch_ms.sort()
+    return {
+        "expired": total,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(total / elapsed, 1) if elapsed else 0.0,
+        "batch_p50_ms": round(batch_ms[len(batch_ms) // 2], 3),
+        "batch_p99_ms": round(batch_ms[min(len(batch_ms) - 1, int(len(batch_ms) * 0.99))], 3),
+        "batches": len(batch_ms),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="sync DB URL (default: fresh SQLite file in a temp dir)")
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--stale-ratio", type=float, default=0.6)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--ttl", type=float, default=86400)
+    parser.add_argument("--skip-unindexed", action="store_true", help="only run with the composite index")
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        _configure_env(args, workdir)
+        from database import Base, engine
+        from models import Payment
+
+        Base.metadata.create_all(bind=engine)
+        index = next(i for i in Payment.__table__.indexes if i.name == "ix_payments_status_created_at")
+
+        started = time.perf_counter()
+        _fill(engine, args.rows, args.stale_ratio, args.ttl)
+        report = {"rows": args.rows, "fill_seconds": round(time.perf_counter() - started, 1)}
+
+        index.create(bind=engine, checkfirst=True)
+        report["indexed"] = {"plan": _plan(engine, args.batch_size, args.ttl), **_sweep(engine, args.batch_size, args.ttl)}
+
+        if not args.skip_unindexed:
+            _reset_expired(engine)
+            index.drop(bind=engine)
+            report["unindexed"] = {"plan": _plan(engine, args.batch_size, args.ttl), **_sweep(engine, args.batch_size, args.ttl)}
+            index.create(bind=engine)
+
+        engine.dispose()
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+Micro-benchmark of MmapStorage (rate_limit.py), the mmap:// rate limit
+storage shared by every worker on the host, against limits' memory://.
+
+  latency     per-check cost (limiter.hit) for each storage and supported
+              strategy, one process, --keys distinct keys
+  processes   --processes forked workers each hit one shared key --hits
+              times against a --limit/minute limit: with mmap:// exactly
+              --limit are allowed in total; memory:// allows --limit per
+              process (what separate workers did before)
+  pressure    --slots-small slots and 4x as many live keys: full probe
+              windows evict the entry closest to expiry instead of failing
+
+Exits 1 if any check fails.
+
+    cd backend
+    python -m benchmarks.rate_limit_storage --processes 4 --hits 500 --limit 150
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks._common import _percentile
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def _configure_env() -> None:
+    # rate_limit builds the app's limiter at import; keep it off /dev/shm
+    os.environ["RATE_LIMIT_STORAGE_URI"] = "memory://"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _limiter(uri: str, strategy: str):
+    from limits.storage import storage_from_string
+    from limits.strategies import STRATEGIES
+
+    import rate_limit  # noqa: F401  (registers the mmap:// scheme)
+
+    return STRATEGIES[strategy](storage_from_string(uri))
+
+
+def _latency(uri: str, strategy: str, checks: int, keys: int) -> dict:
+    from limits import parse
+
+    limiter = _limiter(uri, strategy)
+    item = parse("1000000/minute")
+    samples = []
+    for i in range(checks):
+        key = f"bench-{i % keys}"
+        started = time.perf_counter()
+        limiter.hit(item, key)
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return {
+        "storage": uri.split(":", 1)[0],
+        "strategy": strategy,
+        "p50_us": round(_percentile(samples, 50), 2),
+        "p99_us": round(_percentile(samples, 99), 2),
+        "checks_per_s": round(checks / (sum(samples) / 1e6)),
+    }
+
+
+def _worker(uri: str, strategy: str, limit: int, hits: int, start, results) -> None:
+    from limits import parse
+
+    limiter = _limiter(uri, strategy)
+    item = parse(f"{limit}/minute")
+    start.wait()
+    allowed = sum(1 for _ in range(hits) if limiter.hit(item, "shared-client"))
+    results.put(allowed)
+
+
+def _processes(uri: str, strategy: str, processes: int, hits: int, limit: int) -> dict:
+    context = multiprocessing.get_context("fork")
+    start = context.Event()
+    results = context.Queue()
+    workers = [
+        context.Process(target=_worker, args=(uri, strategy, limit, hits, start, results))
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    started = time.perf_counter()
+    start.set()
+    allowed = [results.get(timeout=120) for _ in workers]
+    elapsed = time.perf_counter() - started
+    for worker in workers:
+        worker.join()
+    return {
+        "storage": uri.split(":", 1)[0],
+        "strategy": strategy,
+        "allowed": sum(allowed),
+        "allowed_per_process": allowed,
+        "checks_per_s": round(processes * hits / elapsed),
+    }
+
+
+def _pressure(path: str, slots: int) -> dict:
+    from limits import parse
+    from limits.strategies import STRATEGIES
+
+    from rate_limit import MmapStorage
+
+    limiter = STRATEGIES["sliding-window-counter"](MmapStorage(f"mmap://{path}", slots=slots))
+    item = parse("10/minute")
+    keys = slots * 4
+    errors = 0
+    for i in range(keys):
+        try:
+            limiter.hit(item, f"pressure-{i}")
+        except Exception:
+            errors += 1
+    # The newest keys must still be tracked after the table filled up
+    recent = [f"pressure-{i}" for i in range(keys - 100, keys)]
+    tracked = sum(1 for key in recent if limiter.get_window_stats(item, key).remaining < 10)
+    return {"slots": slots, "keys": keys, "errors": errors, "recent_keys_tracked": tracked, "recent_keys": len(recent)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checks", type=int, default=20000)
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--hits", type=int, default=500, help="hits per process on the shared key")
+    parser.add_argument("--limit", type=int, default=150, help="per-minute limit in the processes run")
+    parser.add_argument("--slots-small", type=int, default=1024)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    _configure_env()
+    from rate_limit import MmapStorage
+
+    with tempfile.TemporaryDirectory() as workdir:
+        latency, processes = [], []
+        for strategy in MmapStorage.STRATEGIES:
+            for uri in (f"mmap://{workdir}/latency-{strategy}", "memory://"):
+                latency.append(_latency(uri, strategy, args.checks, args.keys))
+                print("latency", latency[-1], file=sys.stderr)
+            for uri in (f"mmap://{workdir}/processes-{strategy}", "memory://"):
+                processes.append(_processes(uri, strategy, args.processes, args.hits, args.limit))
+                print("processes", processes[-1], file=sys.stderr)
+        pressure = _pressure(f"{workdir}/pressure", args.slots_small)
+
+    checks = {
+        "mmap_exact_across_processes": all(
+            run["allowed"] == args.limit for run in processes if run["storage"] == "mmap"
+        ),
+        "pressure_no_errors": pressure["errors"] == 0,
+        "pressure_tracks_recent_keys": pressure["recent_keys_tracked"] == pressure["recent_keys"],
+    }
+    report = {
+        "cpu_count": os.cpu_count(),
+        "latency": latency,
+        "processes": processes,
+        "pressure": pressure,
+        "checks": checks,
+        "ok": all(checks.values()),
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,416 @@
+"""
+Render job queue: credit reservation, scheduler throughput and queueing
+latency against a fake render backend (RENDER_BACKEND_URL stub that sleeps
+a lognormal --render-ms and injects --error-rate transient 503s).
+
+1. Reservation race: --race submits at once from a user with credits for
+   --race-credits jobs; exactly that many may be accepted (402 for the rest).
+2. Mixed load, run with a FIFO pick (baseline) and with the scheduler's
+   priority / fair-share pick:
+     heavy  one user queues --heavy-jobs normal jobs at once
+     light  --light-users users, one normal job every 0.3 s each
+     high   one user, a high-priority job every 0.25 s
+     faulty jobs the backend rejects (422) or hangs on (past RENDER_JOB_TIMEOUT)
+   Reports throughput vs the ideal (workers / mean render time), queue wait
+   (submit -> first render call) per class, and checks that the pool stays
+   bounded, failed jobs are refunded exactly once and every user's balance
+   equals both the initial credits minus succeeded jobs and their ledger.
+3. Lease recovery: a job left RUNNING by a "dead" worker is taken over
+   after its lease expires.
+
+Exits 1 if any check fails.
+
+    cd backend
+    python -m benchmarks.render_queue --workers 8 --heavy-jobs 300 --render-ms 40
+    python -m benchmarks.render_queue --render-ms 200   # renders long enough that the DB isn't the limit
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from benchmarks._common import _free_port
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def _configure_env(args: argparse.Namespace, render_port: int, workdir: str) -> None:
+    # Must run before the app modules are imported: they read config at import time
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/render_queue.db"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    os.environ["RATE_LIMIT_STORAGE_URI"] = "memory://"
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ["PAYMENT_SWEEP_INTERVAL"] = "0"
+    os.environ["UPLOAD_CLEANUP_INTERVAL"] = "0"
+    os.environ["RENDER_BACKEND_URL"] = f"http://127.0.0.1:{render_port}/render"
+    os.environ["RENDER_WORKERS"] = str(args.workers)
+    os.environ["RENDER_MAX_QUEUED_PER_USER"] = "0"
+    os.environ["RENDER_JOB_TIMEOUT"] = "1"
+    os.environ["RENDER_LEASE_GRACE"] = "0"
+    os.environ["RENDER_RECOVERY_INTERVAL"] = "0.5"
+    os.environ["RENDER_RETRY_DELAY"] = "0.05"
+    os.environ["RENDER_POLL_INTERVAL"] = "0.2"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+class FakeRenderBackend:
+    """POST /render { job_id, params } -> { output_url } after a simulated render"""
+
+    def __init__(self, seed: int, render_ms: float, error_rate: float):
+        self.rng = random.Random(seed)
+        self.render_ms = render_ms
+        self.error_rate = error_rate
+        self.calls = 0
+        self.injected = 0
+        self.active = 0
+        self.max_active = 0
+        self.render_seconds: list[float] = []
+        self.first_call: dict[str, float] = {}
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        body = await request.json()
+        self.calls += 1
+        self.first_call.setdefault(body["job_id"], time.time())
+        params = body.get("params") or {}
+        if params.get("hang"):
+            # Not counted as active: the scheduler gives up (RENDER_JOB_TIMEOUT) long before this returns
+            await asyncio.sleep(3)
+            return web.json_response({"output_url": "http://cdn.local/renders/too-late.mp4"})
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            if params.get("fatal"):
+                return web.json_response({"detail": "Unsupported scene"}, status=422)
+            seconds = self.rng.lognormvariate(math.log(self.render_ms / 1000.0), 0.5)
+            await asyncio.sleep(seconds)
+            self.render_seconds.append(seconds)
+            if self.rng.random() < self.error_rate:
+                self.injected += 1
+                return web.Response(status=503, text="injected")
+            return web.json_response({"output_url": f"http://cdn.local/renders/{body['job_id']}.mp4"})
+        finally:
+            self.active -= 1
+
+    async def start(self, port: int):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post("/render", self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port, shutdown_timeout=1).start()
+        return runner
+
+
+def _percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {
+        "p50": round(statistics.median(ordered) * 1000.0, 1),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000.0, 1),
+        "max": round(ordered[-1] * 1000.0, 1),
+    }
+
+
+def _create_users(prefix: str, credits: dict[str, float]) -> dict[str, str]:
+    from database import SessionLocal
+    from ids import new_id
+    from models import User
+
+    ids = {}
+    db = SessionLocal()
+    try:
+        for name, amount in credits.items():
+            ids[name] = new_id()
+            db.add(User(id=ids[name], email=f"{prefix}-{name}@bench.local", name=name, credits=amount))
+        db.commit()
+    finally:
+        db.close()
+    return ids
+
+
+def _jobs_of(user_ids: list[str]) -> list:
+    from sqlalchemy import select
+
+    from database import SessionLocal
+    from models import RenderJob
+
+    db = SessionLocal()
+    try:
+        return db.execute(select(RenderJob).where(RenderJob.user_id.in_(user_ids))).scalars().all()
+    finally:
+        db.close()
+
+
+def _balances(user_ids: list[str]) -> dict[str, tuple[float, float]]:
+    """user_id -> (users.credits, sum of the ledger)"""
+    from sqlalchemy import case, func, select
+
+    from database import SessionLocal
+    from models import CreditTransaction, User
+
+    db = SessionLocal()
+    try:
+        credits = dict(db.execute(select(User.id, User.credits).where(User.id.in_(user_ids))).all())
+        signed = case((CreditTransaction.type == "DEDUCTION", -CreditTransaction.amount), else_=CreditTransaction.amount)
+        ledger = dict(
+            db.execute(
+                select(CreditTransaction.user_id, func.sum(signed))
+                .where(CreditTransaction.user_id.in_(user_ids))
+                .group_by(CreditTransaction.user_id)
+            ).all()
+        )
+        return {user_id: (float(credits[user_id]), float(ledger.get(user_id) or 0.0)) for user_id in user_ids}
+    finally:
+        db.close()
+
+
+async def _wait_idle(user_ids: list[str], timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(job.status not in ("QUEUED", "RUNNING") for job in _jobs_of(user_ids)):
+            return
+        await asyncio.sleep(0.1)
+
+
+async def _reservation_race(client, args: argparse.Namespace) -> dict:
+    users = _create_users("race", {"racer": float(args.race_credits)})
+    user_id = users["racer"]
+    responses = await asyncio.gather(
+        *(client.post("/api/render/jobs", json={"user_id": user_id, "params": {"n": i}}) for i in range(args.race))
+    )
+    statuses = [response.status_code for response in responses]
+    await _wait_idle([user_id], 30)
+    credits, ledger = _balances([user_id])[user_id]
+    return {
+        "submits": args.race,
+        "accepted": statuses.count(201),
+        "payment_required": statuses.count(402),
+        "final_credits": credits,
+        "ledger": ledger,
+    }
+
+
+async def _mixed_load(client, args: argparse.Namespace, stub: FakeRenderBackend, policy: str) -> dict:
+    from services.render_jobs import RenderJobService, render_scheduler
+
+    initial = {"heavy": 10_000.0, "high": 1_000.0, "faulty": 100.0}
+    initial.update({f"light{i}": 100.0 for i in range(args.light_users)})
+    users = _create_users(policy, initial)
+    classes = {users[name]: name.rstrip("0123456789") for name in users}
+
+    if policy == "fifo":
+        render_scheduler.pick = lambda window, running, free: list(window[:free])
+
+    async def submit(name: str, priority: str = "normal", **params) -> None:
+        response = await client.post(
+            "/api/render/jobs", json={"user_id": users[name], "priority": priority, "params": params}
+        )
+        assert response.status_code == 201, response.text
+
+    async def heavy() -> None:
+        for i in range(args.heavy_jobs):
+            await submit("heavy", frame=i)
+
+    async def light(i: int) -> None:
+        await asyncio.sleep(0.2 + 0.03 * i)
+        for frame in range(5):
+            await submit(f"light{i}", frame=frame)
+            await asyncio.sleep(0.3)
+
+    async def high() -> None:
+        await asyncio.sleep(0.3)
+        for frame in range(8):
+            await submit("high", priority="high", frame=frame)
+            await asyncio.sleep(0.25)
+
+    async def faulty() -> None:
+        for _ in range(3):
+            await submit("faulty", fatal=True)
+        await submit("faulty", hang=True)
+
+    calls_before, rendered_before = stub.calls, len(stub.render_seconds)
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(heavy(), faulty(), high(), *(light(i) for i in range(args.light_users)))
+        await _wait_idle(list(users.values()), 120)
+    finally:
+        render_scheduler.__dict__.pop("pick", None)
+    elapsed = time.perf_counter() - started
+
+    jobs = _jobs_of(list(users.values()))
+    waits: dict[str, list[float]] = {"heavy": [], "light": [], "high": []}
+    spent = {user_id: 0.0 for user_id in users.values()}
+    first_done, last_done = None, None
+    for job in jobs:
+        created_at = job.created_at.replace(tzinfo=timezone.utc).timestamp()
+        if classes[job.user_id] in waits and job.id in stub.first_call:
+            waits[classes[job.user_id]].append(stub.first_call[job.id] - created_at)
+        if not job.refunded:
+            spent[job.user_id] += job.cost
+        if job.status == "SUCCEEDED":
+            finished = job.finished_at.replace(tzinfo=timezone.utc).timestamp()
+            last_done = max(last_done or finished, finished)
+            first_done = min(first_done or created_at, created_at)
+
+    render_seconds = stub.render_seconds[rendered_before:]
+    succeeded = [job for job in jobs if job.status == "SUCCEEDED"]
+    throughput = len(succeeded) / (last_done - first_done)
+    ideal = args.workers / statistics.mean(render_seconds)
+    balances = _balances(list(users.values()))
+    faulty_jobs = [job for job in jobs if job.user_id == users["faulty"]]
+
+    return {
+        "job_ids": [job.id for job in jobs],
+        "policy": policy,
+        "jobs": len(jobs),
+        "statuses": {status: sum(job.status == status for job in jobs) for status in {job.status for job in jobs}},
+        "retried_jobs": sum(job.attempts > 1 for job in succeeded),
+        "render_calls": stub.calls - calls_before,
+        "seconds": round(elapsed, 2),
+        "throughput_jobs_per_s": round(throughput, 1),
+        "ideal_jobs_per_s": round(ideal, 1),
+        "pool_efficiency": round(throughput / ideal, 3),
+        "queue_wait_ms": {name: _percentiles(samples) for name, samples in waits.items()},
+        "checks": {
+            "all_finished": all(job.status in ("SUCCEEDED", "FAILED") for job in jobs),
+            "faulty_failed_and_refunded": all(job.status == "FAILED" and job.refunded for job in faulty_jobs)
+            and [job.attempts for job in faulty_jobs].count(RenderJobService.MAX_ATTEMPTS) == 1,
+            "balances_match": all(
+                abs(balances[user_id][0] - (initial[name] - spent[user_id])) < 1e-6
+                and abs(balances[user_id][0] - (initial[name] + balances[user_id][1])) < 1e-6
+                for name, user_id in users.items()
+            ),
+        },
+    }
+
+
+async def _lease_recovery(client) -> dict:
+    from database import SessionLocal
+    from models import RenderJob
+    from services.render_jobs import RenderJobService, render_scheduler
+
+    users = _create_users("lease", {"owner": 10.0})
+    db = SessionLocal()
+    try:
+        # Queue and claim it as a worker that then "dies" without a trace
+        job = RenderJobService.submit(db, users["owner"], {"scene": "orphan"})
+        RenderJobService.claim(db, [job["job_id"]], "dead-worker:1")
+        db.query(RenderJob).filter(RenderJob.id == job["job_id"]).update(
+            {"lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}
+        )
+        db.commit()
+    finally:
+        db.close()
+    render_scheduler.notify()
+
+    started = time.perf_counter()
+    status = None
+    while time.perf_counter() - started < 10:
+        data = (await client.get(f"/api/render/jobs/{job['job_id']}")).json()
+        status = data["status"]
+        if status in ("succeeded", "failed"):
+            break
+        await asyncio.sleep(0.05)
+    return {"status": status, "attempts": data["attempts"], "recovered_in_s": round(time.perf_counter() - started, 2)}
+
+
+async def _status_latency(client, job_ids: list[str]) -> dict:
+    samples = []
+    for job_id in job_ids:
+        started = time.perf_counter()
+        response = await client.get(f"/api/render/jobs/{job_id}")
+        samples.append(time.perf_counter() - started)
+        assert response.status_code == 200
+    return _percentiles(samples)
+
+
+async def _run(args: argparse.Namespace, stub: FakeRenderBackend) -> dict:
+    import httpx
+
+    import main
+    from services.render_jobs import render_scheduler
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30) as client:
+            race = await _reservation_race(client, args)
+            runs = [await _mixed_load(client, args, stub, policy) for policy in ("fifo", "fair")]
+            job_ids = [job_id for run in runs for job_id in run.pop("job_ids")]
+            lease = await _lease_recovery(client)
+            status_ms = await _status_latency(client, job_ids[:200])
+            scheduler = render_scheduler.stats()
+
+    fifo, fair = runs
+    checks = {
+        "reservation_exact": race["accepted"] == args.race_credits
+        and race["final_credits"] == 0.0
+        and race["ledger"] == -float(args.race_credits),
+        "pool_bounded": stub.max_active <= args.workers,
+        **{f"{run['policy']}_{name}": ok for run in runs for name, ok in run["checks"].items()},
+        "light_users_not_starved": fair["queue_wait_ms"]["light"]["p95"] < fifo["queue_wait_ms"]["light"]["p50"],
+        "high_priority_first": fair["queue_wait_ms"]["high"]["p95"] < fair["queue_wait_ms"]["heavy"]["p50"],
+        "lease_recovered": lease["status"] == "succeeded",
+    }
+    return {
+        "workers": args.workers,
+        "render_ms": args.render_ms,
+        "error_rate": args.error_rate,
+        "reservation_race": race,
+        "runs": runs,
+        "lease_recovery": lease,
+        "status_endpoint_ms": status_ms,
+        "max_concurrent_renders": stub.max_active,
+        "injected_503": stub.injected,
+        "scheduler": scheduler,
+        "checks": checks,
+        "ok": all(checks.values()),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--heavy-jobs", type=int, default=300)
+    parser.add_argument("--light-users", type=int, default=10)
+    parser.add_argument("--render-ms", type=float, default=40.0)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--race", type=int, default=40)
+    parser.add_argument("--race-credits", type=int, default=10)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        render_port = _free_port()
+        _configure_env(args, render_port, workdir)
+
+        async def run() -> dict:
+            stub = FakeRenderBackend(seed=25, render_ms=args.render_ms, error_rate=args.error_rate)
+            runner = await stub.start(render_port)
+            try:
+                return await _run(args, stub)
+            finally:
+                await runner.cleanup()
+
+        report = asyncio.run(run())
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
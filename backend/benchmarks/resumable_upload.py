@@ -0,0 +1,234 @@
+"""
+Interrupted-transfer simulation for the resumable upload endpoints.
+
+Runs the app under uvicorn on a local port with a Zipline stub that hashes
+what it receives, then uploads a --size-mb file in --chunk-mb PUTs where
+--drop-rate of them lose the connection part-way (socket aborted mid-body).
+After each drop the client asks for the offset and resumes from it.
+Also checks the offset-mismatch (409 + Upload-Offset), overflow (413),
+busy-session and cleanup paths, then finalizes and compares the sha256
+Zipline received.
+
+    cd backend
+    python -m benchmarks.resumable_upload --size-mb 256 --chunk-mb 8 --drop-rate 0.3
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks._common import _free_port
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def _configure_env(zipline_port: int, workdir: str) -> None:
+    # Must run before the app modules are imported: they read config at import time
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/resumable.db"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    os.environ["RATE_LIMIT_STORAGE_URI"] = "memory://"
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ["PAYMENT_SWEEP_INTERVAL"] = "0"
+    os.environ["ZIPLINE_API_URL"] = f"http://127.0.0.1:{zipline_port}"
+    os.environ["ZIPLINE_API_KEY"] = "bench"
+    os.environ["ZIPLINE_DEDUP_ENABLED"] = "false"
+    os.environ["UPLOAD_STAGING_DIR"] = os.path.join(workdir, "staging")
+    os.environ["UPLOAD_CLEANUP_INTERVAL"] = "0"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+async def _start_hashing_stub(port: int):
+    from aiohttp import web
+
+    async def upload(request: web.Request) -> web.Response:
+        reader = await request.multipart()
+        part = await reader.next()
+        hasher = hashlib.sha256()
+        size = 0
+        while True:
+            chunk = await part.read_chunk()
+            if not chunk:
+                break
+            hasher.update(chunk)
+            size += len(chunk)
+        return web.json_response({"files": [{"name": part.filename, "url": f"http://zipline.local/u/{size}/{hasher.hexdigest()}"}]})
+
+    app = web.Application(client_max_size=1024 ** 4)
+    app.router.add_post("/api/upload", upload)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def _dropped_put(port: int, path: str, offset: int, body: bytes, cut_at: int) -> None:
+    """Send a PUT whose connection dies after `cut_at` body bytes"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    head = (
+        f"PUT {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nUpload-Offset: {offset}\r\n"
+        f"Content-Type: application/offset+octet-stream\r\nContent-Length: {len(body)}\r\n\r\n"
+    )
+    writer.write(head.encode("ascii") + body[:cut_at])
+    await writer.drain()
+    writer.transport.abort()
+
+
+async def _run(args: argparse.Namespace, app_port: int) -> dict:
+    import aiohttp
+    import uvicorn
+
+    import main
+    from services.resumable_upload import ResumableUploadService
+
+    rng = random.Random(22)
+    size = args.size_mb * 1024 * 1024
+    chunk = args.chunk_mb * 1024 * 1024
+    data = os.urandom(size)
+    expected = hashlib.sha256(data).hexdigest()
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=app_port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    base = f"http://127.0.0.1:{app_port}/api/upload/sessions"
+    checks: dict[str, bool] = {}
+    stats = {"puts": 0, "dropped": 0, "conflicts": 0, "bytes_sent": 0}
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as http:
+            async with http.post(base, json={"filename": "render-input.bin", "size": size}) as r:
+                session = await r.json()
+                checks["create_201"] = r.status == 201 and r.headers.get("Upload-Offset") == "0"
+            url = f"{base}/{session['upload_id']}"
+            path = f"/api/upload/sessions/{session['upload_id']}"
+
+            async with http.put(url, data=b"x", headers={"Upload-Offset": "5"}) as r:
+                checks["offset_mismatch_409"] = r.status == 409 and r.headers.get("Upload-Offset") == "0"
+
+            started = time.perf_counter()
+            offset = 0
+            while offset < size:
+                body = data[offset:offset + chunk]
+                stats["puts"] += 1
+                if rng.random() < args.drop_rate:
+                    cut_at = rng.randrange(1, len(body))
+                    await _dropped_put(app_port, path, offset, body, cut_at)
+                    stats["dropped"] += 1
+                    stats["bytes_sent"] += cut_at
+                else:
+                    stats["bytes_sent"] += len(body)
+                    try:
+                        async with http.put(url, data=body, headers={"Upload-Offset": str(offset)}) as r:
+                            if r.status == 409:
+                                stats["conflicts"] += 1
+                            elif r.status != 200:
+                                raise RuntimeError(f"PUT failed: {r.status} {await r.text()}")
+                    except aiohttp.ClientOSError:
+                        # 409 sent before the body was read (the dropped request was still
+                        # being consumed, so the offset we had was stale); re-sync below
+                        stats["conflicts"] += 1
+                # Resume point after every request, as a client would after a reconnect
+                while True:
+                    async with http.head(url) as r:
+                        new_offset = int(r.headers["Upload-Offset"])
+                    async with http.put(url, data=b"", headers={"Upload-Offset": str(new_offset)}) as r:
+                        # A zero-byte PUT returns 409 while the dropped request still holds the session
+                        if r.status == 200:
+                            break
+                    await asyncio.sleep(0.01)
+                offset = new_offset
+            transfer = time.perf_counter() - started
+
+            # Body longer than the declared size: refused before anything is written
+            async with http.post(base, json={"filename": "small.bin", "size": 16}) as r:
+                small_url = f"{base}/{(await r.json())['upload_id']}"
+            async with http.put(small_url, data=b"s" * 17, headers={"Upload-Offset": "0"}) as r:
+                checks["overflow_413"] = r.status == 413
+            async with http.head(small_url) as r:
+                checks["overflow_not_written"] = r.headers.get("Upload-Offset") == "0"
+
+            # Two writers on one session: exactly one may hold it
+            async with http.post(base, json={"filename": "race.bin", "size": 64 * 1024 * 1024}) as r:
+                race = await r.json()
+            race_url = f"{base}/{race['upload_id']}"
+
+            async def slow_body():
+                for _ in range(8):
+                    yield b"r" * (1024 * 1024)
+                    await asyncio.sleep(0.05)
+
+            first = asyncio.create_task(http.put(race_url, data=slow_body(), headers={"Upload-Offset": "0"}))
+            await asyncio.sleep(0.1)
+            async with http.put(race_url, data=b"z", headers={"Upload-Offset": "0"}) as r:
+                checks["busy_409"] = r.status == 409
+            (await first).release()
+
+            async with http.post(f"{url}/finalize") as r:
+                finalized = await r.json()
+            received = finalized["url"].rsplit("/", 2)
+            checks["sha256_match"] = received[-1] == expected and int(received[-2]) == size
+            async with http.post(f"{url}/finalize") as r:
+                checks["finalize_idempotent"] = (await r.json())["url"] == finalized["url"]
+            checks["staging_removed"] = not os.path.exists(ResumableUploadService._paths(session["upload_id"])[0])
+
+            # Abandoned session: aged past the TTL and swept
+            part_path, meta_path = ResumableUploadService._paths(race["upload_id"])
+            old = time.time() - 2 * ResumableUploadService.SESSION_TTL
+            for p in (part_path, meta_path):
+                os.utime(p, (old, old))
+            swept = ResumableUploadService.cleanup_expired()
+            async with http.get(race_url) as r:
+                checks["cleanup_removed"] = swept["removed"] >= 1 and r.status == 404
+    finally:
+        server.should_exit = True
+        await serving
+
+    return {
+        "size_mb": args.size_mb,
+        "chunk_mb": args.chunk_mb,
+        "drop_rate": args.drop_rate,
+        **stats,
+        "resent_overhead": round(stats["bytes_sent"] / size - 1, 3),
+        "transfer_seconds": round(transfer, 2),
+        "throughput_mb_s": round(args.size_mb / transfer, 1),
+        "checks": checks,
+        "ok": all(checks.values()),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--chunk-mb", type=int, default=8)
+    parser.add_argument("--drop-rate", type=float, default=0.3)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        zipline_port, app_port = _free_port(), _free_port()
+        _configure_env(zipline_port, workdir)
+
+        async def run() -> dict:
+            stub = await _start_hashing_stub(zipline_port)
+            try:
+                return await _run(args, app_port)
+            finally:
+                await stub.cleanup()
+
+        report = asyncio.run(run())
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+SQL statements and latency of GET /api/payments/{id}/status with the payment
+status / user credits caches (services/payment_cache.py), against the same
+polls with both caches emptied before every request (the pre-cache cost).
+
+Boots `main.app` in-process (httpx.ASGITransport) on a fresh SQLite file,
+creates --orders orders for --users users, then polls every order --polls
+times at --concurrency, counting statements on the sync engine. Afterwards one
+order is settled through POST /api/payments/webhook: its next status poll
+must already say `completed` with the new balance (write-through and credits
+invalidation), without waiting for a TTL.
+
+Exits 1 if any check fails.
+
+    cd backend
+    python -m benchmarks.status_cache --orders 100 --polls 3 --concurrency 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from benchmarks._common import _percentile
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+PACKAGE = {"coins": 20.0, "amount_vnd": 52000.0}
+
+
+def _configure_env(workdir: str) -> None:
+    # Must run before the app modules are imported: they read config at import time
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/status_cache.db"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ["PAYMENT_SWEEP_INTERVAL"] = "0"
+    os.environ["PAYMENT_WEBHOOK_SECRET"] = ""
+    # slowapi's own switch: every request comes from the same client
+    os.environ["RATELIMIT_ENABLED"] = "false"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _count_statements() -> list[int]:
+    """Counter of statements run on the sync engine from now on"""
+    from sqlalchemy import event
+
+    from database import engine
+
+    counter = [0]
+    lock = threading.Lock()
+
+    def before_cursor_execute(*_args) -> None:
+        with lock:
+            counter[0] += 1
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    return counter
+
+
+def _create_users(count: int) -> list[str]:
+    from database import SessionLocal
+    from ids import new_id
+    from models import User
+
+    ids = [new_id() for _ in range(count)]
+    db = SessionLocal()
+    try:
+        db.add_all(User(id=user_id, email=f"{user_id}@bench.local", credits=0.0) for user_id in ids)
+        db.commit()
+    finally:
+        db.close()
+    return ids
+
+
+async def _poll(client, transaction_ids: list[str], polls: int, concurrency: int, statements: list[int],
+                clear_caches: bool) -> dict:
+    from services import payment_cache
+
+    latencies: list[float] = []
+    errors = 0
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(transaction_id: str) -> None:
+        nonlocal errors
+        async with gate:
+            if clear_caches:
+                payment_cache.payment_status_cache.clear()
+                payment_cache.user_credits_cache.clear()
+            started = time.perf_counter()
+            response = await client.get(f"/api/payments/{transaction_id}/status")
+            latencies.append((time.perf_counter() - started) * 1000.0)
+            errors += response.status_code != 200
+
+    before = statements[0]
+    started = time.perf_counter()
+    # Round by round, so each order is asked for again after the others
+    for _ in range(polls):
+        await asyncio.gather(*(one(transaction_id) for transaction_id in transaction_ids))
+    elapsed = time.perf_counter() - started
+    requests = polls * len(transaction_ids)
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "queries_per_poll": round((statements[0] - before) / requests, 2),
+        "p50_ms": round(_percentile(latencies, 50), 3),
+        "p99_ms": round(_percentile(latencies, 99), 3),
+        "throughput_rps": round(requests / elapsed, 1),
+    }
+
+
+async def _run(args: argparse.Namespace) -> dict:
+    import httpx
+
+    import main
+    from services.payment_service import PaymentService
+
+    statements = _count_statements()
+    results = {}
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            user_ids = _create_users(args.users)
+            transaction_ids = []
+            for i in range(args.orders):
+                response = await client.post(
+                    "/api/payments/create-order", json={**PACKAGE, "user_id": user_ids[i % len(user_ids)]}
+                )
+                transaction_ids.append(response.json()["transaction_id"])
+
+            results["uncached"] = await _poll(client, transaction_ids, args.polls, args.concurrency, statements, True)
+            print("uncached", results["uncached"], file=sys.stderr)
+            hits_before = PaymentService.status_cache_stats()["payment_status"]["hits"]
+            results["cached"] = await _poll(client, transaction_ids, args.polls, args.concurrency, statements, False)
+            results["cached"]["status_cache_hits"] = (
+                PaymentService.status_cache_stats()["payment_status"]["hits"] - hits_before
+            )
+            print("cached", results["cached"], file=sys.stderr)
+
+            # Settle one order: the very next poll must see it, cache or not
+            transaction_id = transaction_ids[0]
+            await client.get(f"/api/payments/{transaction_id}/status")
+            await client.post(
+                "/api/payments/webhook",
+                json={"transaction_id": transaction_id, "status": "success", "amount": PACKAGE["amount_vnd"]},
+            )
+            before = statements[0]
+            after = (await client.get(f"/api/payments/{transaction_id}/status")).json()
+            results["after_webhook"] = {
+                "status": after["status"],
+                "credits": after["credits"],
+                "queries": statements[0] - before,
+            }
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=100)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--polls", type=int, default=3, help="status requests per order")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        _configure_env(workdir)
+        results = asyncio.run(_run(args))
+
+    cached, uncached, after = results["cached"], results["uncached"], results["after_webhook"]
+    checks = {
+        "no_errors": cached["errors"] == 0 and uncached["errors"] == 0,
+        "cached_fewer_queries": cached["queries_per_poll"] < uncached["queries_per_poll"],
+        "webhook_visible_at_once": after["status"] == "completed" and after["credits"] == PACKAGE["coins"],
+    }
+    report = {
+        "orders": args.orders,
+        "polls": args.polls,
+        **results,
+        "checks": checks,
+        "ok": all(checks.values()),
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Peak RSS of the API process while it relays uploads to Zipline, against the
+number of parallel uploads and the file size.
+
+Every (--parallel, --sizes-mb) combination gets a fresh uvicorn process (peak
+RSS only ever goes up, so configurations can't share one) serving `main.app`
+with the local Zipline stub from benchmarks._common. The client posts the
+same on-disk file N times at once through POST /api/upload/ over real HTTP,
+so neither side holds a whole file in memory. Reported growth is the server's
+peak RSS minus its idle peak (started, never uploaded to).
+
+Since Starlette spools request bodies to disk and ZiplineService streams them
+out in ZIPLINE_UPLOAD_CHUNK_SIZE chunks, growth must not depend on file size:
+the check fails if, at any parallelism, the largest file grows RSS by more than
+--max-size-growth-mb over the smallest. Exits 1 if any check fails.
+
+    cd backend
+    python -m benchmarks.streaming_upload --parallel 1,4,8 --sizes-mb 10,100,500
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks._common import _free_port, _peak_rss_mb, _start_zipline_stub
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def _configure_env(zipline_port: int, workdir: str) -> None:
+    # Inherited by the server processes; they import the app after this is set
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/streaming_upload.db"
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ["PAYMENT_SWEEP_INTERVAL"] = "0"
+    # slowapi's own switch: no per-IP limits during the run
+    os.environ["RATELIMIT_ENABLED"] = "false"
+    os.environ["ZIPLINE_API_URL"] = f"http://127.0.0.1:{zipline_port}"
+    os.environ["ZIPLINE_API_KEY"] = "bench"
+    # Same file N times: with dedup on only the first copy would go out
+    os.environ["ZIPLINE_DEDUP_ENABLED"] = "false"
+    os.environ["ZIPLINE_MAX_UPLOAD_SIZE"] = "0"
+    os.environ["TMPDIR"] = workdir
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _serve(port: int) -> int:
+    """Server side: run the app until SIGINT, then print its peak RSS"""
+    import uvicorn
+
+    import main
+
+    try:
+        uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning")).run()
+    except KeyboardInterrupt:
+        # uvicorn shuts down gracefully, then re-raises the captured SIGINT
+        pass
+    print(json.dumps({"peak_rss_mb": round(_peak_rss_mb(), 1)}))
+    return 0
+
+
+def _start_server() -> tuple[subprocess.Popen, int]:
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.streaming_upload", "--serve", str(port)],
+        cwd=BACKEND_DIR,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("server did not start")
+
+
+def _stop_server(process: subprocess.Popen) -> float:
+    process.send_signal(signal.SIGINT)
+    stdout, _ = process.communicate(timeout=60)
+    return json.loads(stdout.strip().splitlines()[-1])["peak_rss_mb"]
+
+
+def _write_file(path: Path, size_mb: int) -> None:
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as f:
+        for _ in range(size_mb):
+            f.write(block)
+
+
+async def _upload_all(port: int, path: Path, parallel: int) -> tuple[float, int]:
+    import httpx
+
+    async def upload(client: httpx.AsyncClient, i: int) -> bool:
+        # httpx streams multipart file fields from the open file in chunks
+        with open(path, "rb") as f:
+            response = await client.post(
+                "/api/upload/", files={"file": (f"upload-{i}.bin", f, "application/octet-stream")}
+            )
+        return response.status_code == 200
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(upload(client, i) for i in range(parallel)))
+        return time.perf_counter() - started, sum(not ok for ok in results)
+
+
+async def _run(args: argparse.Namespace, workdir: str, zipline_port: int) -> dict:
+    stub = await _start_zipline_stub(zipline_port, 0)
+    try:
+        process, _ = _start_server()
+        idle = _stop_server(process)
+        print({"idle_rss_mb": idle}, file=sys.stderr)
+
+        runs = []
+        for size_mb in (int(s) for s in args.sizes_mb.split(",")):
+            path = Path(workdir) / f"payload-{size_mb}mb.bin"
+            _write_file(path, size_mb)
+            for parallel in (int(n) for n in args.parallel.split(",")):
+                process, port = _start_server()
+                try:
+                    elapsed, failed = await _upload_all(port, path, parallel)
+                finally:
+                    peak = _stop_server(process)
+                runs.append({
+                    "size_mb": size_mb,
+                    "parallel": parallel,
+                    "seconds": round(elapsed, 3),
+                    "mb_per_s": round(size_mb * parallel / elapsed, 1),
+                    "failed": failed,
+                    "peak_rss_mb": peak,
+                    "rss_growth_mb": round(peak - idle, 1),
+                })
+                print(runs[-1], file=sys.stderr)
+            path.unlink()
+        return {"idle_rss_mb": idle, "runs": runs}
+    finally:
+        await stub.cleanup()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--parallel", default="1,4,8", help="parallel upload counts to compare")
+    parser.add_argument("--sizes-mb", default="10,100,500", help="file sizes to compare")
+    parser.add_argument("--max-size-growth-mb", type=float, default=32.0,
+                        help="allowed extra RSS growth of the largest file over the smallest, per parallelism")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    if args.serve:
+        sys.path.insert(0, str(BACKEND_DIR))
+        return _serve(args.serve)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        zipline_port = _free_port()
+        _configure_env(zipline_port, workdir)
+        results = asyncio.run(_run(args, workdir, zipline_port))
+
+    runs = results["runs"]
+    size_independent = {}
+    for parallel in sorted({run["parallel"] for run in runs}):
+        by_size = sorted((run for run in runs if run["parallel"] == parallel), key=lambda run: run["size_mb"])
+        size_independent[str(parallel)] = (
+            by_size[-1]["rss_growth_mb"] - by_size[0]["rss_growth_mb"] <= args.max_size_growth_mb
+        )
+    checks = {
+        "no_failures": all(run["failed"] == 0 for run in runs),
+        "rss_independent_of_file_size": all(size_independent.values()),
+    }
+    report = {
+        "chunk_size": int(os.getenv("ZIPLINE_UPLOAD_CHUNK_SIZE", str(1024 * 1024))),
+        **results,
+        "size_independent_by_parallel": size_independent,
+        "checks": checks,
+        "ok": all(checks.values()),
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+VietQR payloads and in-process QR rendering (VietQRService).
+
+1. Correctness: the CRC-16/CCITT-FALSE check value and published VietQR
+   payloads must come out byte-for-byte; every rendered PNG is decoded again
+   and compared with its payload (needs `pip install zxing-cpp`, skipped
+   otherwise).
+2. Generation time: payload build, PNG and SVG render per QR (p50/p95).
+3. Serving: --orders orders through POST /api/payments/create-order (which
+   renders nothing), then the checkout's image requests (1 + a few repeat
+   loads per order) against GET /api/payments/{id}/qr: order latency, cache
+   hit rate and latency. The first load renders the QR, repeats are hits.
+
+    cd backend
+    python -m benchmarks.vietqr --samples 200 --orders 200
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Published VietQR examples; their CRCs check out independently of this code
+KNOWN_GOOD = [
+    {
+        "args": {"bank_bin": "970416", "account_number": "257678859", "amount_vnd": 1000, "purpose": "Chuyen tien"},
+        "payload": "00020101021238530010A0000007270123000697041601092576788590208QRIBFTTA"
+                   "5303704540410005802VN62150811Chuyen tien6304BBB8",
+    },
+    {
+        "args": {"bank_bin": "970403", "account_number": "0011012345678", "amount_vnd": 180000,
+                 "purpose": "thanh toan don hang", "bill_number": "NPS6869"},
+        "payload": "00020101021238570010A00000072701270006970403011300110123456780208QRIBFTTA"
+                   "530370454061800005802VN62340107NPS68690819thanh toan don hang63042E2E",
+    },
+]
+
+
+def _configure_env(workdir: str) -> None:
+    # Must run before the app modules are imported: they read config at import time
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/vietqr.db"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    os.environ["RATE_LIMIT_STORAGE_URI"] = "memory://"
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ["PAYMENT_SWEEP_INTERVAL"] = "0"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _percentiles(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "p50": round(statistics.median(ordered), 3),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+    }
+
+
+def _correctness(samples: int) -> dict:
+    from services.payment_service import PaymentService
+    from services.vietqr_service import VietQRService
+
+    checks = {
+        "crc_check_value": VietQRService.crc16(b"123456789") == "29B1",
+        "known_good_payloads": all(
+            VietQRService.build_payload(**case["args"]) == case["payload"] for case in KNOWN_GOOD
+        ),
+    }
+    try:
+        import zxingcpp
+        from PIL import Image
+    except ImportError:
+        return {"checks": checks, "decoded": None}
+
+    rng = random.Random(24)
+    decoded = 0
+    for _ in range(samples):
+        package = rng.choice(PaymentService.PACKAGES)
+        content = PaymentService._transfer_content(PaymentService._generate_transaction_id())
+        payload = VietQRService.build_payload(
+            PaymentService.BANK_ID, PaymentService.ACCOUNT_NUMBER, package["amount_vnd"], content
+        )
+        image = Image.open(io.BytesIO(VietQRService.render(payload, "png")))
+        # Only look for QR: a 1-D reader can occasionally "find" a short barcode inside the modules
+        results = zxingcpp.read_barcodes(image, formats=zxingcpp.BarcodeFormat.QRCode)
+        decoded += len(results) == 1 and results[0].text == payload
+    checks["png_round_trip"] = decoded == samples
+    return {"checks": checks, "decoded": f"{decoded}/{samples}"}
+
+
+def _generation(samples: int) -> dict:
+    from services.payment_service import PaymentService
+    from services.vietqr_service import VietQRService
+
+    payloads = []
+    build_us = []
+    for _ in range(samples):
+        content = PaymentService._transfer_content(PaymentService._generate_transaction_id())
+        started = time.perf_counter()
+        payloads.append(VietQRService.build_payload(PaymentService.BANK_ID, PaymentService.ACCOUNT_NUMBER, 52000, content))
+        build_us.append((time.perf_counter() - started) * 1e6)
+
+    report = {"payload_chars": len(payloads[0]), "build_payload_us": _percentiles(build_us)}
+    for fmt in VietQRService.FORMATS:
+        render_ms = []
+        for payload in payloads:
+            started = time.perf_counter()
+            image = VietQRService.render(payload, fmt)
+            render_ms.append((time.perf_counter() - started) * 1000.0)
+        report[f"render_{fmt}_ms"] = _percentiles(render_ms)
+        report[f"{fmt}_bytes"] = len(image)
+    return report
+
+
+async def _serving(orders: int) -> dict:
+    import httpx
+
+    import main
+    from services.vietqr_service import VietQRService
+
+    rng = random.Random(24)
+    VietQRService.image_cache.clear()
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            urls, order_ms = [], []
+            for _ in range(orders):
+                started = time.perf_counter()
+                response = await client.post(
+                    "/api/payments/create-order", json={"coins": 20.0, "amount_vnd": 52000.0}
+                )
+                order_ms.append((time.perf_counter() - started) * 1000.0)
+                urls.append(response.json()["qr_code_url"])
+
+            before = VietQRService.cache_stats()
+            first_ms, repeat_ms = [], []
+            not_modified = 0
+            for url in urls:
+                # Modal opens; then re-opens, refreshes, a second device, ...
+                for load in range(1 + rng.choice([0, 0, 1, 1, 2, 3])):
+                    started = time.perf_counter()
+                    response = await client.get(url)
+                    (first_ms if load == 0 else repeat_ms).append((time.perf_counter() - started) * 1000.0)
+                    assert response.status_code == 200 and response.headers["content-type"] == "image/png"
+                etag = response.headers["etag"]
+                revalidated = await client.get(url, headers={"If-None-Match": etag})
+                not_modified += revalidated.status_code == 304
+            after = VietQRService.cache_stats()
+
+    hits = after["hits"] - before["hits"]
+    lookups = hits + after["misses"] - before["misses"]
+    return {
+        "create_order_ms": _percentiles(order_ms),
+        "requests": len(first_ms) + len(repeat_ms) + orders,
+        "cache_hit_rate": round(hits / lookups, 4),
+        "first_load_ms": _percentiles(first_ms),
+        "repeat_load_ms": _percentiles(repeat_ms),
+        "if_none_match_304": f"{not_modified}/{orders}",
+        "cache_control": response.headers["cache-control"],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=200, help="payloads for round-trip and timing")
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        _configure_env(workdir)
+        report = {"correctness": _correctness(args.samples), "generation": _generation(args.samples)}
+        print(report, file=sys.stderr)
+        report["serving"] = asyncio.run(_serving(args.orders))
+
+    report["ok"] = all(report["correctness"]["checks"].values())
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,406 @@
+"""
+Zipline resilience layer (timeouts, retries, hedging, circuit breaker)
+against a local stub that injects latency and faults, either on its upload
+endpoint or on a GET /source/... endpoint standing in for the file URLs
+upload_file_from_url downloads. Calls ZiplineService.upload_bytes and
+upload_file_from_url directly with --file-kb payloads; dedup is off.
+
+Uploads are not idempotent (a timed-out or 5xx upload may still have been
+stored), so they are only retried when the request never went out, and never
+hedged; source downloads (GET) get full retries and hedging.
+
+Scenarios:
+  hang      stub stalls for 5 s: the per-attempt timeout ends the call first
+  flaky     --error-rate of source GETs are 503: success rate without / with
+            retries; --error-rate of uploads are 503: sent exactly once
+  connect   Zipline unreachable (connection refused): the upload is retried
+  client    stub answers 400: not retried, breaker untouched
+  tail      --slow-rate of source GETs take --slow-ms: p50/p99 without / with
+            hedging; slow uploads with hedging configured: no second copy
+  outage    stub returns 503 for --outage-s seconds under steady load: requests
+            that still reach Zipline and fail-fast rejections without / with
+            the breaker, recovery time after Zipline comes back, breaker gauge
+
+Exits 1 if any check fails.
+
+    cd backend
+    python -m benchmarks.zipline_resilience --calls 400 --error-rate 0.2 --slow-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks._common import _free_port
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def _configure_env(zipline_port: int, workdir: str) -> None:
+    # Must run before the app modules are imported: they read config at import time
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/resilience.db"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ["ZIPLINE_API_URL"] = f"http://127.0.0.1:{zipline_port}"
+    os.environ["ZIPLINE_API_KEY"] = "bench"
+    os.environ["ZIPLINE_DEDUP_ENABLED"] = "false"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+class FaultyZipline:
+    """
+    Zipline stub plus a source file server; the attributes are changed between
+    (and during) scenarios. Faults are injected on `fault_path` ("upload" or "source")
+    """
+
+    def __init__(self, seed: int, payload: bytes):
+        self.rng = random.Random(seed)
+        self.payload = payload
+        self.fault_path = "upload"
+        self.latency_ms = 20.0
+        self.slow_rate = 0.0
+        self.slow_ms = 0.0
+        self.error_rate = 0.0
+        self.status = 200
+        self.hang = False
+        self.requests = 0
+        self.source_requests = 0
+        self.errors = 0
+
+    async def _fault(self, path: str):
+        """Injected delay, then an error response or None"""
+        from aiohttp import web
+
+        faulty = path == self.fault_path
+        if faulty and self.hang:
+            await asyncio.sleep(5)
+        delay = self.latency_ms
+        if faulty and self.slow_rate and self.rng.random() < self.slow_rate:
+            delay = self.slow_ms
+        await asyncio.sleep(delay / 1000.0)
+        if faulty and (self.status != 200 or (self.error_rate and self.rng.random() < self.error_rate)):
+            self.errors += 1
+            return web.Response(status=self.status if self.status != 200 else 503, text="injected")
+        return None
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        self.requests += 1
+        await request.read()
+        error = await self._fault("upload")
+        if error is not None:
+            return error
+        return web.json_response({"files": [{"name": "f", "url": f"http://zipline.local/u/{self.requests}"}]})
+
+    async def source(self, request):
+        from aiohttp import web
+
+        self.source_requests += 1
+        error = await self._fault("source")
+        if error is not None:
+            return error
+        return web.Response(body=self.payload, content_type="application/octet-stream")
+
+    async def start(self, port: int):
+        from aiohttp import web
+
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_post("/api/upload", self.handle)
+        app.router.add_get("/source/{name}", self.source)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port, shutdown_timeout=1).start()
+        return runner
+
+
+def _percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def _configure(attempts: int = 1, hedge_delay: float = 0.0, breaker_failures: int = 0,
+               breaker_reset: float = 30.0, attempt_timeout: float = 15.0) -> None:
+    from services.resilience import CircuitBreaker
+    from services.zipline_service import ZiplineService
+
+    ZiplineService.RETRY_ATTEMPTS = attempts
+    ZiplineService.RETRY_BASE_DELAY = 0.05
+    ZiplineService.RETRY_MAX_DELAY = 0.5
+    ZiplineService.HEDGE_DELAY = hedge_delay
+    ZiplineService.ATTEMPT_TIMEOUT = attempt_timeout
+    ZiplineService.breaker = CircuitBreaker("zipline", breaker_failures, breaker_reset)
+
+
+def _attempts(outcome: str) -> float:
+    from prometheus_client import REGISTRY
+
+    return REGISTRY.get_sample_value("upstream_attempts_total", {"upstream": "zipline", "outcome": outcome}) or 0.0
+
+
+async def _load(send, calls: int, concurrency: int) -> dict:
+    latencies: list[float] = []
+    failures = 0
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        nonlocal failures
+        async with gate:
+            started = time.perf_counter()
+            try:
+                await send(i)
+            except Exception:
+                failures += 1
+            latencies.append((time.perf_counter() - started) * 1000.0)
+
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    return {
+        "calls": calls,
+        "success_rate": round(1 - failures / calls, 4),
+        "latency_ms": {
+            "p50": round(statistics.median(latencies), 1),
+            "p95": round(_percentile(latencies, 0.95), 1),
+            "p99": round(_percentile(latencies, 0.99), 1),
+            "max": round(max(latencies), 1),
+        },
+    }
+
+
+async def _outage(stub: FaultyZipline, payload: bytes, breaker: bool, args: argparse.Namespace) -> dict:
+    from prometheus_client import REGISTRY
+
+    from services.resilience import CircuitOpenError
+    from services.zipline_service import ZiplineService
+
+    _configure(attempts=3, breaker_failures=5 if breaker else 0, breaker_reset=args.breaker_reset_s)
+    stub.error_rate = 0.0
+    events: list[tuple[float, bool, str, float]] = []
+    max_gauge = 0.0
+    lead, outage, tail = 0.5, args.outage_s, args.breaker_reset_s + 1.5
+    started = time.perf_counter()
+    stop = started + lead + outage + tail
+
+    async def worker(n: int) -> None:
+        nonlocal max_gauge
+        i = 0
+        while time.perf_counter() < stop:
+            t0 = time.perf_counter()
+            kind = "ok"
+            try:
+                await ZiplineService.upload_bytes(payload, f"w{n}-{i}.bin", "application/octet-stream")
+            except CircuitOpenError:
+                kind = "rejected"
+            except Exception:
+                kind = "error"
+            events.append((t0 - started, kind == "ok", kind, time.perf_counter() - t0))
+            gauge = REGISTRY.get_sample_value("upstream_circuit_state", {"upstream": "zipline"}) or 0.0
+            max_gauge = max(max_gauge, gauge)
+            i += 1
+            if kind == "rejected":
+                # Callers get an immediate 503 + Retry-After; don't spin
+                await asyncio.sleep(0.02)
+
+    async def fault_window() -> int:
+        await asyncio.sleep(lead)
+        before = stub.errors
+        stub.status = 503
+        await asyncio.sleep(outage)
+        stub.status = 200
+        return stub.errors - before
+
+    requests_before = stub.requests
+    errors_served, *_ = await asyncio.gather(fault_window(), *(worker(n) for n in range(args.concurrency)))
+    outage_end = lead + outage
+    during = [e for e in events if lead <= e[0] < outage_end]
+    recovered = [e[0] for e in events if e[0] >= outage_end and e[1]]
+    failed_latency = [e[3] * 1000.0 for e in during if not e[1]]
+    return {
+        "breaker": breaker,
+        "calls_during_outage": len(during),
+        # Requests that reached the down Zipline (answered 503), in-flight ones included
+        "upstream_errors_served": errors_served,
+        "rejected_fast": sum(1 for e in during if e[2] == "rejected"),
+        "failed_call_p50_ms": round(statistics.median(failed_latency), 1) if failed_latency else None,
+        "recovery_seconds": round(recovered[0] - outage_end, 2) if recovered else None,
+        "upstream_requests_total": stub.requests - requests_before,
+        "max_circuit_gauge": max_gauge,
+        "final_state": ZiplineService.breaker.state,
+    }
+
+
+async def _run(args: argparse.Namespace, stub: FaultyZipline) -> dict:
+    from services.resilience import UpstreamHTTPError
+    from services.zipline_service import ZiplineService
+
+    payload = stub.payload
+    await ZiplineService.startup()
+    report: dict = {}
+    checks: dict[str, bool] = {}
+    try:
+        # hang: per-attempt timeout instead of the 60 s sock_read
+        _configure(attempts=1, attempt_timeout=0.5)
+        stub.hang = True
+        started = time.perf_counter()
+        try:
+            await ZiplineService.upload_bytes(payload, "hang.bin", "application/octet-stream")
+            error = None
+        except Exception as e:
+            error = type(e).__name__
+        elapsed = time.perf_counter() - started
+        stub.hang = False
+        report["hang"] = {"attempt_timeout_s": 0.5, "seconds": round(elapsed, 2), "error": error}
+        checks["hang_times_out"] = error == "TimeoutError" and elapsed < 1.5
+        print("hang", report["hang"], file=sys.stderr)
+
+        def upload(i: int):
+            return ZiplineService.upload_bytes(payload, f"frame-{i}.bin", "application/octet-stream")
+
+        def relay(i: int):
+            return ZiplineService.upload_file_from_url(f"{ZiplineService.ZIPLINE_API_URL}/source/{i}", f"relay-{i}.bin")
+
+        # flaky: source GETs are retried with jittered backoff, uploads are not
+        stub.fault_path, stub.error_rate = "source", args.error_rate
+        report["flaky"] = {}
+        for attempts in (1, 3):
+            _configure(attempts=attempts)
+            before = stub.source_requests
+            row = await _load(relay, args.calls, args.concurrency)
+            row["source_requests"] = stub.source_requests - before
+            report["flaky"][f"source_attempts_{attempts}"] = row
+            print("flaky source", attempts, row, file=sys.stderr)
+        stub.fault_path = "upload"
+        _configure(attempts=3)
+        before = stub.requests
+        row = await _load(upload, args.calls, args.concurrency)
+        row["upstream_requests"] = stub.requests - before
+        report["flaky"]["upload_attempts_3"] = row
+        print("flaky upload", row, file=sys.stderr)
+        stub.error_rate = 0.0
+        expected = 1 - args.error_rate ** 3
+        flaky = report["flaky"]
+        checks["retries_recover_transient"] = (
+            flaky["source_attempts_3"]["success_rate"] >= expected - 0.02
+            and flaky["source_attempts_3"]["success_rate"] > flaky["source_attempts_1"]["success_rate"]
+        )
+        checks["upload_5xx_not_retried"] = flaky["upload_attempts_3"]["upstream_requests"] == args.calls
+
+        # connect: nothing listening, so the upload never went out and is retried
+        _configure(attempts=3)
+        real_url = ZiplineService.ZIPLINE_API_URL
+        ZiplineService.ZIPLINE_API_URL = f"http://127.0.0.1:{_free_port()}"
+        before = _attempts("transient")
+        try:
+            await ZiplineService.upload_bytes(payload, "refused.bin", "application/octet-stream")
+            error = None
+        except Exception as e:
+            error = type(e).__name__
+        ZiplineService.ZIPLINE_API_URL = real_url
+        report["connect"] = {"error": error, "attempts": int(_attempts("transient") - before)}
+        checks["connect_error_retried"] = report["connect"]["attempts"] == 3
+        print("connect", report["connect"], file=sys.stderr)
+
+        # client: 4xx is not retried and does not count against the breaker
+        _configure(attempts=3, breaker_failures=1)
+        stub.status = 400
+        before = stub.requests
+        try:
+            await ZiplineService.upload_bytes(payload, "bad.bin", "application/octet-stream")
+            status = None
+        except UpstreamHTTPError as e:
+            status = e.status
+        stub.status = 200
+        report["client"] = {"status": status, "upstream_requests": stub.requests - before,
+                            "breaker": ZiplineService.breaker.state}
+        checks["client_error_not_retried"] = (
+            status == 400 and report["client"]["upstream_requests"] == 1 and ZiplineService.breaker.state == "closed"
+        )
+
+        # tail: hedged source GETs; uploads stay single even with hedging configured
+        stub.slow_rate, stub.slow_ms = args.slow_rate, args.slow_ms
+        stub.fault_path = "source"
+        report["tail"] = {}
+        for hedge in (0.0, args.hedge_ms / 1000.0):
+            _configure(attempts=1, hedge_delay=hedge)
+            before = stub.source_requests
+            row = await _load(relay, args.calls, args.concurrency)
+            row["extra_source_requests"] = stub.source_requests - before - args.calls
+            report["tail"][f"source_hedge_{int(hedge * 1000)}ms"] = row
+            print("tail source", hedge, row, file=sys.stderr)
+        stub.fault_path = "upload"
+        before = stub.requests
+        row = await _load(upload, args.calls, args.concurrency)
+        row["extra_upstream_requests"] = stub.requests - before - args.calls
+        report["tail"][f"upload_hedge_{args.hedge_ms}ms"] = row
+        print("tail upload", row, file=sys.stderr)
+        stub.slow_rate = 0.0
+        plain, hedged = report["tail"]["source_hedge_0ms"], report["tail"][f"source_hedge_{args.hedge_ms}ms"]
+        checks["hedging_cuts_p99"] = hedged["latency_ms"]["p99"] < plain["latency_ms"]["p99"] / 2
+        checks["uploads_not_hedged"] = row["extra_upstream_requests"] == 0
+
+        # outage: circuit breaker
+        report["outage"] = {}
+        for breaker in (False, True):
+            row = await _outage(stub, payload, breaker, args)
+            report["outage"]["breaker" if breaker else "no_breaker"] = row
+            print("outage", row, file=sys.stderr)
+        without, with_breaker = report["outage"]["no_breaker"], report["outage"]["breaker"]
+        checks["breaker_sheds_load"] = (
+            with_breaker["upstream_errors_served"] < without["upstream_errors_served"] / 4
+            and with_breaker["rejected_fast"] > 0
+        )
+        checks["breaker_gauge_exported"] = with_breaker["max_circuit_gauge"] == 2.0
+        checks["breaker_recovers"] = (
+            with_breaker["final_state"] == "closed"
+            and with_breaker["recovery_seconds"] is not None
+            and with_breaker["recovery_seconds"] <= args.breaker_reset_s + 0.5
+        )
+    finally:
+        await ZiplineService.shutdown()
+
+    report["checks"] = checks
+    report["ok"] = all(checks.values())
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--file-kb", type=int, default=64)
+    parser.add_argument("--error-rate", type=float, default=0.2)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-ms", type=float, default=1000.0)
+    parser.add_argument("--hedge-ms", type=int, default=100)
+    parser.add_argument("--outage-s", type=float, default=2.0)
+    parser.add_argument("--breaker-reset-s", type=float, default=1.0)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        zipline_port = _free_port()
+        _configure_env(zipline_port, workdir)
+
+        async def run() -> dict:
+            stub = FaultyZipline(seed=23, payload=os.urandom(args.file_kb * 1024))
+            runner = await stub.start(zipline_port)
+            try:
+                return await _run(args, stub)
+            finally:
+                await runner.cleanup()
+
+        report = asyncio.run(run())
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
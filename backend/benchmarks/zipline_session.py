@@ -0,0 +1,191 @@
+"""
+Latency and throughput of Zipline uploads through the shared, pooled
+ClientSession (ZiplineService.upload_file) vs the previous pattern of one
+ClientSession per upload (new connector, new TCP connection, closed after
+each call), against the local Zipline stub from benchmarks._common. The stub
+counts the TCP connections it accepts. Both paths stream the same in-memory
+UploadFile through ZiplineService._iter_upload_file. Dedup is off so every
+call goes out.
+
+Exits 1 if the shared session opens more connections than it runs uploads in
+parallel, or is not faster than a session per upload.
+
+    cd backend
+    python -m benchmarks.zipline_session --calls 2000 --concurrency 20 --file-kb 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks._common import _free_port, _percentile, _start_zipline_stub
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def _configure_env(zipline_port: int, workdir: str) -> None:
+    # Must run before the app modules are imported: they read config at import time
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/zipline_session.db"
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ["ZIPLINE_API_URL"] = f"http://127.0.0.1:{zipline_port}"
+    os.environ["ZIPLINE_API_KEY"] = "bench"
+    os.environ["ZIPLINE_DEDUP_ENABLED"] = "false"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def _count_connections(runner) -> list[int]:
+    """Counter of TCP connections the stub accepts from now on"""
+    accepted = [0]
+    server = runner.server
+    connection_made = server.connection_made
+
+    def counted(handler, transport) -> None:
+        accepted[0] += 1
+        connection_made(handler, transport)
+
+    server.connection_made = counted
+    return accepted
+
+
+def _upload_file(payload: bytes, filename: str):
+    """An UploadFile held in memory, like a small request body Starlette has spooled"""
+    from starlette.datastructures import Headers, UploadFile
+
+    buffer = tempfile.SpooledTemporaryFile(max_size=len(payload) + 1)
+    buffer.write(payload)
+    buffer.seek(0)
+    headers = Headers({"content-type": "application/octet-stream"})
+    return UploadFile(buffer, size=len(payload), filename=filename, headers=headers)
+
+
+async def _per_request_upload(payload: bytes, filename: str) -> dict:
+    """The pre-pooling upload: a throwaway ClientSession per call"""
+    import aiohttp
+
+    from services.zipline_service import ZiplineService
+
+    file = _upload_file(payload, filename)
+    data = aiohttp.FormData()
+    data.add_field("file", ZiplineService._iter_upload_file(file), filename=filename,
+                   content_type="application/octet-stream")
+    async with aiohttp.ClientSession() as session:
+        async with session.post(
+            f"{ZiplineService.ZIPLINE_API_URL}/api/upload",
+            data=data,
+            headers={"Authorization": ZiplineService.ZIPLINE_API_KEY},
+        ) as response:
+            if response.status != 200:
+                raise Exception(f"Zipline upload failed: {response.status}")
+            return (await response.json())["files"][0]
+
+
+async def _load(send, calls: int, concurrency: int) -> dict:
+    latencies: list[float] = []
+    failures = 0
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        nonlocal failures
+        async with gate:
+            started = time.perf_counter()
+            try:
+                await send(i)
+            except Exception:
+                failures += 1
+            latencies.append((time.perf_counter() - started) * 1000.0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "calls": calls,
+        "failures": failures,
+        "p50_ms": round(_percentile(latencies, 50), 3),
+        "p95_ms": round(_percentile(latencies, 95), 3),
+        "p99_ms": round(_percentile(latencies, 99), 3),
+        "throughput_rps": round(calls / elapsed, 1),
+    }
+
+
+async def _run(args: argparse.Namespace, runner) -> dict:
+    from services.zipline_service import ZiplineService
+
+    payload = os.urandom(args.file_kb * 1024)
+    accepted = _count_connections(runner)
+    results = {}
+
+    await ZiplineService.startup()
+    try:
+        # Warm-up outside the measurement (imports, first connection)
+        await ZiplineService.upload_file(_upload_file(payload, "warmup.bin"))
+        await _per_request_upload(payload, "warmup.bin")
+
+        def shared(i: int):
+            return ZiplineService.upload_file(_upload_file(payload, f"s-{i}.bin"))
+
+        def per_request(i: int):
+            return _per_request_upload(payload, f"p-{i}.bin")
+
+        for mode, send in (("per_request", per_request), ("shared", shared)):
+            before = accepted[0]
+            row = await _load(send, args.calls, args.concurrency)
+            row["connections_opened"] = accepted[0] - before
+            results[mode] = row
+            print(mode, row, file=sys.stderr)
+    finally:
+        await ZiplineService.shutdown()
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--file-kb", type=int, default=16)
+    parser.add_argument("--zipline-latency-ms", type=float, default=2.0)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        zipline_port = _free_port()
+        _configure_env(zipline_port, workdir)
+
+        async def run() -> dict:
+            runner = await _start_zipline_stub(zipline_port, args.zipline_latency_ms)
+            try:
+                return await _run(args, runner)
+            finally:
+                await runner.cleanup()
+
+        results = asyncio.run(run())
+
+    shared, per_request = results["shared"], results["per_request"]
+    checks = {
+        "no_failures": shared["failures"] == 0 and per_request["failures"] == 0,
+        # Connections already open from the warm-up are reused, so at most one per concurrent upload
+        "shared_reuses_connections": shared["connections_opened"] <= args.concurrency,
+        "shared_faster": shared["throughput_rps"] > per_request["throughput_rps"],
+    }
+    report = {
+        "calls": args.calls,
+        "concurrency": args.concurrency,
+        "file_kb": args.file_kb,
+        "zipline_latency_ms": args.zipline_latency_ms,
+        **results,
+        "speedup": round(shared["throughput_rps"] / per_request["throughput_rps"], 2),
+        "checks": checks,
+        "ok": all(checks.values()),
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+import argparse
+import sys
+
+from database import Base, engine, ensure_indexes
+import models  # noqa: F401  (registers the tables on Base.metadata)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Create indexes declared in models.py that are missing on existing tables "
+                    "(CREATE INDEX CONCURRENTLY IF NOT EXISTS on PostgreSQL)"
+    )
+    parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    result = ensure_indexes(engine)
+    print(result)
+    # An invalid index is skipped by IF NOT EXISTS: DROP INDEX CONCURRENTLY it and rerun
+    return 1 if result["invalid"] else 0
+
+
+if __name__ == "__main__":
+    # cd backend && python -m create_indexes   (deploy step, before starting the new app version)
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import os
+import secrets
+import threading
+import time
+import uuid
+
+# Crockford base32: no I/L/O/U, so IDs survive case changes and common misreads
+CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+
+class MonotonicClock:
+    """
+    (unix_ms, random) pairs that strictly increase within this process.
+    A new millisecond draws fresh random bits; IDs made in the same
+    millisecond (or after the wall clock steps back) reuse the last
+    timestamp and increment the random part, so ordering never breaks and
+    nothing collides in-process. Across processes the random bits make a
+    collision negligible (unique indexes still back it).
+    """
+
+    def __init__(self, random_bits: int):
+        self.random_bits = random_bits
+        self._last_ms = -1
+        self._last_random = 0
+        self._lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            # Forked workers must not continue the parent's sequence
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self) -> None:
+        self._lock = threading.Lock()
+        self._last_ms = -1
+
+    def next(self) -> tuple[int, int]:
+        now_ms = time.time_ns() // 1_000_000
+        with self._lock:
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                # Leave headroom so increments rarely overflow into the timestamp
+                self._last_random = secrets.randbits(self.random_bits - 1)
+            else:
+                self._last_random += 1
+                if self._last_random >> self.random_bits:
+                    self._last_ms += 1
+                    self._last_random = secrets.randbits(self.random_bits - 1)
+            return self._last_ms, self._last_random
+
+
+_uuid7_clock = MonotonicClock(random_bits=74)
+_ulid_clock = MonotonicClock(random_bits=80)
+
+
+def uuid7() -> uuid.UUID:
+    """RFC 9562 UUIDv7: 48-bit unix ms, then 74 random/counter bits"""
+    unix_ms, rand = _uuid7_clock.next()
+    rand_a = rand >> 62
+    rand_b = rand & ((1 << 62) - 1)
+    value = (unix_ms & ((1 << 48) - 1)) << 80 | 0x7 << 76 | rand_a << 64 | 0b10 << 62 | rand_b
+    return uuid.UUID(int=value)
+
+
+def new_id() -> str:
+    """Primary key for users / payments / credit_transactions (same 36-char format as uuid4)"""
+    return str(uuid7())
+
+
+def ulid() -> str:
+    """26-char ULID (48-bit unix ms + 80 random/counter bits, Crockford base32)"""
+    unix_ms, rand = _ulid_clock.next()
+    value = (unix_ms & ((1 << 48) - 1)) << 80 | rand
+    chars = []
+    for _ in range(26):
+        chars.append(CROCKFORD[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
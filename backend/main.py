@@ -1,19 +1,46 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
+from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 
-from api.routes import auth, upload, users, payments
-from database import engine, Base
+from api.routes import auth, upload, users, payments, render
+import metrics
+import profiling
+from database import engine, async_engine, Base
+from rate_limit import limiter
+from services.image_service import ImageService
+from services.payment_expiry import PaymentExpiryService
+from services.render_jobs import render_scheduler
+from services.resumable_upload import ResumableUploadService
+from services.zipline_service import ZiplineService
 
-# Create tables
+# Create tables (indexes added to existing tables: `python -m create_indexes`)
 Base.metadata.create_all(bind=engine)
 
-# Create limiter for rate limiting
-limiter = Limiter(key_func=get_remote_address)
 
-app = FastAPI(title="RenderTool API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared pooled HTTP client for Zipline
+    await ZiplineService.startup()
+    ImageService.startup()
+    sweeper = PaymentExpiryService.start_background_sweeper()
+    upload_cleanup = ResumableUploadService.start_background_cleanup()
+    render_scheduler.start()
+    try:
+        yield
+    finally:
+        for task in (sweeper, upload_cleanup):
+            if task is not None:
+                task.cancel()
+        await render_scheduler.stop()
+        ImageService.shutdown()
+        await ZiplineService.shutdown()
+        await async_engine.dispose()
+
+
+app = FastAPI(title="RenderTool API", version="1.0.0", lifespan=lifespan)
 
 # Add rate limiting state
 app.state.limiter = limiter
@@ -27,12 +54,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if profiling.PROFILING_ENABLED:
+    app.add_middleware(profiling.ProfilingMiddleware)
+
+# Added last so it wraps everything, including CORS and rate limiting responses
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(upload.router, prefix="/api/upload", tags=["upload"])
 app.include_router(users.router, prefix="/api/users", tags=["users"])
 app.include_router(payments.router, prefix="/api/payments", tags=["payments"])
+app.include_router(render.router, prefix="/api/render", tags=["render"])
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    body, content_type = metrics.render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+if profiling.PROFILING_ENABLED:
+    @app.get("/debug/profiles/{profile_id}", include_in_schema=False)
+    def get_profile(profile_id: str, x_profile: str | None = Header(default=None)):
+        if not profiling.is_admin_token(x_profile):
+            raise HTTPException(status_code=403, detail="Forbidden")
+        summary = profiling.recent_profiles.get(profile_id)
+        if summary is None:
+            raise HTTPException(status_code=404, detail="Profile not found")
+        return summary
+
+    # After every route is registered
+    profiling.instrument_routes(app)
@@ -0,0 +1,225 @@
+import os
+import time
+from contextvars import ContextVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import REGISTRY, multiprocess
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in {"1", "true", "yes"}
+# Set (to an empty, writable dir) when running several uvicorn/gunicorn workers so
+# /metrics aggregates all of them instead of whichever worker answered
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Request latencies in seconds; upstream calls (Zipline) get a longer tail
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+UPSTREAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds",
+    "Duration of individual SQL statements",
+    ["engine"],
+    buckets=QUERY_BUCKETS,
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request",
+    "SQL statements issued per HTTP request",
+    ["route"],
+    buckets=COUNT_BUCKETS,
+)
+DB_SECONDS_PER_REQUEST = Histogram(
+    "db_time_per_request_seconds",
+    "Total time spent in SQL statements per HTTP request",
+    ["route"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled DB connection",
+    ["engine"],
+    buckets=QUERY_BUCKETS,
+)
+ZIPLINE_UPLOAD_SECONDS = Histogram(
+    "zipline_upload_duration_seconds",
+    "Zipline upload latency",
+    ["source", "outcome"],
+    buckets=UPSTREAM_BUCKETS,
+)
+ZIPLINE_UPLOAD_BYTES = Counter(
+    "zipline_upload_bytes",
+    "Bytes streamed to Zipline",
+    ["source"],
+)
+UPSTREAM_ATTEMPTS = Counter(
+    "upstream_attempts",
+    "Individual upstream call attempts (retries and hedges included) by outcome",
+    ["upstream", "outcome"],
+)
+UPSTREAM_HEDGES = Counter(
+    "upstream_hedged_requests",
+    "Calls that started a hedge request, by which copy answered first",
+    ["upstream", "winner"],
+)
+# Worst state across live workers when aggregated: 0 closed, 1 half-open, 2 open
+UPSTREAM_CIRCUIT_STATE = Gauge(
+    "upstream_circuit_state",
+    "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+    ["upstream"],
+    multiprocess_mode="livemax",
+)
+UPSTREAM_CIRCUIT_OPENED = Counter(
+    "upstream_circuit_opened",
+    "Times the circuit breaker opened",
+    ["upstream"],
+)
+RENDER_JOB_OUTCOMES = Counter(
+    "render_job_outcomes",
+    "Finished render attempts by outcome (succeeded, retried, failed, expired)",
+    ["outcome"],
+)
+RENDER_QUEUE_WAIT_SECONDS = Histogram(
+    "render_queue_wait_seconds",
+    "Time a render job waited in the queue before a worker picked it up",
+    ["priority"],
+    buckets=UPSTREAM_BUCKETS,
+)
+RENDER_SECONDS = Histogram(
+    "render_duration_seconds",
+    "Render attempt duration",
+    ["outcome"],
+    buckets=UPSTREAM_BUCKETS,
+)
+CACHE_LOOKUPS = Counter(
+    "cache_lookups",
+    "In-process cache lookups by result (hit, miss)",
+    ["cache", "result"],
+)
+CACHE_EVICTIONS = Counter(
+    "cache_evictions",
+    "Entries dropped from an in-process cache (expired or LRU)",
+    ["cache"],
+)
+WEBHOOK_OUTCOMES = Counter(
+    "payment_webhook_outcomes",
+    "Processed payment webhook notifications by outcome",
+    ["status"],
+)
+
+# Per-request [query count, query seconds], set by MetricsMiddleware. Routes run
+# in a copy of the request context (threadpool / run_sync greenlet), so the
+# engine listeners mutate the same list.
+_request_db: ContextVar[list | None] = ContextVar("metrics_request_db", default=None)
+
+
+def instrument_engine(engine, name: str) -> None:
+    """
+    Time every statement on a (sync) Engine and add it to the current
+    request's totals. For an AsyncEngine pass `async_engine.sync_engine`.
+    """
+    histogram = DB_QUERY_SECONDS.labels(engine=name)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_query_start"].pop()
+        histogram.observe(elapsed)
+        totals = _request_db.get()
+        if totals is not None:
+            totals[0] += 1
+            totals[1] += elapsed
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a free connection"""
+
+    metrics_engine = "sync"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.labels(engine=self.metrics_engine).observe(time.perf_counter() - started)
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that records how long checkouts wait for a free connection"""
+
+    metrics_engine = "async"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.labels(engine=self.metrics_engine).observe(time.perf_counter() - started)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no BaseHTTPMiddleware task/stream wrapping) recording
+    latency and DB usage per route template. Requests that match no route are
+    grouped under "unmatched" so random paths can't blow up label cardinality.
+
+    Overhead budget: under 50 µs per request (3 histogram observations plus a
+    ContextVar set); benchmarks/loadtest.py --no-metrics measures the difference.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        totals = [0, 0.0]
+        token = _request_db.set(totals)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_db.reset(token)
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.labels(scope["method"], template, str(status)).observe(elapsed)
+            DB_QUERIES_PER_REQUEST.labels(template).observe(totals[0])
+            DB_SECONDS_PER_REQUEST.labels(template).observe(totals[1])
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Returns (body, content type) in the Prometheus text exposition format"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
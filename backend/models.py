@@ -1,11 +1,20 @@
-from sqlalchemy import Column, String, Float, DateTime, Boolean, Text
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, String, Float, DateTime, Boolean, Text, Index, Integer
 from sqlalchemy.sql import func
 from database import Base
+from ids import new_id
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
 
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(String, primary_key=True)
+    # UUIDv7: time-ordered, so new rows append to the right edge of the PK index
+    id = Column(String, primary_key=True, default=new_id)
     email = Column(String, unique=True, index=True)
     name = Column(String)
     picture = Column(String, nullable=True)  # avatar_url saved here
@@ -16,11 +25,20 @@ class User(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
 
+class UserAvatar(Base):
+    __tablename__ = "user_avatars"
+
+    user_id = Column(String, primary_key=True)
+    # JSON list of resized renditions: [{ "size", "format", "url", "bytes" }] (see ImageService)
+    renditions = Column(Text, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
 class Payment(Base):
     __tablename__ = "payments"
 
-    # Internal id
-    id = Column(String, primary_key=True)
+    # Internal id (UUIDv7)
+    id = Column(String, primary_key=True, default=new_id)
 
     # Owner
     user_id = Column(String, index=True, nullable=True)
@@ -28,7 +46,7 @@ class Payment(Base):
     # External/public identifier used by frontend + webhook
     transaction_id = Column(String, unique=True, index=True, nullable=False)
 
-    # PENDING | COMPLETED | FAILED
+    # PENDING | COMPLETED | FAILED | EXPIRED (QR never paid, see PaymentExpiryService)
     status = Column(String, index=True, default="PENDING")
 
     # BANK_TRANSFER_QR
@@ -41,20 +59,30 @@ class Payment(Base):
     # Bank transfer info
     bank_name = Column(String, default="VietinBank")
     account_number = Column(String, default="113366668888")
-    transfer_content = Column(String, nullable=False)
+    # Indexed: bank statement reconciliation looks payments up by it
+    transfer_content = Column(String, nullable=False, index=True)
     qr_code_url = Column(String, nullable=True)
 
     # Webhook debugging / idempotency inspection
     raw_webhook = Column(Text, nullable=True)
 
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Set app-side too: keyset cursors need sub-second precision and the same
+    # stored format as bound parameters (SQLite's CURRENT_TIMESTAMP has neither)
+    created_at = Column(DateTime(timezone=True), default=_utcnow, server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
+    __table_args__ = (
+        # Expiry sweeper: status = 'PENDING' AND created_at < cutoff is a range scan
+        Index("ix_payments_status_created_at", "status", "created_at"),
+        # Payment history keyset pagination (HistoryService)
+        Index("ix_payments_user_created_id", "user_id", "created_at", "id"),
+    )
+
 
 class CreditTransaction(Base):
     __tablename__ = "credit_transactions"
 
-    id = Column(String, primary_key=True)
+    id = Column(String, primary_key=True, default=new_id)
     user_id = Column(String, index=True, nullable=False)
 
     # Link to a payment transaction_id (optional)
@@ -64,5 +92,90 @@ class CreditTransaction(Base):
     type = Column(String, index=True, nullable=False)
 
     amount = Column(Float, nullable=False, default=0.0)
+    created_at = Column(DateTime(timezone=True), default=_utcnow, server_default=func.now())
+
+    __table_args__ = (
+        # Credit history keyset pagination (HistoryService)
+        Index("ix_credit_transactions_user_created_id", "user_id", "created_at", "id"),
+        # Incremental ledger audits scan only rows newer than the last snapshot
+        Index("ix_credit_transactions_created_at", "created_at"),
+    )
+
+
+class LedgerSnapshot(Base):
+    __tablename__ = "ledger_snapshots"
+
+    id = Column(String, primary_key=True, default=new_id)
+
+    # Every credit transaction with created_at <= watermark is folded into ledger_balances
+    watermark = Column(DateTime(timezone=True), index=True, nullable=False)
+
+    users = Column(Integer, default=0)
+    transactions = Column(Integer, default=0)  # ledger rows folded by this snapshot
+    drifted = Column(Integer, default=0)  # users whose credits disagreed with the ledger
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+
+class LedgerBalance(Base):
+    __tablename__ = "ledger_balances"
+
+    # Sum of a user's credit transactions up to the snapshot watermark (see LedgerAuditService)
+    user_id = Column(String, primary_key=True)
+    amount = Column(Float, nullable=False, default=0.0)
+    transactions = Column(Integer, nullable=False, default=0)
+    snapshot_id = Column(String, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class RenderJob(Base):
+    __tablename__ = "render_jobs"
+
+    id = Column(String, primary_key=True, default=new_id)
+    user_id = Column(String, nullable=False)
+
+    # QUEUED -> RUNNING -> SUCCEEDED | FAILED; QUEUED -> CANCELLED (see RenderJobService)
+    status = Column(String, nullable=False, default="QUEUED")
+    # 0 low, 1 normal, 2 high
+    priority = Column(Integer, nullable=False, default=1)
+
+    # JSON render parameters, passed to the renderer as is
+    params = Column(Text, nullable=False, default="{}")
+
+    # Credits reserved at submit; given back once (refunded = True) if the job fails or is cancelled
+    cost = Column(Float, nullable=False, default=0.0)
+    refunded = Column(Boolean, nullable=False, default=False)
+
+    attempts = Column(Integer, nullable=False, default=0)
+    # A requeued job (transient failure) isn't picked up before this
+    available_at = Column(DateTime(timezone=True), default=_utcnow)
+    # RUNNING jobs whose lease ran out (worker died) are requeued or failed
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    worker_id = Column(String, nullable=True)
+
+    output_url = Column(String, nullable=True)
+    error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), default=_utcnow, server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # Scheduler: oldest QUEUED jobs, RUNNING counts, expired leases
+        Index("ix_render_jobs_status_created_at", "status", "created_at"),
+        # Per-user queue limit and fair-share counts
+        Index("ix_render_jobs_user_status", "user_id", "status"),
+    )
+
+
+class WebhookEvent(Base):
+    __tablename__ = "webhook_events"
+
+    # Idempotency-Key header / gateway event id / hash of the payload
+    idempotency_key = Column(String, primary_key=True)
+
+    transaction_id = Column(String, index=True, nullable=True)
+
+    # JSON response returned for this event (replayed on duplicates)
+    response = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,234 @@
+import asyncio
+import cProfile
+import functools
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+from services.cache import LRUTTLCache
+
+# Requests carrying `X-Profile: <PROFILE_ADMIN_TOKEN>` are always profiled;
+# otherwise a PROFILE_SAMPLE_RATE fraction of requests is. With neither set
+# the middleware and SQL listeners are not installed at all.
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_HEADER = b"x-profile"
+# Optional: also write <id>.prof (pstats / snakeviz) and <id>.json here
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "30"))
+PROFILE_MAX_QUERIES = int(os.getenv("PROFILE_MAX_QUERIES", "200"))
+
+PROFILING_ENABLED = bool(PROFILE_ADMIN_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+# Recent summaries, served by GET /debug/profiles/{id}
+recent_profiles = LRUTTLCache(max_entries=100, ttl_seconds=3600)
+
+_active: ContextVar["RequestProfile | None"] = ContextVar("profiling_active", default=None)
+# One profiled request per process: cProfile hooks are per thread, and a second
+# profiler on the event loop thread would replace the first
+_busy = threading.Lock()
+
+
+class RequestProfile:
+    """cProfile data and SQL statements collected for one request"""
+
+    def __init__(self, method: str, path: str, reason: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.route: str | None = None
+        self.status: int | None = None
+        self.started_at = time.time()
+        self.duration_ms = 0.0
+        self.profiles: list[cProfile.Profile] = []
+        self.queries: list[dict] = []
+        self.query_count = 0
+        self.query_ms = 0.0
+        self._lock = threading.Lock()
+
+    def add_profile(self, profile: cProfile.Profile) -> None:
+        with self._lock:
+            self.profiles.append(profile)
+
+    def record_query(self, statement: str, elapsed: float, executemany: bool) -> None:
+        with self._lock:
+            self.query_count += 1
+            self.query_ms += elapsed * 1000.0
+            if len(self.queries) < PROFILE_MAX_QUERIES:
+                self.queries.append({
+                    "sql": " ".join(statement.split()),
+                    "ms": round(elapsed * 1000.0, 3),
+                    "executemany": executemany,
+                })
+
+    def _stats(self) -> pstats.Stats | None:
+        if not self.profiles:
+            return None
+        stats = pstats.Stats(self.profiles[0], stream=io.StringIO())
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def summary(self) -> dict:
+        top = []
+        stats = self._stats()
+        if stats is not None:
+            stats.sort_stats("cumulative")
+            for func in stats.fcn_list[:PROFILE_TOP_N]:
+                calls, primitive, tottime, cumtime, _ = stats.stats[func]
+                filename, line, name = func
+                top.append({
+                    "function": f"{filename}:{line}({name})",
+                    "calls": calls,
+                    "tottime_ms": round(tottime * 1000.0, 3),
+                    "cumtime_ms": round(cumtime * 1000.0, 3),
+                })
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "reason": self.reason,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 3),
+            "sql_count": self.query_count,
+            "sql_ms": round(self.query_ms, 3),
+            "sql": self.queries,
+            "top_functions": top,
+        }
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        stats = self._stats()
+        if stats is not None:
+            stats.dump_stats(os.path.join(directory, f"{self.id}.prof"))
+        with open(os.path.join(directory, f"{self.id}.json"), "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+def is_admin_token(value: str | None) -> bool:
+    return bool(PROFILE_ADMIN_TOKEN) and value is not None and hmac.compare_digest(value, PROFILE_ADMIN_TOKEN)
+
+
+def instrument_engine(engine) -> None:
+    """Record the statements a profiled request issues (sync Engine or async_engine.sync_engine)"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _active.get() is not None:
+            conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        profile = _active.get()
+        if profile is not None:
+            started = conn.info["profile_query_start"].pop()
+            profile.record_query(statement, time.perf_counter() - started, executemany)
+
+
+def _profile_sync_call(func):
+    # Sync endpoints run in a threadpool thread the loop-thread profiler can't see
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = _active.get()
+        if profile is None:
+            return func(*args, **kwargs)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            profile.add_profile(profiler)
+
+    return wrapper
+
+
+def instrument_routes(app) -> None:
+    """Wrap sync endpoints so their threadpool execution is profiled too. Call after include_router."""
+    for route in app.routes:
+        if isinstance(route, APIRoute) and not asyncio.iscoroutinefunction(route.dependant.call):
+            route.dependant.call = _profile_sync_call(route.dependant.call)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles selected requests with cProfile and records their SQL.
+    The event loop thread is profiled for the whole request (async handlers,
+    routing, serialization) and sync endpoints in their worker thread. Loop
+    thread samples may include other requests interleaved at awaits.
+
+    Responses carry `X-Profile-Id` and a Server-Timing entry; the summary is
+    kept for GET /debug/profiles/{id} and optionally written to PROFILE_DIR.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _reason(self, scope) -> str | None:
+        if scope["path"].startswith("/debug/profiles/"):
+            return None
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return "header" if is_admin_token(value.decode("latin-1")) else None
+        if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        reason = self._reason(scope)
+        if reason is None or not _busy.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            profile = RequestProfile(scope["method"], scope["path"], reason)
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    profile.status = message["status"]
+                    timing = f"sql;desc=\"{profile.query_count} queries\";dur={profile.query_ms:.3f}"
+                    message = {
+                        **message,
+                        "headers": [
+                            *message.get("headers", []),
+                            (b"x-profile-id", profile.id.encode("latin-1")),
+                            (b"server-timing", timing.encode("latin-1")),
+                        ],
+                    }
+                await send(message)
+
+            token = _active.set(profile)
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                profiler.disable()
+                profile.duration_ms = (time.perf_counter() - started) * 1000.0
+                _active.reset(token)
+                profile.add_profile(profiler)
+                route = scope.get("route")
+                profile.route = getattr(route, "path", None)
+                recent_profiles.set(profile.id, await run_in_threadpool(profile.summary))
+                if PROFILE_DIR:
+                    await run_in_threadpool(profile.save, PROFILE_DIR)
+        finally:
+            _busy.release()
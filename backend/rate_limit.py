@@ -0,0 +1,237 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from math import floor
+from urllib.parse import urlparse
+
+from limits.storage import Storage
+from limits.storage.base import SlidingWindowCounterSupport, TimestampedSlidingWindow
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single-process only
+    fcntl = None
+
+
+class MmapStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """
+    Rate limit storage shared by every worker on the host through a
+    memory-mapped file (`mmap:///dev/shm/rendertool-ratelimit`).
+
+    The file is a fixed-size open-addressing table of
+    (key digest, expiry, counter) slots; each key probes a bounded number of
+    slots, so every check is O(1) and expired entries are reused in place
+    (or the soonest-to-expire one is evicted when the probe window is full).
+    Cross-process atomicity comes from flock on the file.
+    """
+
+    STORAGE_SCHEME = ["mmap"]
+    # moving-window needs a per-hit timestamp log, which fixed-size slots can't hold
+    STRATEGIES = ("fixed-window", "sliding-window-counter")
+
+    MAGIC = b"RTRL0001"
+    HEADER = struct.Struct("<8sQ")
+    SLOT = struct.Struct("<16sdq")
+    PROBES = 16
+    EMPTY = b"\x00" * 16
+
+    def __init__(self, uri: str | None = None, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        parsed = urlparse(uri or "mmap://")
+        self.path = parsed.path or os.path.join(tempfile.gettempdir(), "rendertool-ratelimit")
+        self.slots = int(options.get("slots", os.getenv("RATE_LIMIT_MMAP_SLOTS", "65536")))
+        self.size = self.HEADER.size + self.slots * self.SLOT.size
+        self._thread_lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    @property
+    def base_exceptions(self):
+        return (OSError, ValueError)
+
+    # --- file / locking -------------------------------------------------
+
+    def _open(self) -> None:
+        # Re-open after fork so each worker has its own file description (flock is per description)
+        if self._pid == os.getpid():
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < self.size:
+                os.ftruncate(fd, self.size)
+            mapped = mmap.mmap(fd, self.size)
+            magic, slots = self.HEADER.unpack_from(mapped, 0)
+            if magic != self.MAGIC or slots != self.slots:
+                mapped[: self.size] = b"\x00" * self.size
+                self.HEADER.pack_into(mapped, 0, self.MAGIC, self.slots)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd, self._map, self._pid = fd, mapped, os.getpid()
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            self._open()
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    # --- slots (call with the lock held) --------------------------------
+
+    def _offset(self, index: int) -> int:
+        return self.HEADER.size + index * self.SLOT.size
+
+    def _find(self, key: str, now: float, create: bool) -> tuple[int, int, float] | None:
+        """
+        Returns (offset, count, expiry) of the live slot for key. With create,
+        returns a reusable slot (count 0) when the key has no live slot.
+        """
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        start = int.from_bytes(digest[:8], "little") % self.slots
+        reusable = None
+        oldest = None
+        for i in range(self.PROBES):
+            offset = self._offset((start + i) % self.slots)
+            slot_digest, expiry, count = self.SLOT.unpack_from(self._map, offset)
+            if slot_digest == digest and expiry > now:
+                return offset, count, expiry
+            if slot_digest == digest or slot_digest == self.EMPTY or expiry <= now:
+                if reusable is None:
+                    reusable = offset
+            elif oldest is None or expiry < oldest[1]:
+                oldest = (offset, expiry)
+        if not create:
+            return None
+        offset = reusable if reusable is not None else oldest[0]
+        self.SLOT.pack_into(self._map, offset, digest, 0.0, 0)
+        return offset, 0, 0.0
+
+    def _incr(self, key: str, expiry: float, amount: int, now: float) -> int:
+        offset, count, slot_expiry = self._find(key, now, create=True)
+        digest = self.SLOT.unpack_from(self._map, offset)[0]
+        if count == 0 and slot_expiry == 0.0:
+            slot_expiry = now + expiry
+        count += amount
+        self.SLOT.pack_into(self._map, offset, digest, slot_expiry, count)
+        return count
+
+    def _get(self, key: str, now: float) -> int:
+        found = self._find(key, now, create=False)
+        return found[1] if found else 0
+
+    # --- limits.Storage -------------------------------------------------
+
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        with self._locked():
+            return self._incr(key, expiry, amount, time.time())
+
+    def get(self, key: str) -> int:
+        with self._locked():
+            return self._get(key, time.time())
+
+    def get_expiry(self, key: str) -> float:
+        now = time.time()
+        with self._locked():
+            found = self._find(key, now, create=False)
+        return found[2] if found else now
+
+    def check(self) -> bool:
+        try:
+            with self._locked():
+                return True
+        except OSError:
+            return False
+
+    def reset(self) -> int | None:
+        now = time.time()
+        with self._locked():
+            live = 0
+            for index in range(self.slots):
+                _, expiry, _ = self.SLOT.unpack_from(self._map, self._offset(index))
+                if expiry > now:
+                    live += 1
+            self._map[self.HEADER.size : self.size] = b"\x00" * (self.size - self.HEADER.size)
+            return live
+
+    def clear(self, key: str) -> None:
+        with self._locked():
+            found = self._find(key, time.time(), create=False)
+            if found:
+                self.SLOT.pack_into(self._map, found[0], self.EMPTY, 0.0, 0)
+
+    # --- sliding window counter ----------------------------------------
+
+    def _sliding_window_info(self, key: str, expiry: int, now: float) -> tuple[int, float, int, float]:
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous_count = self._get(previous_key, now)
+        current_count = self._get(current_key, now)
+        if previous_count == 0:
+            previous_ttl = 0.0
+        else:
+            previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def acquire_sliding_window_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+        if amount > limit:
+            return False
+        now = time.time()
+        with self._locked():
+            previous_count, previous_ttl, current_count, _ = self._sliding_window_info(key, expiry, now)
+            if floor(previous_count * previous_ttl / expiry + current_count) + amount > limit:
+                return False
+            # The check and the increment share the lock, so no revert step is needed
+            _, current_key = self.sliding_window_keys(key, expiry, now)
+            self._incr(current_key, 2 * expiry, amount, now)
+            return True
+
+    def get_sliding_window(self, key: str, expiry: int) -> tuple[int, float, int, float]:
+        with self._locked():
+            return self._sliding_window_info(key, expiry, time.time())
+
+    def clear_sliding_window(self, key: str, expiry: int) -> None:
+        now = time.time()
+        for window_key in self.sliding_window_keys(key, expiry, now):
+            self.clear(window_key)
+
+
+RATE_LIMIT_STORAGE_URI = os.getenv(
+    "RATE_LIMIT_STORAGE_URI",
+    "mmap:///dev/shm/rendertool-ratelimit" if os.path.isdir("/dev/shm") else "memory://",
+)
+RATE_LIMIT_STRATEGY = os.getenv("RATE_LIMIT_STRATEGY", "sliding-window-counter")
+# Disabled by the load test harness (benchmarks/loadtest.py)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in {"1", "true", "yes"}
+
+# Fail at startup with a clear message rather than limits' NotImplementedError
+if (
+    urlparse(RATE_LIMIT_STORAGE_URI).scheme in MmapStorage.STORAGE_SCHEME
+    and RATE_LIMIT_STRATEGY not in MmapStorage.STRATEGIES
+):
+    raise ValueError(
+        f"RATE_LIMIT_STRATEGY={RATE_LIMIT_STRATEGY!r} is not supported by mmap:// storage; "
+        f"use one of {', '.join(MmapStorage.STRATEGIES)}, or memory:// / redis:// storage for moving-window"
+    )
+
+# One limiter for the app and every router
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    strategy=RATE_LIMIT_STRATEGY,
+    enabled=RATE_LIMIT_ENABLED,
+)
@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from metrics import CACHE_EVICTIONS, CACHE_LOOKUPS
+
+
+class LRUTTLCache:
+    """
+    Bounded in-process cache: LRU eviction once max_entries is reached, plus a
+    per-entry TTL. Thread-safe (sync routes run in FastAPI's threadpool).
+    Keeps hit/miss/eviction counters for monitoring; a named cache also
+    exports them to /metrics (cache_lookups_total{cache, result}).
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, name: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.name = name
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if name:
+            self._hit_counter = CACHE_LOOKUPS.labels(cache=name, result="hit")
+            self._miss_counter = CACHE_LOOKUPS.labels(cache=name, result="miss")
+            self._eviction_counter = CACHE_EVICTIONS.labels(cache=name)
+        else:
+            self._hit_counter = self._miss_counter = self._eviction_counter = None
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = time.monotonic()
+        evicted = 0
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._data[key]
+                self.evictions += 1
+                evicted = 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+        if self._hit_counter is not None:
+            if evicted:
+                self._eviction_counter.inc()
+            (self._miss_counter if entry is None else self._hit_counter).inc()
+        return None if entry is None else entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        evicted = 0
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+                evicted += 1
+        if evicted and self._eviction_counter is not None:
+            self._eviction_counter.inc(evicted)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
@@ -1,37 +1,197 @@
-import uuid
+from sqlalchemy import bindparam, func, insert, select, update
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
 
+from ids import new_id
 from models import User, CreditTransaction
+from services.payment_cache import invalidate_user_credits
+
+
+class InsufficientCreditsError(ValueError):
+    """The balance doesn't cover a deduction"""
 
 
 class CreditService:
+    ADDITION = "ADDITION"
+    DEDUCTION = "DEDUCTION"
+
+    @staticmethod
+    def _ledger_row(user_id: str, type: str, amount: float, payment_transaction_id: str | None) -> dict:
+        return {
+            "id": new_id(),
+            "user_id": user_id,
+            "payment_transaction_id": payment_transaction_id,
+            "type": type,
+            "amount": amount,
+        }
+
+    @staticmethod
+    def _apply_delta(db: Session, user_id: str, delta: float, require_balance: float | None = None) -> float | None:
+        """
+        Atomic `UPDATE users SET credits = credits + delta ... RETURNING credits`.
+        With require_balance, the row is only updated if credits >= require_balance.
+        Returns the new balance, or None if no row matched.
+        """
+        users = User.__table__
+        stmt = (
+            update(users)
+            .where(users.c.id == user_id)
+            .values(credits=func.coalesce(users.c.credits, 0.0) + delta)
+            .returning(users.c.credits)
+        )
+        if require_balance is not None:
+            stmt = stmt.where(func.coalesce(users.c.credits, 0.0) >= require_balance)
+        new_credits = db.execute(stmt).scalar_one_or_none()
+        if new_credits is None:
+            return None
+
+        # Keep an already loaded User in this session in sync without another SELECT
+        user = db.identity_map.get(identity_key(User, user_id))
+        if user is not None:
+            set_committed_value(user, "credits", new_credits)
+        return float(new_credits)
+
     @staticmethod
     def add_credits(
         db: Session,
         user_id: str,
         coins: float,
         payment_transaction_id: str | None = None,
+        commit: bool = True,
     ) -> float:
         """
         Add credits to a user and create a CreditTransaction record.
+        Balance change and ledger insert happen in the same transaction
+        (pass commit=False to let the caller commit it with other changes;
+        the caller then also invalidates the cached balance).
         Returns the new user credits.
         """
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
+        amount = float(coins or 0.0)
+        new_credits = CreditService._apply_delta(db, user_id, amount)
+        if new_credits is None:
             raise ValueError("User not found")
 
-        user.credits = float(user.credits or 0.0) + float(coins or 0.0)
+        db.execute(
+            insert(CreditTransaction),
+            [CreditService._ledger_row(user_id, CreditService.ADDITION, amount, payment_transaction_id)],
+        )
+
+        if commit:
+            db.commit()
+            invalidate_user_credits(user_id)
+        return new_credits
+
+    @staticmethod
+    def deduct_credits(
+        db: Session,
+        user_id: str,
+        coins: float,
+        payment_transaction_id: str | None = None,
+        commit: bool = True,
+    ) -> float:
+        """
+        Deduct credits if the balance allows it and create a DEDUCTION record.
+        The balance check and the decrement are one conditional UPDATE, so
+        concurrent deductions can't overdraw. With commit=False the caller
+        commits (and invalidates the cached balance); on failure the
+        transaction is rolled back either way.
+        Returns the new user credits.
+        """
+        amount = float(coins or 0.0)
+        new_credits = CreditService._apply_delta(db, user_id, -amount, require_balance=amount)
+        if new_credits is None:
+            exists = db.execute(select(User.id).where(User.id == user_id)).first()
+            db.rollback()
+            if not exists:
+                raise ValueError("User not found")
+            raise InsufficientCreditsError("Insufficient credits")
+
+        db.execute(
+            insert(CreditTransaction),
+            [CreditService._ledger_row(user_id, CreditService.DEDUCTION, amount, payment_transaction_id)],
+        )
+
+        if commit:
+            db.commit()
+            invalidate_user_credits(user_id)
+        return new_credits
 
-        tx = CreditTransaction(
-            id=str(uuid.uuid4()),
-            user_id=user.id,
-            payment_transaction_id=payment_transaction_id,
-            type="ADDITION",
-            amount=float(coins or 0.0),
+    @staticmethod
+    def apply_ledger_entries(db: Session, entries: list[dict], commit: bool = True) -> dict:
+        """
+        Apply many grants/deductions in one transaction:
+        one locking SELECT, one batched UPDATE and one batched INSERT (plus a
+        re-read of the debited rows when there are deductions).
+        entries: [{ "user_id", "amount", "type": "ADDITION" | "DEDUCTION", "payment_transaction_id"? }]
+        All-or-nothing: raises ValueError (nothing applied) on unknown users or
+        a resulting negative balance. A negative balance only seen after the
+        UPDATE rolls the transaction back even with commit=False.
+        Returns { user_id: new_credits }.
+        """
+        if not entries:
+            return {}
+
+        deltas: dict[str, float] = {}
+        rows = []
+        for entry in entries:
+            entry_type = entry.get("type") or CreditService.ADDITION
+            if entry_type not in {CreditService.ADDITION, CreditService.DEDUCTION}:
+                raise ValueError(f"Invalid credit transaction type: {entry_type}")
+            amount = float(entry.get("amount") or 0.0)
+            if amount < 0:
+                raise ValueError("Amount must be >= 0")
+            signed = amount if entry_type == CreditService.ADDITION else -amount
+            deltas[entry["user_id"]] = deltas.get(entry["user_id"], 0.0) + signed
+            rows.append(
+                CreditService._ledger_row(entry["user_id"], entry_type, amount, entry.get("payment_transaction_id"))
+            )
+
+        # Lock the affected rows (no-op on SQLite) so the balance check below holds.
+        # In id order, so batches touching overlapping users can't deadlock
+        balances = {
+            user_id: float(credits or 0.0)
+            for user_id, credits in db.execute(
+                select(User.id, User.credits).where(User.id.in_(deltas)).order_by(User.id).with_for_update()
+            )
+        }
+        missing = set(deltas) - set(balances)
+        if missing:
+            if commit:
+                db.rollback()
+            raise ValueError(f"User not found: {', '.join(sorted(missing))}")
+
+        new_balances = {user_id: balances[user_id] + delta for user_id, delta in deltas.items()}
+        negative = [user_id for user_id, credits in new_balances.items() if credits < 0]
+        if negative:
+            if commit:
+                db.rollback()
+            raise ValueError(f"Insufficient credits: {', '.join(sorted(negative))}")
+
+        db.execute(
+            update(User.__table__)
+            .where(User.__table__.c.id == bindparam("b_user_id"))
+            .values(credits=func.coalesce(User.__table__.c.credits, 0.0) + bindparam("b_delta")),
+            [{"b_user_id": user_id, "b_delta": delta} for user_id, delta in deltas.items()],
         )
-        db.add(tx)
 
-        db.commit()
-        db.refresh(user)
-        return float(user.credits or 0.0)
+        # SQLite ignores FOR UPDATE, so a deduction committed since the SELECT
+        # can leave the check above stale. This transaction holds the write
+        # lock from the UPDATE on, so re-read the debited rows and refuse here
+        debited = [user_id for user_id, delta in deltas.items() if delta < 0]
+        if debited:
+            new_balances.update(
+                (user_id, float(credits or 0.0))
+                for user_id, credits in db.execute(select(User.id, User.credits).where(User.id.in_(debited)))
+            )
+            negative = [user_id for user_id in debited if new_balances[user_id] < 0]
+            if negative:
+                db.rollback()
+                raise ValueError(f"Insufficient credits: {', '.join(sorted(negative))}")
+
+        db.execute(insert(CreditTransaction), rows)
 
+        if commit:
+            db.commit()
+            invalidate_user_credits(*new_balances)
+        return new_balances
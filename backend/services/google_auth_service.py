@@ -0,0 +1,106 @@
+import hashlib
+import os
+import re
+import threading
+import time
+
+import requests
+from google.auth import jwt
+
+from services.cache import LRUTTLCache
+
+
+class GoogleTokenVerifier:
+    """
+    Verifies Google ID tokens without a network round trip per login:
+    - signing certs are cached for the Cache-Control max-age Google sends
+      and fetched through one pooled requests.Session
+    - already verified tokens are cached (by sha256) until they expire or
+      for GOOGLE_TOKEN_CACHE_TTL seconds, whichever comes first
+    Same checks as google.oauth2.id_token.verify_oauth2_token.
+    """
+
+    ISSUERS = {"accounts.google.com", "https://accounts.google.com"}
+    MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+    def __init__(
+        self,
+        certs_url: str,
+        default_certs_ttl: float,
+        token_cache_ttl: float,
+        token_cache_max_entries: int,
+        http_timeout: float,
+    ):
+        self.certs_url = certs_url
+        self.default_certs_ttl = default_certs_ttl
+        self.token_cache_ttl = token_cache_ttl
+        self.http_timeout = http_timeout
+        self.token_cache = LRUTTLCache(max_entries=token_cache_max_entries, ttl_seconds=token_cache_ttl)
+        self.cert_fetches = 0
+        self._session = requests.Session()
+        self._certs: dict | None = None
+        self._certs_expires_at = 0.0
+        self._certs_lock = threading.Lock()
+
+    def _certs_ttl(self, cache_control: str) -> float:
+        match = self.MAX_AGE_RE.search(cache_control or "")
+        return float(match.group(1)) if match else self.default_certs_ttl
+
+    def get_certs(self, force_refresh: bool = False) -> dict:
+        if not force_refresh and self._certs is not None and time.monotonic() < self._certs_expires_at:
+            return self._certs
+
+        # One thread refreshes; the others wait for it and reuse the result
+        with self._certs_lock:
+            if not force_refresh and self._certs is not None and time.monotonic() < self._certs_expires_at:
+                return self._certs
+
+            response = self._session.get(self.certs_url, timeout=self.http_timeout)
+            if response.status_code != 200:
+                raise Exception(f"Could not fetch Google certificates: {response.status_code}")
+            self.cert_fetches += 1
+            self._certs = response.json()
+            self._certs_expires_at = time.monotonic() + self._certs_ttl(response.headers.get("Cache-Control", ""))
+            return self._certs
+
+    def _decode(self, token: str, audience: str | None, certs: dict) -> dict:
+        idinfo = jwt.decode(token, certs=certs, audience=audience)
+        if idinfo.get("iss") not in self.ISSUERS:
+            raise ValueError(f"Wrong issuer. 'iss' should be one of the following: {sorted(self.ISSUERS)}")
+        return idinfo
+
+    def verify(self, token: str, audience: str | None) -> dict:
+        """
+        Returns the decoded token. Raises ValueError if it is invalid.
+        """
+        cache_key = hashlib.sha256(f"{audience}:{token}".encode("utf-8")).hexdigest()
+        cached = self.token_cache.get(cache_key)
+        if cached is not None:
+            if cached.get("exp", 0) > time.time():
+                return dict(cached)
+            self.token_cache.delete(cache_key)
+
+        try:
+            idinfo = self._decode(token, audience, self.get_certs())
+        except ValueError as e:
+            # Google rotated its keys before our cached copy expired
+            if "certificate for key id" not in str(e).lower():
+                raise
+            idinfo = self._decode(token, audience, self.get_certs(force_refresh=True))
+
+        ttl = min(self.token_cache_ttl, float(idinfo.get("exp", 0)) - time.time())
+        if ttl > 0:
+            self.token_cache.set(cache_key, dict(idinfo), ttl_seconds=ttl)
+        return idinfo
+
+    def stats(self) -> dict:
+        return {"cert_fetches": self.cert_fetches, "token_cache": self.token_cache.stats()}
+
+
+google_token_verifier = GoogleTokenVerifier(
+    certs_url=os.getenv("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v1/certs"),
+    default_certs_ttl=float(os.getenv("GOOGLE_CERTS_DEFAULT_TTL", "3600")),
+    token_cache_ttl=float(os.getenv("GOOGLE_TOKEN_CACHE_TTL", "300")),
+    token_cache_max_entries=int(os.getenv("GOOGLE_TOKEN_CACHE_MAX_ENTRIES", "10000")),
+    http_timeout=float(os.getenv("GOOGLE_CERTS_HTTP_TIMEOUT", "5")),
+)
@@ -0,0 +1,105 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+
+from models import CreditTransaction, Payment
+
+
+class HistoryService:
+    """
+    Newest-first keyset pagination over a user's payments / credit
+    transactions. Pages are `(created_at, id) < cursor` range scans on the
+    (user_id, created_at, id) indexes, so page 1000 costs the same as page 1.
+    """
+
+    DEFAULT_LIMIT = 20
+    MAX_LIMIT = 100
+
+    @staticmethod
+    def _encode_cursor(created_at: datetime, id_: str) -> str:
+        raw = json.dumps([created_at.isoformat(), id_], separators=(",", ":"))
+        return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> tuple[datetime, str]:
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            created_at, id_ = json.loads(raw)
+            return datetime.fromisoformat(created_at), str(id_)
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    @staticmethod
+    def _page(db: Session, model, filters: list, limit: int | None, cursor: str | None) -> tuple[list, str | None]:
+        limit = max(1, min(limit or HistoryService.DEFAULT_LIMIT, HistoryService.MAX_LIMIT))
+        query = select(model).where(*filters)
+        if cursor:
+            created_at, id_ = HistoryService._decode_cursor(cursor)
+            query = query.where(tuple_(model.created_at, model.id) < tuple_(created_at, id_))
+        # One extra row tells whether there is a next page
+        rows = db.execute(
+            query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1)
+        ).scalars().all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = HistoryService._encode_cursor(rows[-1].created_at, rows[-1].id)
+        return rows, next_cursor
+
+    @staticmethod
+    def list_payments(
+        db: Session,
+        user_id: str,
+        limit: int | None = None,
+        cursor: str | None = None,
+        status: str | None = None,
+    ) -> dict:
+        filters = [Payment.user_id == user_id]
+        if status:
+            filters.append(Payment.status == status.upper())
+        payments, next_cursor = HistoryService._page(db, Payment, filters, limit, cursor)
+        return {
+            "items": [
+                {
+                    "transaction_id": p.transaction_id,
+                    "status": p.status,
+                    "payment_method": p.payment_method,
+                    "coins": p.coins,
+                    "amount_vnd": p.amount_vnd,
+                    "transfer_content": p.transfer_content,
+                    "created_at": p.created_at.isoformat() if p.created_at else None,
+                    "updated_at": p.updated_at.isoformat() if p.updated_at else None,
+                }
+                for p in payments
+            ],
+            "next_cursor": next_cursor,
+        }
+
+    @staticmethod
+    def list_credit_transactions(
+        db: Session,
+        user_id: str,
+        limit: int | None = None,
+        cursor: str | None = None,
+        type: str | None = None,
+    ) -> dict:
+        filters = [CreditTransaction.user_id == user_id]
+        if type:
+            filters.append(CreditTransaction.type == type.upper())
+        transactions, next_cursor = HistoryService._page(db, CreditTransaction, filters, limit, cursor)
+        return {
+            "items": [
+                {
+                    "id": t.id,
+                    "type": t.type,
+                    "amount": t.amount,
+                    "payment_transaction_id": t.payment_transaction_id,
+                    "created_at": t.created_at.isoformat() if t.created_at else None,
+                }
+                for t in transactions
+            ],
+            "next_cursor": next_cursor,
+        }
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from fastapi import UploadFile
+from PIL import Image, ImageCms, ImageOps, UnidentifiedImageError
+
+from services.zipline_service import UploadTooLargeError, ZiplineService
+
+CONTENT_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+class InvalidImageError(Exception):
+    """Upload is not a decodable image (or exceeds AVATAR_MAX_PIXELS)"""
+
+
+class ImageService:
+    """
+    Avatar pipeline: decode, square-crop to AVATAR_SIZES, strip metadata and
+    re-encode in AVATAR_FORMATS. Decoding/encoding is CPU bound, so it runs in
+    a process pool of IMAGE_POOL_WORKERS; at most IMAGE_POOL_QUEUE uploads are
+    read into memory and queued for it at once, the rest wait on a semaphore.
+    """
+
+    SIZES = sorted({int(s) for s in os.getenv("AVATAR_SIZES", "64,256,512").split(",") if s.strip()}, reverse=True)
+    FORMATS = [f.strip().lower() for f in os.getenv("AVATAR_FORMATS", "webp").split(",") if f.strip()]
+    QUALITY = int(os.getenv("AVATAR_QUALITY", "80"))
+    # Rendition stored in users.picture (what the frontend shows)
+    PICTURE_SIZE = int(os.getenv("AVATAR_PICTURE_SIZE", "256"))
+    MAX_UPLOAD_SIZE = int(os.getenv("AVATAR_MAX_UPLOAD_SIZE", str(20 * 1024 * 1024)))
+    # Decompression bomb guard (a tiny PNG can declare a gigapixel canvas)
+    MAX_PIXELS = int(os.getenv("AVATAR_MAX_PIXELS", str(50_000_000)))
+
+    POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+    POOL_QUEUE = int(os.getenv("IMAGE_POOL_QUEUE", "0")) or POOL_WORKERS * 2
+
+    _pool: Optional[ProcessPoolExecutor] = None
+    _slots: Optional[asyncio.Semaphore] = None
+
+    @staticmethod
+    def startup() -> None:
+        if ImageService._pool is None:
+            # spawn: forking a process that runs an event loop and driver threads is unsafe
+            ImageService._pool = ProcessPoolExecutor(
+                max_workers=ImageService.POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        if ImageService._slots is None:
+            ImageService._slots = asyncio.Semaphore(ImageService.POOL_QUEUE)
+
+    @staticmethod
+    def shutdown() -> None:
+        pool = ImageService._pool
+        ImageService._pool = None
+        ImageService._slots = None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _to_srgb(image: Image.Image, mode: str) -> Image.Image:
+        # Phone photos are often Display P3 (or CMYK); dropping the profile
+        # without converting would shift colors
+        icc = image.info.get("icc_profile")
+        if icc:
+            try:
+                return ImageCms.profileToProfile(
+                    image, ImageCms.ImageCmsProfile(io.BytesIO(icc)), ImageCms.createProfile("sRGB"), outputMode=mode
+                )
+            except (ImageCms.PyCMSError, OSError):
+                pass
+        return image.convert(mode)
+
+    @staticmethod
+    def render_renditions(data: bytes, sizes: list[int], formats: list[str], quality: int, max_pixels: int) -> list[dict]:
+        """
+        Runs in a pool worker. Returns [{ "size", "format", "content_type", "data" }]
+        largest first; raises InvalidImageError for anything that is not a usable image.
+        """
+        try:
+            image = Image.open(io.BytesIO(data))
+            if image.width * image.height > max_pixels:
+                raise InvalidImageError(f"Image exceeds {max_pixels} pixels")
+            # JPEG: let libjpeg decode at 1/2..1/8 scale when that still covers the largest size
+            image.draft("RGB", (sizes[0], sizes[0]))
+            image = ImageOps.exif_transpose(image)
+            alpha = "A" in image.getbands() or "transparency" in image.info
+            image = ImageService._to_srgb(image, "RGBA" if alpha else "RGB")
+        except Image.DecompressionBombError:
+            raise InvalidImageError(f"Image exceeds {max_pixels} pixels")
+        except (UnidentifiedImageError, OSError, SyntaxError):
+            raise InvalidImageError("Unsupported or corrupt image file")
+
+        # Center square crop
+        side = min(image.size)
+        left = (image.width - side) // 2
+        top = (image.height - side) // 2
+        box = (left, top, left + side, top + side)
+
+        renditions = []
+        source = image
+        # Never upscale: sizes above the source side collapse onto it
+        for size in sorted({min(size, side) for size in sizes}, reverse=True):
+            # Each size is resized from the previous (larger) rendition
+            resized = source.resize((size, size), Image.Resampling.LANCZOS, box=box, reducing_gap=3.0)
+            source, box = resized, None
+            for fmt in formats:
+                out = resized
+                buffer = io.BytesIO()
+                # No exif/icc_profile passed to save(): metadata is stripped
+                if fmt == "jpeg":
+                    if out.mode == "RGBA":
+                        flat = Image.new("RGB", out.size, (255, 255, 255))
+                        flat.paste(out, mask=out.getchannel("A"))
+                        out = flat
+                    out.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+                elif fmt == "webp":
+                    out.save(buffer, "WEBP", quality=quality, method=4)
+                else:
+                    raise ValueError(f"Unsupported avatar format: {fmt}")
+                renditions.append({
+                    "size": size,
+                    "format": fmt,
+                    "content_type": CONTENT_TYPES[fmt],
+                    "data": buffer.getvalue(),
+                })
+        return renditions
+
+    @staticmethod
+    async def _read_upload(file: UploadFile) -> bytes:
+        max_size = ImageService.MAX_UPLOAD_SIZE
+        if file.size is not None and file.size > max_size:
+            raise UploadTooLargeError(f"Avatar exceeds maximum upload size of {max_size} bytes")
+        data = await file.read(max_size + 1)
+        if len(data) > max_size:
+            raise UploadTooLargeError(f"Avatar exceeds maximum upload size of {max_size} bytes")
+        return data
+
+    @staticmethod
+    async def render(data: bytes) -> list[dict]:
+        """Run render_renditions in the process pool (event loop stays free)"""
+        ImageService.startup()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                ImageService._pool,
+                ImageService.render_renditions,
+                data,
+                ImageService.SIZES,
+                ImageService.FORMATS,
+                ImageService.QUALITY,
+                ImageService.MAX_PIXELS,
+            )
+        except BrokenProcessPool:
+            # A worker died (OOM kill, segfault in a codec): start a fresh pool next time
+            pool, ImageService._pool = ImageService._pool, None
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    @staticmethod
+    async def upload_avatar(file: UploadFile) -> list[dict]:
+        """
+        Render the avatar renditions and upload them to Zipline in parallel.
+        Returns [{ "size", "format", "url", "bytes" }] largest first.
+        """
+        # Fail on missing config before spending CPU on the renditions
+        ZiplineService._check_config()
+        ImageService.startup()
+        async with ImageService._slots:
+            data = await ImageService._read_upload(file)
+            renditions = await ImageService.render(data)
+
+        digest = hashlib.sha256(renditions[0]["data"]).hexdigest()[:12]
+        results = await asyncio.gather(*(
+            ZiplineService.upload_bytes(
+                r["data"], f"avatar_{digest}_{r['size']}.{r['format']}", r["content_type"]
+            )
+            for r in renditions
+        ))
+        return [
+            {"size": r["size"], "format": r["format"], "url": result["url"], "bytes": len(r["data"])}
+            for r, result in zip(renditions, results)
+        ]
+
+    @staticmethod
+    def picture_url(renditions: list[dict]) -> str:
+        """URL for users.picture: first format, size closest to PICTURE_SIZE"""
+        primary = [r for r in renditions if r["format"] == renditions[0]["format"]]
+        return min(primary, key=lambda r: abs(r["size"] - ImageService.PICTURE_SIZE))["url"]
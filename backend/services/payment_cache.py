@@ -0,0 +1,42 @@
+import os
+
+from services.cache import LRUTTLCache
+
+
+# transaction_id -> payment fields of the status response
+PAYMENT_STATUS_CACHE_TTL = float(os.getenv("PAYMENT_STATUS_CACHE_TTL", "5"))
+# Only COMPLETED is final. A late transfer still settles a FAILED or EXPIRED
+# payment, and write-through only refreshes the worker that took the webhook,
+# so those stay on the short TTL and other workers see the change within seconds
+PAYMENT_STATUS_CACHE_TERMINAL_TTL = float(os.getenv("PAYMENT_STATUS_CACHE_TERMINAL_TTL", "3600"))
+payment_status_cache = LRUTTLCache(
+    max_entries=int(os.getenv("PAYMENT_STATUS_CACHE_MAX_ENTRIES", "50000")),
+    ttl_seconds=PAYMENT_STATUS_CACHE_TTL,
+    name="payment_status",
+)
+
+# user_id -> credits; invalidated by CreditService on every balance change
+user_credits_cache = LRUTTLCache(
+    max_entries=int(os.getenv("USER_CREDITS_CACHE_MAX_ENTRIES", "50000")),
+    ttl_seconds=float(os.getenv("USER_CREDITS_CACHE_TTL", "5")),
+    name="user_credits",
+)
+
+
+def cache_payment_status(entry: dict) -> None:
+    status = (entry.get("status") or "").upper()
+    ttl = PAYMENT_STATUS_CACHE_TERMINAL_TTL if status == "COMPLETED" else None
+    payment_status_cache.set(entry["transaction_id"], entry, ttl_seconds=ttl)
+
+
+def invalidate_user_credits(*user_ids: str) -> None:
+    for user_id in user_ids:
+        if user_id:
+            user_credits_cache.delete(user_id)
+
+
+def stats() -> dict:
+    return {
+        "payment_status": payment_status_cache.stats(),
+        "user_credits": user_credits_cache.stats(),
+    }
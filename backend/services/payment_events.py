@@ -0,0 +1,68 @@
+import asyncio
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class TooManyWaitersError(Exception):
+    """PAYMENT_STATUS_MAX_WAITERS open waiters reached"""
+
+
+class PaymentStatusBroker:
+    """
+    In-process pub/sub for payment status changes.
+    Long-poll/SSE handlers subscribe to a transaction_id and sleep on an
+    asyncio.Event; PaymentService publishes after committing a webhook.
+    Only wakes waiters in this worker process, so handlers still re-check
+    the DB when their wait times out.
+    """
+
+    def __init__(self, max_waiters: int):
+        self.max_waiters = max_waiters
+        self._waiters: dict[str, set[tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def subscribe(self, transaction_id: str) -> Iterator[asyncio.Event]:
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            if self.max_waiters and self._count >= self.max_waiters:
+                raise TooManyWaitersError("Too many open payment status waiters")
+            self._waiters.setdefault(transaction_id, set()).add(waiter)
+            self._count += 1
+        try:
+            yield waiter[1]
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(transaction_id)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[transaction_id]
+                self._count -= 1
+
+    def publish(self, transaction_id: str) -> int:
+        """
+        Wake every waiter of transaction_id. Safe to call from any thread.
+        Returns the number of waiters woken.
+        """
+        with self._lock:
+            waiters = list(self._waiters.get(transaction_id, ()))
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Loop already closed (worker shutting down)
+                pass
+        return len(waiters)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"waiters": self._count, "transactions": len(self._waiters)}
+
+
+payment_status_broker = PaymentStatusBroker(
+    max_waiters=int(os.getenv("PAYMENT_STATUS_MAX_WAITERS", "10000")),
+)
@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Payment
+from services import payment_cache
+from services.payment_events import payment_status_broker
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentExpiryService:
+    """
+    Marks PENDING payments whose QR was never paid as EXPIRED.
+    A late bank transfer still settles an EXPIRED payment through the webhook.
+    """
+
+    # Seconds a PENDING order stays payable
+    TTL = float(os.getenv("PAYMENT_PENDING_TTL", "86400"))
+    BATCH_SIZE = int(os.getenv("PAYMENT_SWEEP_BATCH_SIZE", "1000"))
+    # Background sweep in the app lifespan (0 disables; run the CLI from cron instead)
+    INTERVAL = float(os.getenv("PAYMENT_SWEEP_INTERVAL", "300"))
+
+    @staticmethod
+    def _stale(cutoff: datetime, after: tuple | None, upto: tuple | None = None) -> list:
+        """
+        Filters for expirable payments with (created_at, id) in the keyset
+        range (after, upto]; they walk ix_payments_status_created_at in order.
+        """
+        conditions = [Payment.status == "PENDING", Payment.created_at < cutoff]
+        if after is not None:
+            created_at, id_ = after
+            # created_at >= x keeps it an index range; the OR only breaks ties
+            conditions += [
+                Payment.created_at >= created_at,
+                or_(Payment.created_at > created_at, and_(Payment.created_at == created_at, Payment.id > id_)),
+            ]
+        if upto is not None:
+            created_at, id_ = upto
+            conditions += [
+                Payment.created_at <= created_at,
+                or_(Payment.created_at < created_at, and_(Payment.created_at == created_at, Payment.id <= id_)),
+            ]
+        return conditions
+
+    @staticmethod
+    def _batch_query(cutoff: datetime, after: tuple | None, batch_size: int):
+        """Next (id, created_at) page after the keyset cursor"""
+        return (
+            select(Payment.id, Payment.created_at)
+            .where(*PaymentExpiryService._stale(cutoff, after))
+            .order_by(Payment.created_at, Payment.id)
+            .limit(batch_size)
+        )
+
+    @staticmethod
+    def expire_stale(
+        db: Session,
+        ttl_seconds: float | None = None,
+        batch_size: int | None = None,
+        max_batches: int | None = None,
+    ) -> dict:
+        """
+        Expire PENDING payments older than ttl_seconds, batch_size rows per
+        transaction so locks and WAL stay bounded.
+        Returns { "expired": n, "batches": n, "seconds": t }.
+        """
+        ttl_seconds = PaymentExpiryService.TTL if ttl_seconds is None else ttl_seconds
+        batch_size = batch_size or PaymentExpiryService.BATCH_SIZE
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=ttl_seconds)
+
+        started = time.perf_counter()
+        expired = 0
+        batches = 0
+        after = None
+        while max_batches is None or batches < max_batches:
+            rows = db.execute(PaymentExpiryService._batch_query(cutoff, after, batch_size)).all()
+            if not rows:
+                break
+            upto = (rows[-1].created_at, rows[-1].id)
+
+            # Update the same index range rather than `id IN (...)`; the status
+            # predicate skips rows a webhook settled since the read
+            transaction_ids = db.execute(
+                update(Payment)
+                .where(*PaymentExpiryService._stale(cutoff, after, upto))
+                .values(status="EXPIRED", updated_at=datetime.now(timezone.utc))
+                .returning(Payment.transaction_id),
+                execution_options={"synchronize_session": False},
+            ).scalars().all()
+            db.commit()
+            after = upto
+
+            for transaction_id in transaction_ids:
+                payment_cache.payment_status_cache.delete(transaction_id)
+                payment_status_broker.publish(transaction_id)
+            expired += len(transaction_ids)
+            batches += 1
+            if len(rows) < batch_size:
+                break
+
+        return {"expired": expired, "batches": batches, "seconds": round(time.perf_counter() - started, 3)}
+
+    @staticmethod
+    def _sweep_once() -> dict:
+        db = SessionLocal()
+        try:
+            return PaymentExpiryService.expire_stale(db)
+        finally:
+            db.close()
+
+    @staticmethod
+    async def _sweep_forever(interval: float) -> None:
+        while True:
+            try:
+                await run_in_threadpool(PaymentExpiryService._sweep_once)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Payment expiry sweep failed")
+            await asyncio.sleep(interval)
+
+    @staticmethod
+    def start_background_sweeper() -> asyncio.Task | None:
+        """
+        Called from the app lifespan. Each worker runs its own sweeper; the
+        guarded UPDATE makes concurrent sweeps harmless.
+        """
+        if PaymentExpiryService.INTERVAL <= 0:
+            return None
+        return asyncio.create_task(PaymentExpiryService._sweep_forever(PaymentExpiryService.INTERVAL))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Expire stale PENDING payments")
+    parser.add_argument("--ttl", type=float, default=PaymentExpiryService.TTL, help="seconds a PENDING order stays payable")
+    parser.add_argument("--batch-size", type=int, default=PaymentExpiryService.BATCH_SIZE)
+    parser.add_argument("--max-batches", type=int, default=None)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(PaymentExpiryService.expire_stale(db, args.ttl, args.batch_size, args.max_batches))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    # cd backend && python -m services.payment_expiry --ttl 86400
+    main()
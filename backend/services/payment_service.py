@@ -1,14 +1,18 @@
+import hashlib
+import hmac
 import json
 import os
-import random
-import time
-import uuid
-from urllib.parse import quote
-
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from models import Payment, User
+from ids import new_id, ulid
+from metrics import WEBHOOK_OUTCOMES
+from models import Payment, User, WebhookEvent
 from services.credit_service import CreditService
+from services import payment_cache
+from services.payment_events import payment_status_broker
+from services.vietqr_service import VietQRService
 
 
 class PaymentService:
@@ -26,28 +30,25 @@ class PaymentService:
     BANK_ID = os.getenv("PAYMENT_BANK_ID", "970415")  # VietinBank (VietQR bank code)
     ACCOUNT_NUMBER = os.getenv("PAYMENT_ACCOUNT_NUMBER", "113366668888")
     ACCOUNT_NAME = os.getenv("PAYMENT_ACCOUNT_NAME", "RENDERTOOL")
+    # Prefix for qr_code_url; empty = relative /api/payments/... (served through the frontend proxy)
+    QR_BASE_URL = os.getenv("PAYMENT_QR_BASE_URL", "").rstrip("/")
 
     WEBHOOK_SECRET = os.getenv("PAYMENT_WEBHOOK_SECRET", "")
+    WEBHOOK_BATCH_MAX = int(os.getenv("PAYMENT_WEBHOOK_BATCH_MAX", "500"))
 
     @staticmethod
     def _generate_transaction_id() -> str:
-        return f"TXN-{int(time.time())}-{random.randint(100000, 999999)}"
+        # Time-ordered and unique per process (ULID), Crockford base32
+        return f"TXN-{ulid()}"
 
     @staticmethod
     def _transfer_content(transaction_id: str) -> str:
         return f"NAPCOIN{transaction_id}"
 
     @staticmethod
-    def _build_vietqr_url(amount_vnd: float, transfer_content: str) -> str:
-        # Using VietQR image generator. Example:
-        # https://img.vietqr.io/image/{BANK_ID}-{ACCOUNT_NUMBER}-compact2.png?amount=...&addInfo=...&accountName=...
-        amount = int(round(float(amount_vnd)))
-        add_info = quote(transfer_content)
-        account_name = quote(PaymentService.ACCOUNT_NAME)
-        return (
-            f"https://img.vietqr.io/image/{PaymentService.BANK_ID}-{PaymentService.ACCOUNT_NUMBER}-compact2.png"
-            f"?amount={amount}&addInfo={add_info}&accountName={account_name}"
-        )
+    def _build_qr_url(transaction_id: str) -> str:
+        # VietQR image rendered by GET /api/payments/{transaction_id}/qr (VietQRService)
+        return f"{PaymentService.QR_BASE_URL}/api/payments/{transaction_id}/qr"
 
     @staticmethod
     def _validate_package(coins: float, amount_vnd: float) -> bool:
@@ -78,7 +79,7 @@ class PaymentService:
 
         if not user:
             # Create a temp user if not found
-            temp_id = str(uuid.uuid4())
+            temp_id = new_id()
             user = User(
                 id=temp_id,
                 email=f"temp_{temp_id}@temp.local",
@@ -92,10 +93,10 @@ class PaymentService:
 
         transaction_id = PaymentService._generate_transaction_id()
         transfer_content = PaymentService._transfer_content(transaction_id)
-        qr_code_url = PaymentService._build_vietqr_url(amount_vnd, transfer_content)
+        qr_code_url = PaymentService._build_qr_url(transaction_id)
 
         payment = Payment(
-            id=str(uuid.uuid4()),
+            id=new_id(),
             user_id=user.id,
             transaction_id=transaction_id,
             status="PENDING",
@@ -111,6 +112,10 @@ class PaymentService:
         db.commit()
         db.refresh(payment)
 
+        # The QR screen polls right away; prime the status cache.
+        # The QR image itself is rendered on its first GET /{transaction_id}/qr
+        payment_cache.cache_payment_status(PaymentService._status_entry(payment))
+
         return {
             "transaction_id": payment.transaction_id,
             "status": payment.status,
@@ -120,57 +125,118 @@ class PaymentService:
             "qr_code_url": payment.qr_code_url,
             "bank_name": payment.bank_name,
             "account_number": payment.account_number,
+            "account_name": PaymentService.ACCOUNT_NAME,
             "transfer_content": payment.transfer_content,
         }
 
     @staticmethod
-    def get_payment_status(db: Session, transaction_id: str) -> dict:
-        payment = db.query(Payment).filter(Payment.transaction_id == transaction_id).first()
-        if not payment:
-            raise ValueError("Payment not found")
-
-        user_credits = None
-        if payment.user_id:
-            user = db.query(User).filter(User.id == payment.user_id).first()
-            if user:
-                user_credits = float(user.credits or 0.0)
-
+    def _status_entry(payment: Payment) -> dict:
         return {
             "transaction_id": payment.transaction_id,
             "status": payment.status,
             "coins": payment.coins,
             "amount_vnd": payment.amount_vnd,
             "user_id": payment.user_id,
-            "user_credits": user_credits,
         }
 
+    @staticmethod
+    def get_payment_status(db: Session, transaction_id: str) -> dict:
+        """
+        Read-through cached: payment fields by transaction_id (kept longer
+        once COMPLETED) and the owner's credits by user_id.
+        """
+        entry = payment_cache.payment_status_cache.get(transaction_id)
+        if entry is None:
+            payment = db.query(Payment).filter(Payment.transaction_id == transaction_id).first()
+            if not payment:
+                raise ValueError("Payment not found")
+            entry = PaymentService._status_entry(payment)
+            payment_cache.cache_payment_status(entry)
+
+        user_credits = None
+        if entry["user_id"]:
+            user_credits = payment_cache.user_credits_cache.get(entry["user_id"])
+            if user_credits is None:
+                credits = db.query(User.credits).filter(User.id == entry["user_id"]).first()
+                if credits is not None:
+                    user_credits = float(credits[0] or 0.0)
+                    payment_cache.user_credits_cache.set(entry["user_id"], user_credits)
+
+        return {**entry, "user_credits": user_credits}
+
+    @staticmethod
+    def status_cache_stats() -> dict:
+        return payment_cache.stats()
+
+    @staticmethod
+    def get_payment_qr(db: Session, transaction_id: str, fmt: str = "png") -> tuple[bytes, str]:
+        """
+        VietQR image of a payment as (bytes, etag). Served from the image
+        cache when possible; otherwise loads the payment and renders it.
+        """
+        cached = VietQRService.cached_image(transaction_id, fmt)
+        if cached is not None:
+            return cached
+        payment = db.query(Payment).filter(Payment.transaction_id == transaction_id).first()
+        if not payment:
+            raise ValueError("Payment not found")
+        return VietQRService.render_payment(
+            payment.transaction_id, fmt, PaymentService.BANK_ID,
+            payment.account_number, payment.amount_vnd, payment.transfer_content,
+        )
+
     @staticmethod
     def _is_success_status(status: str) -> bool:
         s = (status or "").strip().lower()
         return s in {"success", "completed", "paid"}
 
     @staticmethod
-    def process_webhook(db: Session, payload: dict, signature: str | None = None) -> dict:
-        """
-        Expected minimal payload:
-          { "transaction_id": "...", "status": "...", "amount": 12345 }
-        Additional fields are ignored.
-        """
+    def _check_signature(signature: str | None) -> None:
         if PaymentService.WEBHOOK_SECRET:
-            if not signature or signature != PaymentService.WEBHOOK_SECRET:
+            if not signature or not hmac.compare_digest(signature, PaymentService.WEBHOOK_SECRET):
                 raise ValueError("Invalid webhook signature")
 
-        txid = payload.get("transaction_id") or payload.get("transactionId") or payload.get("txn_id")
-        if not txid:
-            raise ValueError("Missing transaction_id")
+    @staticmethod
+    def require_secret(signature: str | None) -> None:
+        """
+        Like _check_signature, but refuses outright while PAYMENT_WEBHOOK_SECRET
+        is unset, for endpoints that must never run unauthenticated (statement import).
+        """
+        if not PaymentService.WEBHOOK_SECRET:
+            raise PermissionError("PAYMENT_WEBHOOK_SECRET is not configured")
+        PaymentService._check_signature(signature)
 
-        payment = db.query(Payment).filter(Payment.transaction_id == txid).first()
-        if not payment:
-            raise ValueError("Payment not found")
+    @staticmethod
+    def _webhook_txid(payload: dict) -> str | None:
+        return payload.get("transaction_id") or payload.get("transactionId") or payload.get("txn_id")
+
+    @staticmethod
+    def _idempotency_key(payload: dict, idempotency_key: str | None = None) -> str:
+        """
+        Idempotency-Key header > gateway event id > hash of the payload
+        (so a gateway retrying the exact same notification is deduplicated).
+        """
+        key = idempotency_key or payload.get("idempotency_key") or payload.get("event_id") or payload.get("id")
+        if key:
+            return str(key)
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return "sha256:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _record_outcome(outcome: str) -> None:
+        # COMPLETED / FAILED from _apply_webhook, or DUPLICATE / REJECTED
+        WEBHOOK_OUTCOMES.labels(status=outcome).inc()
 
+    @staticmethod
+    def _apply_webhook(payment: Payment, payload: dict) -> tuple[dict, bool]:
+        """
+        Apply one notification to a loaded Payment (no I/O, no commit).
+        Returns (response, credits_due). When credits_due is True the caller
+        adds payment.coins to the user and fills in "user_credits".
+        """
         # Idempotency: already completed
         if (payment.status or "").upper() == "COMPLETED":
-            return {"ok": True, "status": "COMPLETED", "transaction_id": payment.transaction_id}
+            return {"ok": True, "status": "COMPLETED", "transaction_id": payment.transaction_id}, False
 
         incoming_status = str(payload.get("status") or "")
         incoming_amount = payload.get("amount") or payload.get("amount_vnd") or payload.get("amountVnd")
@@ -189,30 +255,189 @@ class PaymentService:
         # Amount validation (±0.01)
         if incoming_amount is not None and abs(float(payment.amount_vnd or 0.0) - float(incoming_amount)) > 0.01:
             payment.status = "FAILED"
-            db.commit()
-            return {"ok": False, "status": "FAILED", "reason": "Amount mismatch"}
+            return {"ok": False, "status": "FAILED", "reason": "Amount mismatch"}, False
 
         if PaymentService._is_success_status(incoming_status):
             payment.status = "COMPLETED"
-            db.commit()
-
-            # Add credits
-            new_credits = CreditService.add_credits(
-                db=db,
-                user_id=payment.user_id,
-                coins=float(payment.coins or 0.0),
-                payment_transaction_id=payment.transaction_id,
-            )
             return {
                 "ok": True,
                 "status": "COMPLETED",
                 "transaction_id": payment.transaction_id,
                 "user_id": payment.user_id,
-                "user_credits": new_credits,
-            }
+                "user_credits": None,
+            }, True
 
         # Otherwise mark failed
         payment.status = "FAILED"
+        return {"ok": True, "status": "FAILED", "transaction_id": payment.transaction_id}, False
+
+    @staticmethod
+    def process_webhook(
+        db: Session,
+        payload: dict,
+        signature: str | None = None,
+        idempotency_key: str | None = None,
+    ) -> dict:
+        """
+        Expected minimal payload:
+          { "transaction_id": "...", "status": "...", "amount": 12345 }
+        Additional fields are ignored.
+        Payment status, credits and the idempotency record are written in a
+        single transaction; a replayed idempotency key returns the stored response.
+        """
+        PaymentService._check_signature(signature)
+
+        txid = PaymentService._webhook_txid(payload)
+        if not txid:
+            PaymentService._record_outcome("REJECTED")
+            raise ValueError("Missing transaction_id")
+
+        key = PaymentService._idempotency_key(payload, idempotency_key)
+        event = db.get(WebhookEvent, key)
+        if event is not None:
+            PaymentService._record_outcome("DUPLICATE")
+            return json.loads(event.response)
+
+        payment = db.execute(
+            select(Payment).where(Payment.transaction_id == txid).with_for_update()
+        ).scalars().first()
+        if not payment:
+            PaymentService._record_outcome("REJECTED")
+            raise ValueError("Payment not found")
+
+        result, credits_due = PaymentService._apply_webhook(payment, payload)
+        if credits_due:
+            try:
+                result["user_credits"] = CreditService.add_credits(
+                    db=db,
+                    user_id=payment.user_id,
+                    coins=float(payment.coins or 0.0),
+                    payment_transaction_id=payment.transaction_id,
+                    commit=False,
+                )
+            except ValueError:
+                db.rollback()
+                PaymentService._record_outcome("REJECTED")
+                raise
+
+        db.add(WebhookEvent(idempotency_key=key, transaction_id=txid, response=json.dumps(result)))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Same key settled concurrently by another request: replay its response
+            db.rollback()
+            event = db.get(WebhookEvent, key)
+            if event is None:
+                raise
+            PaymentService._record_outcome("DUPLICATE")
+            return json.loads(event.response)
+
+        payment_cache.cache_payment_status(PaymentService._status_entry(payment))
+        if credits_due:
+            payment_cache.invalidate_user_credits(payment.user_id)
+        payment_status_broker.publish(txid)
+        PaymentService._record_outcome(result["status"])
+        return result
+
+    @staticmethod
+    def process_webhook_batch(db: Session, payloads: list[dict], signature: str | None = None) -> list[dict]:
+        """
+        Settle many notifications in one transaction with grouped reads
+        (payments, users, idempotency keys) and one grouped ledger write.
+        Returns one response per payload, in order. Per-item problems
+        (missing/unknown transaction, unknown user) are reported with
+        "ok": False and "error" instead of failing the whole batch.
+        """
+        PaymentService._check_signature(signature)
+
+        keys = [PaymentService._idempotency_key(p) if isinstance(p, dict) else None for p in payloads]
+        txids = {PaymentService._webhook_txid(p) for p in payloads if isinstance(p, dict)} - {None}
+
+        events = {
+            e.idempotency_key: e
+            for e in db.execute(
+                select(WebhookEvent).where(WebhookEvent.idempotency_key.in_({k for k in keys if k}))
+            ).scalars()
+        }
+        # Row locks in id order: overlapping batches can't deadlock each other
+        payments = {
+            p.transaction_id: p
+            for p in db.execute(
+                select(Payment).where(Payment.transaction_id.in_(txids)).order_by(Payment.id).with_for_update()
+            ).scalars()
+        }
+        user_ids = {p.user_id for p in payments.values() if p.user_id}
+        existing_users = set(db.execute(select(User.id).where(User.id.in_(user_ids))).scalars())
+
+        results: list[dict] = []
+        ledger_entries = []
+        credited = []
+        applied: dict[str, dict] = {}
+        # Recorded only after the commit, like the single-notification path
+        outcomes: list[str] = []
+        for payload, key in zip(payloads, keys):
+            if key is None:
+                results.append({"ok": False, "error": "Invalid payload"})
+                outcomes.append("REJECTED")
+                continue
+            if key in applied:
+                # Duplicate inside this batch: replay the first occurrence
+                results.append(applied[key])
+                outcomes.append("DUPLICATE")
+                continue
+            if key in events:
+                results.append(json.loads(events[key].response))
+                outcomes.append("DUPLICATE")
+                continue
+            txid = PaymentService._webhook_txid(payload)
+            if not txid:
+                results.append({"ok": False, "error": "Missing transaction_id"})
+                outcomes.append("REJECTED")
+                continue
+            payment = payments.get(txid)
+            if payment is None:
+                results.append({"ok": False, "transaction_id": txid, "error": "Payment not found"})
+                outcomes.append("REJECTED")
+                continue
+            if payment.status != "COMPLETED" and PaymentService._is_success_status(str(payload.get("status") or "")):
+                if payment.user_id not in existing_users:
+                    results.append({"ok": False, "transaction_id": txid, "error": "User not found"})
+                    outcomes.append("REJECTED")
+                    continue
+
+            result, credits_due = PaymentService._apply_webhook(payment, payload)
+            if credits_due:
+                ledger_entries.append({
+                    "user_id": payment.user_id,
+                    "amount": float(payment.coins or 0.0),
+                    "type": CreditService.ADDITION,
+                    "payment_transaction_id": payment.transaction_id,
+                })
+                credited.append(result)
+            applied[key] = result
+            results.append(result)
+            outcomes.append(result["status"])
+            events[key] = WebhookEvent(idempotency_key=key, transaction_id=txid)
+            db.add(events[key])
+
+        balances = CreditService.apply_ledger_entries(db, ledger_entries, commit=False)
+        for result in credited:
+            result["user_credits"] = balances.get(result["user_id"])
+        # Responses are final only after balances are known
+        for key, result in applied.items():
+            events[key].response = json.dumps(result)
+        # Snapshot before commit expires the instances (reading them after would reload row by row)
+        status_entries = [
+            PaymentService._status_entry(payments[txid])
+            for txid in {events[key].transaction_id for key in applied}
+        ]
+
         db.commit()
-        return {"ok": True, "status": "FAILED", "transaction_id": payment.transaction_id}
 
+        payment_cache.invalidate_user_credits(*balances)
+        for entry in status_entries:
+            payment_cache.cache_payment_status(entry)
+            payment_status_broker.publish(entry["transaction_id"])
+        for outcome in outcomes:
+            PaymentService._record_outcome(outcome)
+        return results
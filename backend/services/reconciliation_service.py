@@ -0,0 +1,330 @@
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import time
+from typing import IO, Iterable, Iterator
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from ids import CROCKFORD
+from models import Payment, WebhookEvent
+from services.payment_service import PaymentService
+
+
+class ReconciliationService:
+    """
+    Settles payments from bank statement exports instead of gateway webhooks.
+    Rows are streamed, references (NAPCOIN{transaction_id}) are pulled out of
+    the free-text description and resolved through the indexed
+    payments.transfer_content column, BATCH_SIZE rows at a time. Clean
+    matches go through PaymentService.process_webhook_batch (same ledger,
+    idempotency, cache and push updates as webhooks); everything else is
+    reported.
+    """
+
+    BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "500"))
+    # Max mismatch/leftover rows listed in a report (counts are always complete)
+    REPORT_MAX_ITEMS = int(os.getenv("RECONCILE_REPORT_MAX_ITEMS", "1000"))
+
+    # Banks drop dashes/spaces, change case and sometimes swap O/0
+    PREFIX_RE = re.compile(r"NAPC[O0]INTXN")
+    NON_ALNUM_RE = re.compile(r"[^0-9A-Z]")
+    CROCKFORD_FIXES = str.maketrans("ILO", "110")
+    CROCKFORD_SET = frozenset(CROCKFORD)
+
+    DESCRIPTION_FIELDS = ("description", "content", "transfer_content", "remark", "memo", "noi_dung", "nội dung", "diễn giải")
+    AMOUNT_FIELDS = ("amount", "credit", "credit_amount", "amount_vnd", "so_tien", "số tiền", "ghi có")
+    REFERENCE_FIELDS = ("reference", "ref", "bank_ref", "transaction_number", "trans_id", "so_tham_chieu", "số tham chiếu")
+
+    # --- parsing ---------------------------------------------------------
+
+    @staticmethod
+    def extract_references(text: str) -> list[str]:
+        """
+        Candidate transfer_content values found in a statement description,
+        in canonical form (what PaymentService._transfer_content produced).
+        """
+        compact = ReconciliationService.NON_ALNUM_RE.sub("", (text or "").upper())
+        candidates: list[str] = []
+        for match in ReconciliationService.PREFIX_RE.finditer(compact):
+            tail = compact[match.end():]
+            # TXN-<ULID>
+            ulid = tail[:26].translate(ReconciliationService.CROCKFORD_FIXES)
+            if len(ulid) == 26 and ulid[0] <= "7" and set(ulid) <= ReconciliationService.CROCKFORD_SET:
+                candidates.append(PaymentService._transfer_content(f"TXN-{ulid}"))
+            # Legacy TXN-<epoch>-<6 digits>
+            if len(tail) >= 16 and tail[:16].isdigit():
+                candidates.append(PaymentService._transfer_content(f"TXN-{tail[:10]}-{tail[10:16]}"))
+        return list(dict.fromkeys(candidates))
+
+    @staticmethod
+    def _parse_amount(value) -> float | None:
+        if value is None or value == "":
+            return None
+        if isinstance(value, (int, float)):
+            return float(value)
+        text = re.sub(r"[^0-9,.\-]", "", str(value))
+        if not text:
+            return None
+        # "52,000.00" / "52.000,00": the last separator is decimal only with 1-2 digits after it
+        last = max(text.rfind(","), text.rfind("."))
+        if last != -1 and 1 <= len(text) - last - 1 <= 2:
+            whole, fraction = text[:last], text[last + 1:]
+        else:
+            whole, fraction = text, ""
+        whole = whole.replace(",", "").replace(".", "")
+        try:
+            return float(f"{whole or '0'}.{fraction or '0'}")
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _pick(row: dict, names: tuple) -> object:
+        lowered = {str(k).strip().lower(): v for k, v in row.items()}
+        for name in names:
+            value = lowered.get(name)
+            if value not in (None, ""):
+                return value
+        return None
+
+    @staticmethod
+    def normalize_row(row: dict, line: int) -> dict:
+        description = ReconciliationService._pick(row, ReconciliationService.DESCRIPTION_FIELDS)
+        reference = ReconciliationService._pick(row, ReconciliationService.REFERENCE_FIELDS)
+        amount = ReconciliationService._parse_amount(ReconciliationService._pick(row, ReconciliationService.AMOUNT_FIELDS))
+        if reference is None:
+            # No bank reference: the row content itself identifies it on re-import
+            raw = json.dumps(row, sort_keys=True, ensure_ascii=False, default=str)
+            reference = "sha256:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+        return {
+            "line": line,
+            "reference": str(reference),
+            "description": str(description or ""),
+            "amount": amount,
+        }
+
+    @staticmethod
+    def _iter_json_array(stream: IO[str], chunk_size: int = 1 << 16) -> Iterator[dict]:
+        # Incremental decode of `[ {...}, {...} ]` without loading the whole file
+        decoder = json.JSONDecoder()
+        buffer = stream.read(chunk_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError("Expected a JSON array")
+        buffer = buffer[1:]
+        while True:
+            buffer = buffer.lstrip().lstrip(",").lstrip()
+            if buffer.startswith("]"):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                more = stream.read(chunk_size)
+                if not more:
+                    raise ValueError("Truncated JSON statement")
+                buffer += more
+                continue
+            yield item
+            buffer = buffer[end:]
+
+    @staticmethod
+    def iter_statement(stream: IO[str], fmt: str | None = None) -> Iterator[dict]:
+        """
+        Normalized rows ({line, reference, description, amount}) from a CSV,
+        JSON array or JSON Lines statement, one at a time.
+        """
+        head = stream.read(1)
+        while head and head.isspace():
+            head = stream.read(1)
+        stream = _Prepend(head, stream)
+        if fmt is None:
+            fmt = "json" if head in ("[", "{") else "csv"
+
+        if fmt == "csv":
+            for line, row in enumerate(csv.DictReader(stream), start=2):
+                yield ReconciliationService.normalize_row(row, line)
+        elif fmt == "json":
+            if head == "[":
+                rows = ReconciliationService._iter_json_array(stream)
+            else:
+                rows = (json.loads(text) for text in stream if text.strip())
+            for line, row in enumerate(rows, start=1):
+                yield ReconciliationService.normalize_row(row, line)
+        else:
+            raise ValueError(f"Unsupported statement format: {fmt}")
+
+    # --- matching / settlement ------------------------------------------
+
+    @staticmethod
+    def _settle_batch(db: Session, batch: list[dict], claimed: set[str], report: dict) -> None:
+        contents = {c for row in batch for c in row["candidates"]}
+        payments = {
+            p.transfer_content: p
+            for p in db.execute(
+                select(Payment.transfer_content, Payment.transaction_id, Payment.status, Payment.amount_vnd)
+                .where(Payment.transfer_content.in_(contents))
+            )
+        }
+        keys = [f"statement:{row['reference']}" for row in batch]
+        # Already settled by an earlier import; repeated rows in this one count the same
+        reconciled = set(
+            db.execute(select(WebhookEvent.idempotency_key).where(WebhookEvent.idempotency_key.in_(set(keys)))).scalars()
+        )
+
+        payloads = []
+        pending_rows = []
+        for key, row in zip(keys, batch):
+            payment = next((payments[c] for c in row["candidates"] if c in payments), None)
+            if key in reconciled:
+                report["already_reconciled"] += 1
+            elif payment is None:
+                ReconciliationService._add(report, "mismatches", row, "Unknown payment reference")
+            elif payment.transaction_id in claimed:
+                ReconciliationService._add(report, "mismatches", row, "Duplicate transfer in statement", payment)
+            elif (payment.status or "").upper() == "COMPLETED":
+                ReconciliationService._add(report, "mismatches", row, "Payment already completed", payment)
+            elif row["amount"] is None or abs(float(payment.amount_vnd or 0.0) - row["amount"]) > 0.01:
+                ReconciliationService._add(report, "mismatches", row, "Amount mismatch", payment)
+            else:
+                claimed.add(payment.transaction_id)
+                reconciled.add(key)
+                pending_rows.append((row, payment))
+                payloads.append({
+                    "transaction_id": payment.transaction_id,
+                    "status": "success",
+                    "amount": row["amount"],
+                    "idempotency_key": key,
+                    "source": "bank_statement",
+                    "bank_reference": row["reference"],
+                    "description": row["description"],
+                })
+
+        if not payloads:
+            return
+        # Internal caller: the statement upload itself was authorized
+        results = PaymentService.process_webhook_batch(db, payloads, signature=PaymentService.WEBHOOK_SECRET or None)
+        for (row, payment), result in zip(pending_rows, results):
+            if result.get("ok") and result.get("status") == "COMPLETED":
+                report["settled"] += 1
+                report["settled_amount_vnd"] += row["amount"]
+            else:
+                ReconciliationService._add(report, "mismatches", row, result.get("error") or result.get("reason") or "Not settled", payment)
+
+    @staticmethod
+    def _add(report: dict, kind: str, row: dict, reason: str, payment=None) -> None:
+        report[f"{kind}_count"] += 1
+        if len(report[kind]) < ReconciliationService.REPORT_MAX_ITEMS:
+            item = {
+                "line": row["line"],
+                "reference": row["reference"],
+                "amount": row["amount"],
+                "description": row["description"][:200],
+                "reason": reason,
+            }
+            if payment is not None:
+                item.update(transaction_id=payment.transaction_id, status=payment.status, expected_amount=payment.amount_vnd)
+            report[kind].append(item)
+
+    @staticmethod
+    def reconcile(db: Session, rows: Iterable[dict], batch_size: int | None = None) -> dict:
+        """
+        Match and settle normalized statement rows (see iter_statement).
+        Each batch commits on its own, so a re-run after a crash only
+        reports the already settled rows as already_reconciled.
+        """
+        batch_size = batch_size or ReconciliationService.BATCH_SIZE
+        started = time.perf_counter()
+        report = {
+            "rows": 0,
+            "credits": 0,
+            "settled": 0,
+            "settled_amount_vnd": 0.0,
+            "already_reconciled": 0,
+            "mismatches_count": 0,
+            "leftovers_count": 0,
+            "mismatches": [],
+            "leftovers": [],
+        }
+        claimed: set[str] = set()
+        batch: list[dict] = []
+        for row in rows:
+            report["rows"] += 1
+            if row["amount"] is None or row["amount"] <= 0:
+                # Debits / fees / balance lines
+                continue
+            report["credits"] += 1
+            row["candidates"] = ReconciliationService.extract_references(row["description"])
+            if not row["candidates"]:
+                ReconciliationService._add(report, "leftovers", row, "No payment reference")
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                ReconciliationService._settle_batch(db, batch, claimed, report)
+                batch = []
+        if batch:
+            ReconciliationService._settle_batch(db, batch, claimed, report)
+
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        return report
+
+
+class _Prepend(io.TextIOBase):
+    """Text stream with already consumed characters pushed back in front"""
+
+    def __init__(self, head: str, stream: IO[str]):
+        self._head = head
+        self._stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        head, self._head = self._head, ""
+        if size is None or size < 0:
+            return head + self._stream.read()
+        return head + self._stream.read(max(0, size - len(head)))
+
+    def readline(self, size: int = -1) -> str:
+        if self._head:
+            head, self._head = self._head, ""
+            if head.endswith("\n"):
+                return head
+            return head + self._stream.readline()
+        return self._stream.readline()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Settle payments from a bank statement export")
+    parser.add_argument("statement", help="CSV, JSON array or JSON Lines file")
+    parser.add_argument("--format", choices=["csv", "json"], default=None)
+    parser.add_argument("--batch-size", type=int, default=ReconciliationService.BATCH_SIZE)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        with open(args.statement, encoding="utf-8-sig", newline="") as f:
+            report = ReconciliationService.reconcile(
+                db, ReconciliationService.iter_statement(f, args.format), args.batch_size
+            )
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    # cd backend && python -m services.reconciliation_service statement.csv
+    main()
@@ -0,0 +1,595 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+import aiohttp
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from ids import new_id
+from metrics import RENDER_JOB_OUTCOMES, RENDER_QUEUE_WAIT_SECONDS, RENDER_SECONDS
+from models import RenderJob
+from services.credit_service import CreditService
+from services.payment_cache import invalidate_user_credits
+from services.resilience import UpstreamHTTPError, is_transient_error
+
+logger = logging.getLogger(__name__)
+
+# Takes the claimed job (see RenderJobService.claim) and returns the output URL
+Renderer = Callable[[dict], Awaitable[str]]
+
+
+class QueueFullError(Exception):
+    """The user already has RENDER_MAX_QUEUED_PER_USER unfinished jobs"""
+
+
+class JobStateError(Exception):
+    """The job is no longer in a state that allows the operation"""
+
+
+def _parse_priority_costs(raw: str) -> dict[str, float]:
+    costs = {"low": 0.5, "normal": 1.0, "high": 2.0}
+    for item in raw.split(","):
+        name, _, value = item.strip().partition(":")
+        if name in costs and value:
+            costs[name] = float(value)
+    return costs
+
+
+def _utc(value: datetime) -> datetime:
+    # SQLite hands DateTime(timezone=True) back naive; everything is stored as UTC
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+class RenderJobService:
+    """
+    Render jobs and their credits.
+
+    QUEUED -> RUNNING -> SUCCEEDED
+                      -> QUEUED (transient failure, attempts left)
+                      -> FAILED (refunded)
+    QUEUED -> CANCELLED (refunded)
+
+    Credits are reserved (DEDUCTION) in the same transaction that inserts the
+    job and given back (ADDITION) in the one that fails or cancels it. Every
+    transition is a guarded UPDATE on the expected status, so a refund can't
+    happen twice and a worker whose lease expired can't overwrite a newer attempt.
+    """
+
+    PRIORITIES = {"low": 0, "normal": 1, "high": 2}
+    PRIORITY_NAMES = {level: name for name, level in PRIORITIES.items()}
+
+    # Credits per job = COST x the priority's multiplier
+    COST = float(os.getenv("RENDER_JOB_COST", "1"))
+    PRIORITY_COST = _parse_priority_costs(os.getenv("RENDER_PRIORITY_COST", "low:0.5,normal:1,high:2"))
+    # QUEUED + RUNNING jobs per user (0 = no limit). Also keeps the scheduler's scan window fair
+    MAX_QUEUED_PER_USER = int(os.getenv("RENDER_MAX_QUEUED_PER_USER", "20"))
+    MAX_PARAMS_BYTES = int(os.getenv("RENDER_MAX_PARAMS_BYTES", "16384"))
+
+    # Attempts per job; transient failures are requeued RETRY_DELAY seconds later
+    MAX_ATTEMPTS = int(os.getenv("RENDER_MAX_ATTEMPTS", "3"))
+    RETRY_DELAY = float(os.getenv("RENDER_RETRY_DELAY", "5"))
+    # One render attempt; the lease adds LEASE_GRACE before another worker may take the job over
+    JOB_TIMEOUT = float(os.getenv("RENDER_JOB_TIMEOUT", "600"))
+    LEASE_GRACE = float(os.getenv("RENDER_LEASE_GRACE", "60"))
+
+    @staticmethod
+    def cost(priority: str) -> float:
+        return round(RenderJobService.COST * RenderJobService.PRIORITY_COST[priority], 6)
+
+    @staticmethod
+    def to_dict(job: RenderJob) -> dict:
+        def iso(value: Optional[datetime]) -> Optional[str]:
+            return _utc(value).isoformat() if value is not None else None
+
+        return {
+            "job_id": job.id,
+            "user_id": job.user_id,
+            "status": job.status.lower(),
+            "priority": RenderJobService.PRIORITY_NAMES.get(job.priority, str(job.priority)),
+            "params": json.loads(job.params or "{}"),
+            "cost": job.cost,
+            "refunded": bool(job.refunded),
+            "attempts": job.attempts,
+            "output_url": job.output_url,
+            "error": job.error,
+            "created_at": iso(job.created_at),
+            "started_at": iso(job.started_at),
+            "finished_at": iso(job.finished_at),
+        }
+
+    @staticmethod
+    def submit(db: Session, user_id: str, params: dict | None = None, priority: str = "normal") -> dict:
+        """
+        Reserve the job's credits and queue it, in one transaction.
+        Raises InsufficientCreditsError, QueueFullError or ValueError
+        (unknown user / priority, params too large); nothing is charged then.
+        Returns the job plus the user's new "credits".
+        """
+        if priority not in RenderJobService.PRIORITIES:
+            raise ValueError(f"Invalid priority: {priority}")
+        params_json = json.dumps(params or {}, separators=(",", ":"), ensure_ascii=False)
+        if len(params_json.encode("utf-8")) > RenderJobService.MAX_PARAMS_BYTES:
+            raise ValueError("Render params too large")
+
+        if RenderJobService.MAX_QUEUED_PER_USER:
+            # Soft limit: two concurrent submits may both pass the count
+            unfinished = db.execute(
+                select(func.count())
+                .select_from(RenderJob)
+                .where(RenderJob.user_id == user_id, RenderJob.status.in_(("QUEUED", "RUNNING")))
+            ).scalar_one()
+            if unfinished >= RenderJobService.MAX_QUEUED_PER_USER:
+                db.rollback()
+                raise QueueFullError(
+                    f"Too many unfinished render jobs (max {RenderJobService.MAX_QUEUED_PER_USER})"
+                )
+
+        cost = RenderJobService.cost(priority)
+        credits = CreditService.deduct_credits(db, user_id, cost, commit=False)
+
+        now = datetime.now(timezone.utc)
+        job = RenderJob(
+            id=new_id(),
+            user_id=user_id,
+            status="QUEUED",
+            priority=RenderJobService.PRIORITIES[priority],
+            params=params_json,
+            cost=cost,
+            refunded=False,
+            attempts=0,
+            available_at=now,
+            created_at=now,
+        )
+        db.add(job)
+        data = RenderJobService.to_dict(job)
+        db.commit()
+        invalidate_user_credits(user_id)
+
+        data["credits"] = credits
+        return data
+
+    @staticmethod
+    def _refund(db: Session, user_id: str, cost: float) -> None:
+        if cost:
+            CreditService.add_credits(db, user_id, cost, commit=False)
+
+    @staticmethod
+    def cancel(db: Session, job_id: str, user_id: str) -> dict:
+        """
+        Cancel a QUEUED job and refund it. Raises ValueError if the user has
+        no such job, JobStateError once it is running or finished.
+        """
+        now = datetime.now(timezone.utc)
+        row = db.execute(
+            update(RenderJob)
+            .where(RenderJob.id == job_id, RenderJob.user_id == user_id, RenderJob.status == "QUEUED")
+            .values(status="CANCELLED", refunded=True, finished_at=now)
+            .returning(RenderJob.cost),
+            execution_options={"synchronize_session": False},
+        ).first()
+        if row is None:
+            status = db.execute(
+                select(RenderJob.status).where(RenderJob.id == job_id, RenderJob.user_id == user_id)
+            ).scalar_one_or_none()
+            db.rollback()
+            if status is None:
+                raise ValueError("Render job not found")
+            raise JobStateError(f"Render job is {status.lower()}")
+
+        RenderJobService._refund(db, user_id, row.cost)
+        db.commit()
+        invalidate_user_credits(user_id)
+        return RenderJobService.to_dict(db.get(RenderJob, job_id))
+
+    @staticmethod
+    def queued_window(db: Session, limit: int) -> list:
+        """Oldest runnable QUEUED jobs: (id, user_id, priority, created_at)"""
+        return db.execute(
+            select(RenderJob.id, RenderJob.user_id, RenderJob.priority, RenderJob.created_at)
+            .where(RenderJob.status == "QUEUED", RenderJob.available_at <= datetime.now(timezone.utc))
+            .order_by(RenderJob.created_at, RenderJob.id)
+            .limit(limit)
+        ).all()
+
+    @staticmethod
+    def running_counts(db: Session) -> dict[str, int]:
+        """RUNNING jobs per user, across all workers"""
+        return dict(
+            db.execute(
+                select(RenderJob.user_id, func.count())
+                .where(RenderJob.status == "RUNNING")
+                .group_by(RenderJob.user_id)
+            ).all()
+        )
+
+    @staticmethod
+    def claim(db: Session, job_ids: list[str], worker_id: str) -> list[dict]:
+        """
+        Move the given jobs QUEUED -> RUNNING for this worker and start their
+        lease. Jobs another worker claimed first are skipped.
+        """
+        if not job_ids:
+            return []
+        now = datetime.now(timezone.utc)
+        lease = now + timedelta(seconds=RenderJobService.JOB_TIMEOUT + RenderJobService.LEASE_GRACE)
+        rows = db.execute(
+            update(RenderJob)
+            .where(RenderJob.id.in_(job_ids), RenderJob.status == "QUEUED")
+            .values(
+                status="RUNNING",
+                attempts=RenderJob.attempts + 1,
+                started_at=now,
+                lease_expires_at=lease,
+                worker_id=worker_id,
+            )
+            .returning(
+                RenderJob.id,
+                RenderJob.user_id,
+                RenderJob.priority,
+                RenderJob.params,
+                RenderJob.attempts,
+                RenderJob.created_at,
+            ),
+            execution_options={"synchronize_session": False},
+        ).all()
+        db.commit()
+        return [
+            {
+                "id": row.id,
+                "user_id": row.user_id,
+                "priority": RenderJobService.PRIORITY_NAMES.get(row.priority, str(row.priority)),
+                "params": json.loads(row.params or "{}"),
+                "attempt": row.attempts,
+                "created_at": _utc(row.created_at),
+            }
+            for row in rows
+        ]
+
+    @staticmethod
+    def _running_attempt(job_id: str, attempt: int) -> list:
+        return [RenderJob.id == job_id, RenderJob.status == "RUNNING", RenderJob.attempts == attempt]
+
+    @staticmethod
+    def complete(db: Session, job_id: str, attempt: int, output_url: str) -> bool:
+        """RUNNING -> SUCCEEDED. False if this attempt no longer owns the job."""
+        result = db.execute(
+            update(RenderJob)
+            .where(*RenderJobService._running_attempt(job_id, attempt))
+            .values(
+                status="SUCCEEDED",
+                output_url=output_url,
+                error=None,
+                lease_expires_at=None,
+                finished_at=datetime.now(timezone.utc),
+            ),
+            execution_options={"synchronize_session": False},
+        )
+        db.commit()
+        return result.rowcount == 1
+
+    @staticmethod
+    def fail(db: Session, job_id: str, attempt: int, error: str, retry: bool) -> Optional[str]:
+        """
+        A failed attempt: requeue it (retry and attempts left) or fail the job
+        and refund its credits. Returns "retried", "failed", or None if this
+        attempt no longer owns the job.
+        """
+        now = datetime.now(timezone.utc)
+        error = error[:1000]
+        if retry and attempt < RenderJobService.MAX_ATTEMPTS:
+            result = db.execute(
+                update(RenderJob)
+                .where(*RenderJobService._running_attempt(job_id, attempt))
+                .values(
+                    status="QUEUED",
+                    error=error,
+                    available_at=now + timedelta(seconds=RenderJobService.RETRY_DELAY),
+                    lease_expires_at=None,
+                    worker_id=None,
+                ),
+                execution_options={"synchronize_session": False},
+            )
+            db.commit()
+            return "retried" if result.rowcount == 1 else None
+
+        row = db.execute(
+            update(RenderJob)
+            .where(*RenderJobService._running_attempt(job_id, attempt), RenderJob.refunded.is_(False))
+            .values(status="FAILED", error=error, refunded=True, lease_expires_at=None, finished_at=now)
+            .returning(RenderJob.user_id, RenderJob.cost),
+            execution_options={"synchronize_session": False},
+        ).first()
+        if row is None:
+            db.rollback()
+            return None
+        RenderJobService._refund(db, row.user_id, row.cost)
+        db.commit()
+        invalidate_user_credits(row.user_id)
+        return "failed"
+
+    @staticmethod
+    def release(db: Session, jobs: list[tuple[str, int]]) -> int:
+        """Put interrupted attempts (worker shutting down) back in the queue without counting them"""
+        released = 0
+        for job_id, attempt in jobs:
+            result = db.execute(
+                update(RenderJob)
+                .where(*RenderJobService._running_attempt(job_id, attempt))
+                .values(status="QUEUED", attempts=attempt - 1, lease_expires_at=None, worker_id=None),
+                execution_options={"synchronize_session": False},
+            )
+            released += result.rowcount
+        db.commit()
+        return released
+
+    @staticmethod
+    def recover_expired(db: Session) -> dict:
+        """
+        RUNNING jobs whose lease ran out (their worker died or hung): requeue
+        them, or fail and refund the ones out of attempts.
+        """
+        rows = db.execute(
+            select(RenderJob.id, RenderJob.attempts).where(
+                RenderJob.status == "RUNNING", RenderJob.lease_expires_at < datetime.now(timezone.utc)
+            )
+        ).all()
+        db.rollback()
+        counts = {"retried": 0, "failed": 0}
+        for row in rows:
+            outcome = RenderJobService.fail(db, row.id, row.attempts, "Render lease expired", retry=True)
+            if outcome is not None:
+                counts[outcome] += 1
+                RENDER_JOB_OUTCOMES.labels("expired").inc()
+        return counts
+
+
+class RenderScheduler:
+    """
+    Runs QUEUED render jobs on at most `workers` concurrent renders in this
+    process. Every app worker may run one; jobs are claimed with a guarded
+    UPDATE, so they never run twice.
+
+    Each dispatch reads the oldest `scan_window` runnable jobs and fills the
+    free slots in this order:
+      1. priority, raised one level per `aging_seconds` waited (no starvation)
+      2. the user with the fewest RUNNING jobs across all workers (fair share)
+      3. the user this worker served least recently (round robin)
+      4. oldest job first
+    A user at `max_running_per_user` is skipped until one of their jobs ends.
+    Submits in this worker wake the scheduler at once; jobs submitted
+    elsewhere are picked up within `poll_interval`.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_running_per_user: int,
+        poll_interval: float,
+        scan_window: int,
+        aging_seconds: float,
+        recovery_interval: float,
+    ):
+        self.workers = workers
+        self.max_running_per_user = max_running_per_user
+        self.poll_interval = poll_interval
+        self.scan_window = scan_window
+        self.aging_seconds = aging_seconds
+        self.recovery_interval = recovery_interval
+        self.renderer: Optional[Renderer] = None
+        self.worker_id = ""
+        # job id -> (render task, attempt)
+        self._running: dict[str, tuple[asyncio.Task, int]] = {}
+        self._last_served: dict[str, int] = {}
+        self._served = itertools.count(1)
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._counts = {"dispatched": 0, "succeeded": 0, "retried": 0, "failed": 0}
+
+    def start(self, renderer: Optional[Renderer] = None) -> Optional[asyncio.Task]:
+        """
+        Called from the app lifespan. Without a renderer, jobs go to
+        RENDER_BACKEND_URL; with neither (or workers = 0) this worker doesn't
+        run jobs and they wait for one that does.
+        """
+        if self.workers <= 0:
+            return None
+        if renderer is None:
+            if not RENDER_BACKEND_URL:
+                return None
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None))
+            renderer = self._render_via_backend
+        self.renderer = renderer
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self) -> None:
+        """Stop dispatching, interrupt running renders and requeue them"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        interrupted = [(job_id, attempt) for job_id, (_, attempt) in self._running.items()]
+        tasks = [task for task, _ in self._running.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(self._task, *tasks, return_exceptions=True)
+        if interrupted:
+            await run_in_threadpool(self._with_session, RenderJobService.release, interrupted)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self._task = None
+
+    def notify(self) -> None:
+        """Wake the dispatcher (a job was queued or a slot freed). Safe to call from any thread."""
+        if self._loop is None or self._wakeup is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # Loop already closed (worker shutting down)
+            pass
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "running": len(self._running), **self._counts}
+
+    @staticmethod
+    def _with_session(fn, *args):
+        db = SessionLocal()
+        try:
+            return fn(db, *args)
+        finally:
+            db.close()
+
+    async def _run(self) -> None:
+        next_recovery = 0.0
+        while True:
+            self._wakeup.clear()
+            claimed = []
+            try:
+                if self.recovery_interval > 0 and time.monotonic() >= next_recovery:
+                    next_recovery = time.monotonic() + self.recovery_interval
+                    await run_in_threadpool(self._with_session, RenderJobService.recover_expired)
+                free = self.workers - len(self._running)
+                if free > 0:
+                    claimed = await run_in_threadpool(self._with_session, self._dispatch, free)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Render job dispatch failed")
+
+            for job in claimed:
+                self._running[job["id"]] = (asyncio.create_task(self._execute(job)), job["attempt"])
+            if claimed and len(self._running) < self.workers:
+                # More may be runnable (and some picks may have lost to another worker)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self, db: Session, free: int) -> list[dict]:
+        window = RenderJobService.queued_window(db, self.scan_window)
+        if not window:
+            return []
+        picks = self.pick(window, RenderJobService.running_counts(db), free)
+        claimed = RenderJobService.claim(db, [job.id for job in picks], self.worker_id)
+        self._counts["dispatched"] += len(claimed)
+        return claimed
+
+    def pick(self, window: list, running: dict[str, int], free: int) -> list:
+        """Choose up to `free` jobs from the window (see the class docstring for the order)"""
+        now = datetime.now(timezone.utc)
+        running = dict(running)
+        remaining = list(window)
+        picks = []
+        while remaining and len(picks) < free:
+            best_key, best = None, None
+            for job in remaining:
+                if self.max_running_per_user and running.get(job.user_id, 0) >= self.max_running_per_user:
+                    continue
+                created_at = _utc(job.created_at)
+                level = job.priority
+                if self.aging_seconds > 0:
+                    level += int((now - created_at).total_seconds() // self.aging_seconds)
+                key = (-level, running.get(job.user_id, 0), self._last_served.get(job.user_id, 0), created_at, job.id)
+                if best_key is None or key < best_key:
+                    best_key, best = key, job
+            if best is None:
+                break
+            picks.append(best)
+            remaining.remove(best)
+            running[best.user_id] = running.get(best.user_id, 0) + 1
+            self._last_served[best.user_id] = next(self._served)
+
+        if len(self._last_served) > 100_000:
+            # Only the relative order matters; forget users not seen for a long time
+            recent = sorted(self._last_served.items(), key=lambda item: item[1])[-10_000:]
+            self._last_served = dict(recent)
+        return picks
+
+    async def _execute(self, job: dict) -> None:
+        if job["attempt"] == 1:
+            waited = (datetime.now(timezone.utc) - job["created_at"]).total_seconds()
+            RENDER_QUEUE_WAIT_SECONDS.labels(job["priority"]).observe(max(waited, 0.0))
+        started = time.perf_counter()
+        try:
+            try:
+                output_url = await asyncio.wait_for(
+                    self.renderer(job), RenderJobService.JOB_TIMEOUT if RenderJobService.JOB_TIMEOUT > 0 else None
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                RENDER_SECONDS.labels("error").observe(time.perf_counter() - started)
+                outcome = await run_in_threadpool(
+                    self._with_session,
+                    RenderJobService.fail,
+                    job["id"],
+                    job["attempt"],
+                    str(e) or type(e).__name__,
+                    is_transient_error(e),
+                )
+                if outcome is None:
+                    logger.warning("Render job %s attempt %s lost its lease", job["id"], job["attempt"])
+                else:
+                    self._counts[outcome] += 1
+                    RENDER_JOB_OUTCOMES.labels(outcome).inc()
+            else:
+                RENDER_SECONDS.labels("ok").observe(time.perf_counter() - started)
+                if await run_in_threadpool(
+                    self._with_session, RenderJobService.complete, job["id"], job["attempt"], output_url
+                ):
+                    self._counts["succeeded"] += 1
+                    RENDER_JOB_OUTCOMES.labels("succeeded").inc()
+                else:
+                    logger.warning("Render job %s attempt %s lost its lease", job["id"], job["attempt"])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Status update failed; the lease expiry recovers the job
+            logger.exception("Render job %s: status update failed", job["id"])
+        finally:
+            self._running.pop(job["id"], None)
+            self.notify()
+
+    async def _render_via_backend(self, job: dict) -> str:
+        """POST the job to RENDER_BACKEND_URL; it answers { "output_url": ... } when done"""
+        headers = {"authorization": f"Bearer {RENDER_BACKEND_API_KEY}"} if RENDER_BACKEND_API_KEY else {}
+        body = {"job_id": job["id"], "user_id": job["user_id"], "priority": job["priority"], "params": job["params"]}
+        async with self._session.post(RENDER_BACKEND_URL, json=body, headers=headers) as response:
+            if response.status >= 400:
+                text = await response.text()
+                raise UpstreamHTTPError(f"Render backend returned {response.status}: {text[:200]}", response.status)
+            data = await response.json(content_type=None)
+        output_url = (data or {}).get("output_url")
+        if not output_url:
+            raise ValueError("Render backend response has no output_url")
+        return output_url
+
+
+# Render backend called by the default renderer (empty = this worker doesn't run jobs)
+RENDER_BACKEND_URL = os.getenv("RENDER_BACKEND_URL", "")
+RENDER_BACKEND_API_KEY = os.getenv("RENDER_BACKEND_API_KEY", "")
+
+render_scheduler = RenderScheduler(
+    workers=int(os.getenv("RENDER_WORKERS", "2")),
+    max_running_per_user=int(os.getenv("RENDER_MAX_RUNNING_PER_USER", "0")),
+    poll_interval=float(os.getenv("RENDER_POLL_INTERVAL", "1")),
+    scan_window=int(os.getenv("RENDER_SCAN_WINDOW", "500")),
+    aging_seconds=float(os.getenv("RENDER_PRIORITY_AGING_SECONDS", "300")),
+    recovery_interval=float(os.getenv("RENDER_RECOVERY_INTERVAL", "60")),
+)
@@ -0,0 +1,262 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import aiohttp
+
+from metrics import UPSTREAM_ATTEMPTS, UPSTREAM_CIRCUIT_OPENED, UPSTREAM_CIRCUIT_STATE, UPSTREAM_HEDGES
+
+T = TypeVar("T")
+
+
+class UpstreamHTTPError(Exception):
+    """Upstream answered with an error status"""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+class CircuitOpenError(Exception):
+    """The upstream's circuit breaker is open; the call was not attempted"""
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"{upstream} is unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Connection failures, timeouts, 5xx and 429: worth retrying, and they count against the breaker"""
+    if isinstance(error, UpstreamHTTPError):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError))
+
+
+def is_pre_send_error(error: BaseException) -> bool:
+    """
+    Failures where the request never left this process: no connection could be
+    made, or the breaker refused the call. The only ones safe to retry for a
+    non-idempotent request such as an upload.
+    """
+    return isinstance(error, (aiohttp.ClientConnectorError, CircuitOpenError))
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one upstream, per process.
+    closed: calls go through; `failure_threshold` transient failures in a row
+    open it. open: calls fail fast with CircuitOpenError for `reset_timeout`
+    seconds, then half_open: `half_open_calls` trial calls are let through; a
+    success closes the circuit, a failure opens it again.
+    The state is exported as the upstream_circuit_state gauge.
+    """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    _GAUGE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, upstream: str, failure_threshold: int, reset_timeout: float, half_open_calls: int = 1):
+        self.upstream = upstream
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trials = 0
+        self._lock = threading.Lock()
+        self.opened = 0
+        UPSTREAM_CIRCUIT_STATE.labels(upstream=upstream).set(0)
+
+    def _set_state(self, state: str) -> None:
+        self._state = state
+        UPSTREAM_CIRCUIT_STATE.labels(upstream=self.upstream).set(self._GAUGE_VALUES[state])
+        if state == self.OPEN:
+            self._opened_at = time.monotonic()
+            self.opened += 1
+            UPSTREAM_CIRCUIT_OPENED.labels(upstream=self.upstream).inc()
+        elif state == self.HALF_OPEN:
+            self._trials = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def before_call(self) -> None:
+        """
+        Admit a call or raise CircuitOpenError. Every admitted call must end
+        in record_success(), record_failure() or release().
+        """
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            if self._state == self.OPEN:
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(self.upstream, remaining)
+                self._set_state(self.HALF_OPEN)
+            if self._state == self.HALF_OPEN:
+                if self._trials >= self.half_open_calls:
+                    raise CircuitOpenError(self.upstream, 1.0)
+                self._trials += 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            if self._state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (
+                self._state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._set_state(self.OPEN)
+
+    def release(self) -> None:
+        """An admitted call ended without telling us anything (cancelled, rejected locally)"""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._trials > 0:
+                self._trials -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            retry_after = 0.0
+            if self._state == self.OPEN:
+                retry_after = max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "opened": self.opened,
+                "retry_after": retry_after,
+            }
+
+
+async def _attempt(
+    call: Callable[[], Awaitable[T]],
+    upstream: str,
+    breaker: Optional[CircuitBreaker],
+) -> T:
+    if breaker is not None:
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            UPSTREAM_ATTEMPTS.labels(upstream=upstream, outcome="rejected").inc()
+            raise
+    try:
+        result = await call()
+    except asyncio.CancelledError:
+        UPSTREAM_ATTEMPTS.labels(upstream=upstream, outcome="cancelled").inc()
+        if breaker is not None:
+            breaker.release()
+        raise
+    except Exception as e:
+        if isinstance(e, asyncio.TimeoutError):
+            outcome = "timeout"
+        elif is_transient_error(e):
+            outcome = "transient"
+        else:
+            outcome = "error"
+        UPSTREAM_ATTEMPTS.labels(upstream=upstream, outcome=outcome).inc()
+        if breaker is not None:
+            if outcome == "error":
+                breaker.release()
+            else:
+                breaker.record_failure()
+        raise
+    UPSTREAM_ATTEMPTS.labels(upstream=upstream, outcome="ok").inc()
+    if breaker is not None:
+        breaker.record_success()
+    return result
+
+
+async def _hedged(
+    call: Callable[[], Awaitable[T]],
+    upstream: str,
+    breaker: Optional[CircuitBreaker],
+    hedge_delay: float,
+    discard: Optional[Callable[[T], None]] = None,
+) -> T:
+    first = asyncio.ensure_future(_attempt(call, upstream, breaker))
+    try:
+        done, _ = await asyncio.wait({first}, timeout=hedge_delay)
+    except asyncio.CancelledError:
+        first.cancel()
+        raise
+    if done:
+        return first.result()
+
+    second = asyncio.ensure_future(_attempt(call, upstream, breaker))
+    pending = {first, second}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winners = [task for task in done if task.exception() is None]
+            if winners:
+                winner = first if first in winners else winners[0]
+                UPSTREAM_HEDGES.labels(upstream=upstream, winner="first" if winner is first else "hedge").inc()
+                # Both copies finished in the same tick: free the one we don't return
+                for task in winners:
+                    if task is not winner and discard is not None:
+                        discard(task.result())
+                return winner.result()
+            for task in done:
+                # Prefer the real failure over "circuit open" from the copy that was refused
+                if error is None or isinstance(error, CircuitOpenError):
+                    error = task.exception()
+        UPSTREAM_HEDGES.labels(upstream=upstream, winner="none").inc()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def call_with_retries(
+    call: Callable[[], Awaitable[T]],
+    upstream: str,
+    attempts: int = 1,
+    base_delay: float = 0.2,
+    max_delay: float = 2.0,
+    breaker: Optional[CircuitBreaker] = None,
+    hedge_delay: float = 0.0,
+    retry_on: Callable[[BaseException], bool] = is_transient_error,
+    discard: Optional[Callable[[T], None]] = None,
+) -> T:
+    """
+    Run `call` (one attempt) up to `attempts` times. Failures `retry_on`
+    accepts (default: transient ones) are retried after a full-jitter
+    backoff, uniform(0, min(max_delay, base_delay * 2**n)); anything else is
+    raised at once. CircuitOpenError is retried only if `retry_on` accepts it
+    and the breaker admits calls again within max_delay. With hedge_delay > 0,
+    an attempt still pending after that many seconds gets a second copy
+    started next to it: the first success wins, the other is cancelled (or
+    passed to `discard` if it succeeded too).
+
+    Non-idempotent calls (uploads) must not hedge and should pass
+    retry_on=is_pre_send_error: a timeout or 5xx may come after the upstream
+    already acted on the request.
+    """
+    for attempt in range(max(1, attempts)):
+        try:
+            if hedge_delay > 0:
+                return await _hedged(call, upstream, breaker, hedge_delay, discard)
+            return await _attempt(call, upstream, breaker)
+        except Exception as e:
+            if not retry_on(e) or attempt >= attempts - 1:
+                raise
+            wait = 0.0
+            if isinstance(e, CircuitOpenError):
+                if e.retry_after > max_delay:
+                    raise
+                wait = e.retry_after
+        await asyncio.sleep(max(wait, random.uniform(0, min(max_delay, base_delay * 2 ** attempt))))
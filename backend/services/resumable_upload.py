@@ -0,0 +1,294 @@
+import argparse
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from typing import AsyncIterator, Optional
+
+import aiofiles
+from fastapi.concurrency import run_in_threadpool
+
+from ids import new_id
+from services.zipline_service import UploadTooLargeError, ZiplineService
+
+logger = logging.getLogger(__name__)
+
+
+class UploadSessionNotFound(Exception):
+    """Unknown, aborted or cleaned-up upload session"""
+
+
+class UploadConflictError(Exception):
+    """Request does not match the session state (offset mismatch, busy, incomplete)"""
+
+    def __init__(self, message: str, offset: Optional[int] = None):
+        super().__init__(message)
+        self.offset = offset
+
+
+class ResumableUploadService:
+    """
+    tus-style resumable uploads staged on local disk:
+    create a session, append chunks at the current offset (a dropped
+    connection keeps every byte that arrived), query the offset, then
+    finalize, which relays the assembled file to Zipline.
+
+    Each session is <id>.part (the bytes, append-only) and <id>.json (metadata)
+    under UPLOAD_STAGING_DIR. The .part size is the offset; an flock on it
+    keeps two requests from writing or finalizing the same session at once,
+    also across workers on the same host.
+    """
+
+    STAGING_DIR = os.getenv("UPLOAD_STAGING_DIR") or os.path.join(tempfile.gettempdir(), "rendertool-uploads")
+    # Sessions untouched for this many seconds are removed by the cleanup job
+    SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL", "86400"))
+    # Background cleanup in the app lifespan (0 disables; run the CLI from cron instead)
+    CLEANUP_INTERVAL = float(os.getenv("UPLOAD_CLEANUP_INTERVAL", "3600"))
+
+    @staticmethod
+    def _paths(upload_id: str) -> tuple[str, str]:
+        # Ids are UUIDs; anything else never reaches the filesystem
+        try:
+            upload_id = str(uuid.UUID(upload_id))
+        except ValueError:
+            raise UploadSessionNotFound("Upload not found")
+        base = os.path.join(ResumableUploadService.STAGING_DIR, upload_id)
+        return base + ".part", base + ".json"
+
+    @staticmethod
+    def _load(upload_id: str) -> dict:
+        _, meta_path = ResumableUploadService._paths(upload_id)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadSessionNotFound("Upload not found")
+
+    @staticmethod
+    def _save(meta: dict) -> None:
+        _, meta_path = ResumableUploadService._paths(meta["upload_id"])
+        tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    @staticmethod
+    def _lock(fd: int) -> None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadConflictError("Upload is busy in another request")
+
+    @staticmethod
+    def _state(meta: dict, offset: int) -> dict:
+        return {
+            "upload_id": meta["upload_id"],
+            "filename": meta["filename"],
+            "size": meta["size"],
+            "offset": offset,
+            "status": meta["status"],
+            "url": (meta.get("result") or {}).get("url"),
+        }
+
+    @staticmethod
+    def create(filename: str, size: int, content_type: Optional[str] = None) -> dict:
+        """Start a session for a file of `size` bytes. Returns the session state (offset 0)."""
+        if size < 0:
+            raise ValueError("size must be >= 0")
+        ZiplineService._check_size(size)
+
+        os.makedirs(ResumableUploadService.STAGING_DIR, exist_ok=True)
+        meta = {
+            "upload_id": new_id(),
+            "filename": filename,
+            "size": size,
+            "content_type": content_type or "application/octet-stream",
+            "status": "uploading",
+            "created_at": time.time(),
+        }
+        part_path, _ = ResumableUploadService._paths(meta["upload_id"])
+        open(part_path, "xb").close()
+        ResumableUploadService._save(meta)
+        return ResumableUploadService._state(meta, 0)
+
+    @staticmethod
+    def status(upload_id: str) -> dict:
+        meta = ResumableUploadService._load(upload_id)
+        if meta["status"] == "completed":
+            return ResumableUploadService._state(meta, meta["size"])
+        part_path, _ = ResumableUploadService._paths(upload_id)
+        try:
+            offset = os.path.getsize(part_path)
+        except FileNotFoundError:
+            raise UploadSessionNotFound("Upload not found")
+        return ResumableUploadService._state(meta, offset)
+
+    @staticmethod
+    async def append(
+        upload_id: str, offset: int, chunks: AsyncIterator[bytes], length: Optional[int] = None
+    ) -> dict:
+        """
+        Append the request body at `offset`, which must equal the current
+        offset (UploadConflictError carries the real one otherwise). Chunks
+        are written as they arrive; if the stream breaks, what was written
+        stays and the client resumes from status()["offset"]. A known body
+        `length` that would overrun the declared size is refused up front.
+        """
+        meta = ResumableUploadService._load(upload_id)
+        if meta["status"] != "uploading":
+            raise UploadConflictError("Upload already finalized", meta["size"])
+        if length is not None and offset + length > meta["size"]:
+            raise UploadTooLargeError(f"Chunk exceeds the declared upload size of {meta['size']} bytes")
+        part_path, _ = ResumableUploadService._paths(upload_id)
+
+        # r+b, not ab: must not recreate a .part the cleanup job just removed
+        try:
+            f = await aiofiles.open(part_path, "r+b")
+        except FileNotFoundError:
+            raise UploadSessionNotFound("Upload not found")
+        try:
+            ResumableUploadService._lock(f.fileno())
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                raise UploadConflictError(f"Offset mismatch: upload is at {current}", current)
+            await f.seek(current)
+
+            written = current
+            try:
+                async for chunk in chunks:
+                    if written + len(chunk) > meta["size"]:
+                        raise UploadTooLargeError(f"Chunk exceeds the declared upload size of {meta['size']} bytes")
+                    await f.write(chunk)
+                    written += len(chunk)
+            finally:
+                await f.flush()
+        finally:
+            # Closing the descriptor also releases the flock
+            await f.close()
+        return ResumableUploadService._state(meta, written)
+
+    @staticmethod
+    async def finalize(upload_id: str) -> dict:
+        """
+        Relay the complete file to Zipline and drop the staged bytes.
+        Idempotent: finalizing again returns the stored result.
+        """
+        meta = ResumableUploadService._load(upload_id)
+        if meta["status"] == "completed":
+            return ResumableUploadService._state(meta, meta["size"])
+        part_path, _ = ResumableUploadService._paths(upload_id)
+
+        try:
+            f = open(part_path, "rb")
+        except FileNotFoundError:
+            # A concurrent finalize completed (and removed the bytes) since the first read
+            meta = ResumableUploadService._load(upload_id)
+            if meta["status"] == "completed":
+                return ResumableUploadService._state(meta, meta["size"])
+            raise UploadSessionNotFound("Upload not found")
+        with f:
+            ResumableUploadService._lock(f.fileno())
+            # Same race, with the other finalize releasing the lock just before ours
+            meta = ResumableUploadService._load(upload_id)
+            if meta["status"] == "completed":
+                return ResumableUploadService._state(meta, meta["size"])
+            offset = os.fstat(f.fileno()).st_size
+            if offset != meta["size"]:
+                raise UploadConflictError(f"Upload incomplete: {offset} of {meta['size']} bytes", offset)
+
+            result = await ZiplineService.upload_local_file(part_path, meta["filename"], meta["content_type"])
+            meta.update(status="completed", result=result)
+            ResumableUploadService._save(meta)
+            os.remove(part_path)
+        return ResumableUploadService._state(meta, meta["size"])
+
+    @staticmethod
+    def abort(upload_id: str) -> None:
+        part_path, meta_path = ResumableUploadService._paths(upload_id)
+        ResumableUploadService._load(upload_id)
+        try:
+            with open(part_path, "rb") as f:
+                ResumableUploadService._lock(f.fileno())
+                os.remove(part_path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.remove(meta_path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def cleanup_expired(ttl_seconds: Optional[float] = None) -> dict:
+        """
+        Remove sessions (finished or not) whose files were last touched more
+        than ttl_seconds ago. Sessions locked by a running request are skipped.
+        Returns { "removed": n, "bytes": n }.
+        """
+        ttl_seconds = ResumableUploadService.SESSION_TTL if ttl_seconds is None else ttl_seconds
+        staging_dir = ResumableUploadService.STAGING_DIR
+        cutoff = time.time() - ttl_seconds
+        removed = 0
+        freed = 0
+        try:
+            names = os.listdir(staging_dir)
+        except FileNotFoundError:
+            return {"removed": 0, "bytes": 0}
+
+        upload_ids = {name.split(".", 1)[0] for name in names if name.endswith((".part", ".json"))}
+        for upload_id in upload_ids:
+            try:
+                part_path, meta_path = ResumableUploadService._paths(upload_id)
+            except UploadSessionNotFound:
+                continue
+            stats = [os.stat(p) for p in (part_path, meta_path) if os.path.exists(p)]
+            if not stats or max(s.st_mtime for s in stats) > cutoff:
+                continue
+            try:
+                with open(part_path, "rb") as f:
+                    ResumableUploadService._lock(f.fileno())
+                    freed += os.fstat(f.fileno()).st_size
+                    os.remove(part_path)
+            except FileNotFoundError:
+                pass
+            except UploadConflictError:
+                continue
+            try:
+                os.remove(meta_path)
+            except FileNotFoundError:
+                pass
+            removed += 1
+        return {"removed": removed, "bytes": freed}
+
+    @staticmethod
+    async def _cleanup_forever(interval: float) -> None:
+        while True:
+            try:
+                await run_in_threadpool(ResumableUploadService.cleanup_expired)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Upload session cleanup failed")
+            await asyncio.sleep(interval)
+
+    @staticmethod
+    def start_background_cleanup() -> Optional[asyncio.Task]:
+        """Called from the app lifespan; concurrent cleanups skip locked sessions."""
+        if ResumableUploadService.CLEANUP_INTERVAL <= 0:
+            return None
+        return asyncio.create_task(ResumableUploadService._cleanup_forever(ResumableUploadService.CLEANUP_INTERVAL))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Remove abandoned resumable upload sessions")
+    parser.add_argument("--ttl", type=float, default=ResumableUploadService.SESSION_TTL, help="seconds since last write")
+    args = parser.parse_args()
+    print(ResumableUploadService.cleanup_expired(args.ttl))
+
+
+if __name__ == "__main__":
+    # cd backend && python -m services.resumable_upload --ttl 86400
+    main()
@@ -0,0 +1,124 @@
+import binascii
+import hashlib
+import io
+import os
+from typing import Optional
+
+import segno
+
+from services.cache import LRUTTLCache
+
+
+class VietQRService:
+    """
+    VietQR (NAPAS, EMVCo merchant-presented) payloads and QR images built
+    in-process, so checkout doesn't depend on img.vietqr.io.
+
+    Payload = TLV fields "<id><2-digit length><value>", closed by the CRC field
+    63 (CRC-16/CCITT-FALSE over everything before it, including "6304").
+    """
+
+    GUID = "A000000727"  # NAPAS
+    SERVICE_TO_ACCOUNT = "QRIBFTTA"  # transfer to a bank account number
+    CURRENCY_VND = "704"
+    COUNTRY = "VN"
+
+    FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+    SCALE = int(os.getenv("PAYMENT_QR_SCALE", "8"))
+    BORDER = int(os.getenv("PAYMENT_QR_BORDER", "4"))
+    ERROR_LEVEL = os.getenv("PAYMENT_QR_ERROR_LEVEL", "M")
+    # A payment's QR never changes (amount and transfer content are fixed), so browsers may keep it
+    CACHE_MAX_AGE = int(os.getenv("PAYMENT_QR_CACHE_MAX_AGE", str(365 * 24 * 3600)))
+
+    # (transaction_id, format) -> (image bytes, etag)
+    image_cache = LRUTTLCache(
+        max_entries=int(os.getenv("PAYMENT_QR_CACHE_MAX_ENTRIES", "5000")),
+        ttl_seconds=float(os.getenv("PAYMENT_QR_CACHE_TTL", "3600")),
+    )
+
+    @staticmethod
+    def crc16(data: bytes) -> str:
+        # binascii.crc_hqx is CRC-CCITT (poly 0x1021, unreflected); init 0xFFFF makes it CCITT-FALSE
+        return f"{binascii.crc_hqx(data, 0xFFFF):04X}"
+
+    @staticmethod
+    def _tlv(tag: str, value: str) -> str:
+        if len(value) > 99:
+            raise ValueError(f"VietQR field {tag} is longer than 99 characters")
+        return f"{tag}{len(value):02d}{value}"
+
+    @staticmethod
+    def build_payload(
+        bank_bin: str,
+        account_number: str,
+        amount_vnd: Optional[float] = None,
+        purpose: Optional[str] = None,
+        bill_number: Optional[str] = None,
+    ) -> str:
+        """
+        Payload for a transfer to `account_number` at the bank with this BIN.
+        With an amount the QR is dynamic (point of initiation 12), else static (11).
+        `purpose` is the transfer content the payer's app pre-fills.
+        """
+        tlv = VietQRService._tlv
+        beneficiary = tlv("00", bank_bin) + tlv("01", account_number)
+        merchant_account = (
+            tlv("00", VietQRService.GUID)
+            + tlv("01", beneficiary)
+            + tlv("02", VietQRService.SERVICE_TO_ACCOUNT)
+        )
+
+        payload = tlv("00", "01") + tlv("01", "12" if amount_vnd is not None else "11")
+        payload += tlv("38", merchant_account) + tlv("53", VietQRService.CURRENCY_VND)
+        if amount_vnd is not None:
+            payload += tlv("54", str(int(round(float(amount_vnd)))))
+        payload += tlv("58", VietQRService.COUNTRY)
+
+        additional = ""
+        if bill_number:
+            additional += tlv("01", bill_number)
+        if purpose:
+            additional += tlv("08", purpose)
+        if additional:
+            payload += tlv("62", additional)
+
+        payload += "6304"
+        return payload + VietQRService.crc16(payload.encode("utf-8"))
+
+    @staticmethod
+    def render(payload: str, fmt: str = "png") -> bytes:
+        if fmt not in VietQRService.FORMATS:
+            raise ValueError(f"Unsupported QR format: {fmt}")
+        qr = segno.make(payload, error=VietQRService.ERROR_LEVEL, micro=False)
+        buffer = io.BytesIO()
+        if fmt == "svg":
+            qr.save(buffer, kind="svg", scale=VietQRService.SCALE, border=VietQRService.BORDER,
+                    xmldecl=False, svgclass=None, lineclass=None)
+        else:
+            qr.save(buffer, kind="png", scale=VietQRService.SCALE, border=VietQRService.BORDER)
+        return buffer.getvalue()
+
+    @staticmethod
+    def cached_image(transaction_id: str, fmt: str) -> Optional[tuple[bytes, str]]:
+        """(image, etag) for a payment's QR if already rendered"""
+        return VietQRService.image_cache.get((transaction_id, fmt))
+
+    @staticmethod
+    def render_payment(
+        transaction_id: str,
+        fmt: str,
+        bank_bin: str,
+        account_number: str,
+        amount_vnd: float,
+        transfer_content: str,
+    ) -> tuple[bytes, str]:
+        """Render a payment's QR and cache it by (transaction_id, fmt). Returns (image, etag)."""
+        payload = VietQRService.build_payload(bank_bin, account_number, amount_vnd, transfer_content)
+        image = VietQRService.render(payload, fmt)
+        etag = '"' + hashlib.sha256(image).hexdigest()[:32] + '"'
+        VietQRService.image_cache.set((transaction_id, fmt), (image, etag))
+        return image, etag
+
+    @staticmethod
+    def cache_stats() -> dict:
+        return VietQRService.image_cache.stats()
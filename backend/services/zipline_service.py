@@ -1,105 +1,484 @@
+import asyncio
+import hashlib
 import os
+import time
 import aiohttp
 import aiofiles
-from typing import Optional
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Optional
 from fastapi import UploadFile
 
+from metrics import ZIPLINE_UPLOAD_BYTES, ZIPLINE_UPLOAD_SECONDS
+from services.cache import LRUTTLCache
+from services.resilience import CircuitBreaker, UpstreamHTTPError, call_with_retries, is_pre_send_error
+
+
+class UploadTooLargeError(Exception):
+    """File vượt quá giới hạn ZIPLINE_MAX_UPLOAD_SIZE"""
+
+
 class ZiplineService:
     ZIPLINE_API_URL = os.getenv("ZIPLINE_API_URL", "")
     ZIPLINE_API_KEY = os.getenv("ZIPLINE_API_KEY", "")
-    
+
+    # Đọc/gửi file theo từng chunk để RAM mỗi request không phụ thuộc kích thước file
+    CHUNK_SIZE = int(os.getenv("ZIPLINE_UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+    # 0 = không giới hạn
+    MAX_UPLOAD_SIZE = int(os.getenv("ZIPLINE_MAX_UPLOAD_SIZE", str(500 * 1024 * 1024)))
+
+    # HTTP client dùng chung cho cả app (tạo/đóng trong lifespan của main.py)
+    HTTP_LIMIT = int(os.getenv("ZIPLINE_HTTP_LIMIT", "100"))
+    HTTP_LIMIT_PER_HOST = int(os.getenv("ZIPLINE_HTTP_LIMIT_PER_HOST", "20"))
+    HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("ZIPLINE_HTTP_KEEPALIVE_TIMEOUT", "30"))
+    HTTP_DNS_TTL = int(os.getenv("ZIPLINE_HTTP_DNS_TTL", "300"))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("ZIPLINE_HTTP_CONNECT_TIMEOUT", "10"))
+    HTTP_READ_TIMEOUT = float(os.getenv("ZIPLINE_HTTP_READ_TIMEOUT", "60"))
+
+    # Số URL relay song song tối đa trong upload_files_from_urls
+    RELAY_CONCURRENCY = int(os.getenv("ZIPLINE_RELAY_CONCURRENCY", "4"))
+    # Batch upload (/api/upload/batch): số file gửi song song và số file tối đa mỗi request
+    BATCH_CONCURRENCY = int(os.getenv("ZIPLINE_BATCH_CONCURRENCY", "4"))
+    BATCH_MAX_FILES = int(os.getenv("ZIPLINE_BATCH_MAX_FILES", "50"))
+
+    # Cache dedup theo nội dung: sha256 -> { "url", "name" } đã upload lên Zipline
+    # (hit/miss xuất ra /metrics: cache_lookups_total{cache="zipline_dedup"})
+    DEDUP_ENABLED = os.getenv("ZIPLINE_DEDUP_ENABLED", "true").lower() in {"1", "true", "yes"}
+    DEDUP_MAX_ENTRIES = int(os.getenv("ZIPLINE_DEDUP_MAX_ENTRIES", "10000"))
+    DEDUP_TTL_SECONDS = float(os.getenv("ZIPLINE_DEDUP_TTL_SECONDS", str(7 * 24 * 3600)))
+
+    # Timeout cho mỗi lần gửi: ATTEMPT_TIMEOUT + thời gian truyền file ở tốc độ MIN_THROUGHPUT (bytes/s).
+    # Chỉ áp dụng khi biết trước kích thước (relay từ URL vẫn dùng sock_read); 0 = tắt
+    ATTEMPT_TIMEOUT = float(os.getenv("ZIPLINE_ATTEMPT_TIMEOUT", "15"))
+    MIN_THROUGHPUT = float(os.getenv("ZIPLINE_MIN_THROUGHPUT", str(1024 * 1024)))
+    # Số lần gửi tối đa, backoff có jitter. GET (tải file nguồn) idempotent: retry mọi lỗi tạm thời
+    # (mất kết nối, timeout, 5xx, 429). Upload POST không idempotent: timeout/5xx có thể đến sau khi
+    # Zipline đã lưu file, nên chỉ retry khi request chưa được gửi (không kết nối được, breaker từ chối)
+    RETRY_ATTEMPTS = int(os.getenv("ZIPLINE_RETRY_ATTEMPTS", "3"))
+    RETRY_BASE_DELAY = float(os.getenv("ZIPLINE_RETRY_BASE_DELAY", "0.2"))
+    RETRY_MAX_DELAY = float(os.getenv("ZIPLINE_RETRY_MAX_DELAY", "2"))
+    # Hedged request cho GET tải file nguồn: sau HEDGE_DELAY giây chưa có header thì gửi thêm 1 bản,
+    # lấy bản về trước; 0 = tắt. Upload không bao giờ hedge (sẽ tạo 2 file trên Zipline)
+    HEDGE_DELAY = float(os.getenv("ZIPLINE_HEDGE_DELAY", "0"))
+    # Circuit breaker: BREAKER_FAILURES lỗi tạm thời liên tiếp -> từ chối ngay trong
+    # BREAKER_RESET_SECONDS giây rồi thử lại 1 request; BREAKER_FAILURES=0 = tắt
+    BREAKER_FAILURES = int(os.getenv("ZIPLINE_BREAKER_FAILURES", "5"))
+    BREAKER_RESET_SECONDS = float(os.getenv("ZIPLINE_BREAKER_RESET_SECONDS", "30"))
+
+    _session: Optional[aiohttp.ClientSession] = None
+    dedup_cache = LRUTTLCache(max_entries=DEDUP_MAX_ENTRIES, ttl_seconds=DEDUP_TTL_SECONDS, name="zipline_dedup")
+    breaker = CircuitBreaker("zipline", BREAKER_FAILURES, BREAKER_RESET_SECONDS)
+
     @staticmethod
-    async def upload_file(file: UploadFile) -> dict:
+    async def startup() -> None:
         """
-        Upload file lên Zipline và trả về URL
-        Returns: { "url": "...", "name": "..." }
+        Tạo ClientSession dùng chung (keep-alive, giới hạn connection, cache DNS)
         """
+        if ZiplineService._session is not None and not ZiplineService._session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=ZiplineService.HTTP_LIMIT,
+            limit_per_host=ZiplineService.HTTP_LIMIT_PER_HOST,
+            keepalive_timeout=ZiplineService.HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=ZiplineService.HTTP_DNS_TTL,
+            use_dns_cache=True,
+        )
+        # Không đặt total timeout vì file lớn có thể upload lâu; chỉ giới hạn connect/read
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=ZiplineService.HTTP_CONNECT_TIMEOUT,
+            sock_connect=ZiplineService.HTTP_CONNECT_TIMEOUT,
+            sock_read=ZiplineService.HTTP_READ_TIMEOUT,
+        )
+        ZiplineService._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    @staticmethod
+    async def shutdown() -> None:
+        session = ZiplineService._session
+        ZiplineService._session = None
+        if session is not None and not session.closed:
+            await session.close()
+
+    @staticmethod
+    async def _get_session() -> aiohttp.ClientSession:
+        # Fallback khi chạy ngoài app (script, worker): tự khởi tạo lần đầu
+        if ZiplineService._session is None or ZiplineService._session.closed:
+            await ZiplineService.startup()
+        return ZiplineService._session
+
+    @staticmethod
+    def dedup_stats() -> dict:
+        return ZiplineService.dedup_cache.stats()
+
+    @staticmethod
+    def circuit_stats() -> dict:
+        return ZiplineService.breaker.stats()
+
+    @staticmethod
+    def _check_config() -> None:
         if not ZiplineService.ZIPLINE_API_URL or not ZiplineService.ZIPLINE_API_KEY:
             raise ValueError("ZIPLINE_API_URL and ZIPLINE_API_KEY must be set in environment variables")
-        
-        # Đọc file content
-        content = await file.read()
-        
-        # Tạo FormData
-        data = aiohttp.FormData()
-        data.add_field('file', 
-                      content,
-                      filename=file.filename,
-                      content_type=file.content_type)
-        
-        # Upload lên Zipline
+
+    @staticmethod
+    def _check_size(size: int) -> None:
+        max_size = ZiplineService.MAX_UPLOAD_SIZE
+        if max_size and size > max_size:
+            raise UploadTooLargeError(f"File exceeds maximum upload size of {max_size} bytes")
+
+    @staticmethod
+    async def _iter_upload_file(file: UploadFile) -> AsyncIterator[bytes]:
+        """
+        Đọc UploadFile theo chunk, kiểm tra giới hạn kích thước trong lúc stream
+        """
+        total = 0
+        counter = ZIPLINE_UPLOAD_BYTES.labels(source="file")
+        while True:
+            chunk = await file.read(ZiplineService.CHUNK_SIZE)
+            if not chunk:
+                break
+            total += len(chunk)
+            ZiplineService._check_size(total)
+            counter.inc(len(chunk))
+            yield chunk
+
+    @staticmethod
+    async def _iter_local_file(path: str, counter=None) -> AsyncIterator[bytes]:
+        """
+        Đọc file trên đĩa theo chunk (file đã ghép xong của resumable upload)
+        """
+        async with aiofiles.open(path, "rb") as f:
+            while True:
+                chunk = await f.read(ZiplineService.CHUNK_SIZE)
+                if not chunk:
+                    break
+                if counter is not None:
+                    counter.inc(len(chunk))
+                yield chunk
+
+    @staticmethod
+    async def _hash_upload_file(file: UploadFile) -> str:
+        """
+        Tính sha256 của UploadFile theo chunk rồi seek về đầu để upload
+        """
+        hasher = hashlib.sha256()
+        total = 0
+        while True:
+            chunk = await file.read(ZiplineService.CHUNK_SIZE)
+            if not chunk:
+                break
+            total += len(chunk)
+            ZiplineService._check_size(total)
+            hasher.update(chunk)
+        await file.seek(0)
+        return hasher.hexdigest()
+
+    @staticmethod
+    async def _iter_response(response: aiohttp.ClientResponse, hasher=None) -> AsyncIterator[bytes]:
+        """
+        Đọc body của response download theo chunk (pipe thẳng sang upload)
+        """
+        total = 0
+        counter = ZIPLINE_UPLOAD_BYTES.labels(source="url")
+        async for chunk in response.content.iter_chunked(ZiplineService.CHUNK_SIZE):
+            total += len(chunk)
+            ZiplineService._check_size(total)
+            counter.inc(len(chunk))
+            if hasher is not None:
+                hasher.update(chunk)
+            yield chunk
+
+    @staticmethod
+    def _attempt_timeout(size: Optional[int]) -> Optional[aiohttp.ClientTimeout]:
+        if size is None or ZiplineService.ATTEMPT_TIMEOUT <= 0:
+            return None
+        return aiohttp.ClientTimeout(
+            total=ZiplineService.ATTEMPT_TIMEOUT + size / ZiplineService.MIN_THROUGHPUT,
+            connect=ZiplineService.HTTP_CONNECT_TIMEOUT,
+            sock_connect=ZiplineService.HTTP_CONNECT_TIMEOUT,
+            sock_read=ZiplineService.HTTP_READ_TIMEOUT,
+        )
+
+    @staticmethod
+    async def _post_to_zipline(
+        build_form: Callable[[], Awaitable[aiohttp.FormData]],
+        filename: Optional[str],
+        source: str,
+        size: Optional[int] = None,
+        replayable: bool = False,
+    ) -> dict:
+        """
+        Gửi request upload qua circuit breaker, ghi latency theo nguồn (file/url) và kết quả (ok/error).
+        build_form tạo body mới cho mỗi lần gửi; replayable = gửi lại được.
+        Upload không idempotent: chỉ retry lỗi trước khi gửi (is_pre_send_error), không hedge
+        """
+        timeout = ZiplineService._attempt_timeout(size)
+
+        async def attempt() -> dict:
+            return await ZiplineService._send_to_zipline(await build_form(), filename, timeout)
+
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await call_with_retries(
+                attempt,
+                upstream="zipline",
+                attempts=ZiplineService.RETRY_ATTEMPTS if replayable else 1,
+                base_delay=ZiplineService.RETRY_BASE_DELAY,
+                max_delay=ZiplineService.RETRY_MAX_DELAY,
+                breaker=ZiplineService.breaker,
+                retry_on=is_pre_send_error,
+            )
+            outcome = "ok"
+            return result
+        finally:
+            ZIPLINE_UPLOAD_SECONDS.labels(source=source, outcome=outcome).observe(time.perf_counter() - started)
+
+    @staticmethod
+    async def _send_to_zipline(
+        data: aiohttp.FormData,
+        filename: Optional[str],
+        timeout: Optional[aiohttp.ClientTimeout] = None,
+    ) -> dict:
         headers = {
             'Authorization': ZiplineService.ZIPLINE_API_KEY
         }
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{ZiplineService.ZIPLINE_API_URL}/api/upload",
-                data=data,
-                headers=headers
-            ) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    raise Exception(f"Zipline upload failed: {response.status} - {error_text}")
-                
-                result = await response.json()
-                
-                # Zipline trả về format: { "files": [{ "name": "...", "url": "..." }] }
-                if "files" in result and len(result["files"]) > 0:
-                    file_info = result["files"][0]
-                    return {
-                        "url": file_info.get("url", ""),
-                        "name": file_info.get("name", file.filename)
-                    }
-                else:
-                    raise Exception("Invalid response from Zipline")
-    
+
+        session = await ZiplineService._get_session()
+        kwargs = {"timeout": timeout} if timeout is not None else {}
+        async with session.post(
+            f"{ZiplineService.ZIPLINE_API_URL}/api/upload",
+            data=data,
+            headers=headers,
+            **kwargs
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise UpstreamHTTPError(f"Zipline upload failed: {response.status} - {error_text}", response.status)
+
+            result = await response.json()
+
+            # Zipline trả về format: { "files": [{ "name": "...", "url": "..." }] }
+            if "files" in result and len(result["files"]) > 0:
+                file_info = result["files"][0]
+                return {
+                    "url": file_info.get("url", ""),
+                    "name": file_info.get("name", filename)
+                }
+            else:
+                raise Exception("Invalid response from Zipline")
+
+    @staticmethod
+    async def upload_file(file: UploadFile) -> dict:
+        """
+        Upload file lên Zipline và trả về URL (stream theo chunk, không buffer cả file)
+        Returns: { "url": "...", "name": "..." }
+        """
+        ZiplineService._check_config()
+
+        # Báo lỗi sớm nếu đã biết kích thước (Starlette đã spool file ra đĩa)
+        if file.size is not None:
+            ZiplineService._check_size(file.size)
+
+        # File đã spool ở local nên hash trước: trùng nội dung thì trả URL cũ, không upload lại
+        digest = None
+        if ZiplineService.DEDUP_ENABLED:
+            digest = await ZiplineService._hash_upload_file(file)
+            cached = ZiplineService.dedup_cache.get(digest)
+            if cached is not None:
+                return dict(cached)
+
+        # Tạo FormData với body là async iterator -> aiohttp gửi chunked.
+        # Mỗi lần gửi (retry) đọc lại từ đầu file đã spool
+        async def build_form() -> aiohttp.FormData:
+            await file.seek(0)
+            data = aiohttp.FormData()
+            data.add_field('file',
+                          ZiplineService._iter_upload_file(file),
+                          filename=file.filename,
+                          content_type=file.content_type or 'application/octet-stream')
+            return data
+
+        result = await ZiplineService._post_to_zipline(
+            build_form, file.filename, source="file", size=file.size, replayable=True
+        )
+        if digest is not None:
+            ZiplineService.dedup_cache.set(digest, dict(result))
+        return result
+
+    @staticmethod
+    async def upload_bytes(data: bytes, filename: str, content_type: str) -> dict:
+        """
+        Upload nội dung đã có sẵn trong RAM (vd: các bản avatar đã resize) lên Zipline
+        Returns: { "url": "...", "name": "..." }
+        """
+        ZiplineService._check_config()
+        ZiplineService._check_size(len(data))
+
+        digest = None
+        if ZiplineService.DEDUP_ENABLED:
+            digest = hashlib.sha256(data).hexdigest()
+            cached = ZiplineService.dedup_cache.get(digest)
+            if cached is not None:
+                return dict(cached)
+
+        async def build_form() -> aiohttp.FormData:
+            form = aiohttp.FormData()
+            form.add_field('file', data, filename=filename, content_type=content_type)
+            ZIPLINE_UPLOAD_BYTES.labels(source="bytes").inc(len(data))
+            return form
+
+        result = await ZiplineService._post_to_zipline(
+            build_form, filename, source="bytes", size=len(data), replayable=True
+        )
+        if digest is not None:
+            ZiplineService.dedup_cache.set(digest, dict(result))
+        return result
+
+    @staticmethod
+    async def upload_local_file(path: str, filename: str, content_type: str) -> dict:
+        """
+        Upload file có sẵn trên đĩa lên Zipline (stream theo chunk, dedup theo sha256)
+        Returns: { "url": "...", "name": "..." }
+        """
+        ZiplineService._check_config()
+        size = os.path.getsize(path)
+        ZiplineService._check_size(size)
+
+        digest = None
+        if ZiplineService.DEDUP_ENABLED:
+            hasher = hashlib.sha256()
+            async for chunk in ZiplineService._iter_local_file(path):
+                hasher.update(chunk)
+            digest = hasher.hexdigest()
+            cached = ZiplineService.dedup_cache.get(digest)
+            if cached is not None:
+                return dict(cached)
+
+        # Mỗi lần gửi mở file riêng nên gửi lại được
+        async def build_form() -> aiohttp.FormData:
+            data = aiohttp.FormData()
+            data.add_field('file',
+                          ZiplineService._iter_local_file(path, ZIPLINE_UPLOAD_BYTES.labels(source="file")),
+                          filename=filename,
+                          content_type=content_type)
+            return data
+
+        result = await ZiplineService._post_to_zipline(
+            build_form, filename, source="file", size=size, replayable=True
+        )
+        if digest is not None:
+            ZiplineService.dedup_cache.set(digest, dict(result))
+        return result
+
     @staticmethod
     async def upload_file_from_url(file_url: str, filename: str) -> dict:
         """
         Upload file từ URL lên Zipline (dùng khi admin upload kết quả)
         """
-        if not ZiplineService.ZIPLINE_API_URL or not ZiplineService.ZIPLINE_API_KEY:
-            raise ValueError("ZIPLINE_API_URL and ZIPLINE_API_KEY must be set in environment variables")
-        
-        # Download file từ URL
-        async with aiohttp.ClientSession() as session:
-            async with session.get(file_url) as response:
-                if response.status != 200:
-                    raise Exception(f"Failed to download file from URL: {response.status}")
-                
-                content = await response.read()
-                content_type = response.headers.get('Content-Type', 'application/octet-stream')
-        
-        # Upload lên Zipline
-        data = aiohttp.FormData()
-        data.add_field('file', 
-                      content,
-                      filename=filename,
-                      content_type=content_type)
-        
-        headers = {
-            'Authorization': ZiplineService.ZIPLINE_API_KEY
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{ZiplineService.ZIPLINE_API_URL}/api/upload",
-                data=data,
-                headers=headers
-            ) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    raise Exception(f"Zipline upload failed: {response.status} - {error_text}")
-                
-                result = await response.json()
-                
-                if "files" in result and len(result["files"]) > 0:
-                    file_info = result["files"][0]
-                    return {
-                        "url": file_info.get("url", ""),
-                        "name": file_info.get("name", filename)
-                    }
-                else:
-                    raise Exception("Invalid response from Zipline")
+        ZiplineService._check_config()
+
+        # Download file từ URL và pipe thẳng sang Zipline: download/upload chạy song song,
+        # RAM chỉ giữ vài chunk thay vì cả file
+        session = await ZiplineService._get_session()
+
+        # GET idempotent: retry và hedge tới khi nhận được header 200; khi đã bắt đầu stream thì không retry nữa
+        async def open_download() -> aiohttp.ClientResponse:
+            response = await session.get(file_url)
+            if response.status != 200:
+                response.release()
+                raise UpstreamHTTPError(f"Failed to download file from URL: {response.status}", response.status)
+            return response
+
+        response = await call_with_retries(
+            open_download,
+            upstream="source",
+            attempts=ZiplineService.RETRY_ATTEMPTS,
+            base_delay=ZiplineService.RETRY_BASE_DELAY,
+            max_delay=ZiplineService.RETRY_MAX_DELAY,
+            hedge_delay=ZiplineService.HEDGE_DELAY,
+            discard=lambda extra: extra.release(),
+        )
+        async with response:
+            if response.content_length is not None:
+                ZiplineService._check_size(response.content_length)
+
+            content_type = response.headers.get('Content-Type', 'application/octet-stream')
+
+            # Không biết nội dung trước khi tải nên hash trong lúc stream, lưu vào cache sau khi upload
+            hasher = hashlib.sha256() if ZiplineService.DEDUP_ENABLED else None
+
+            data = aiohttp.FormData()
+            data.add_field('file',
+                          ZiplineService._iter_response(response, hasher),
+                          filename=filename,
+                          content_type=content_type)
+
+            async def build_form() -> aiohttp.FormData:
+                return data
+
+            result = await ZiplineService._post_to_zipline(build_form, filename, source="url")
+
+        if hasher is not None:
+            ZiplineService.dedup_cache.set(hasher.hexdigest(), dict(result))
+        return result
+
+    @staticmethod
+    async def upload_files_from_urls(
+        items: Iterable[tuple[str, str]],
+        concurrency: Optional[int] = None,
+    ) -> list[dict]:
+        """
+        Relay nhiều URL lên Zipline, tối đa `concurrency` URL cùng lúc.
+        items: [(file_url, filename), ...]
+        Returns (cùng thứ tự với items):
+          [{ "file_url", "filename", "ok", "url", "name", "error" }, ...]
+        """
+        ZiplineService._check_config()
+
+        limit = ZiplineService.RELAY_CONCURRENCY if concurrency is None else concurrency
+        if limit < 1:
+            raise ValueError("concurrency must be >= 1")
+        semaphore = asyncio.Semaphore(limit)
+
+        async def relay(file_url: str, filename: str) -> dict:
+            item = {"file_url": file_url, "filename": filename, "ok": False, "url": None, "name": None, "error": None}
+            async with semaphore:
+                try:
+                    result = await ZiplineService.upload_file_from_url(file_url, filename)
+                except Exception as e:
+                    item["error"] = str(e)
+                    return item
+            item.update(ok=True, url=result["url"], name=result["name"])
+            return item
+
+        return await asyncio.gather(*(relay(url, name) for url, name in items))
+
+    @staticmethod
+    async def upload_files(
+        files: list[UploadFile],
+        concurrency: Optional[int] = None,
+    ) -> list[dict]:
+        """
+        Upload nhiều file (đã spool ở local) lên Zipline, tối đa `concurrency` file cùng lúc.
+        Mỗi file vẫn stream theo chunk như upload_file nên RAM không tăng theo số file.
+        Returns (cùng thứ tự với files):
+          [{ "filename", "ok", "url", "name", "error" }, ...]
+        """
+        ZiplineService._check_config()
+
+        limit = ZiplineService.BATCH_CONCURRENCY if concurrency is None else concurrency
+        if limit < 1:
+            raise ValueError("concurrency must be >= 1")
+        semaphore = asyncio.Semaphore(limit)
+
+        async def send(file: UploadFile) -> dict:
+            item = {"filename": file.filename, "ok": False, "url": None, "name": None, "error": None}
+            async with semaphore:
+                try:
+                    result = await ZiplineService.upload_file(file)
+                except Exception as e:
+                    item["error"] = str(e)
+                    return item
+            item.update(ok=True, url=result["url"], name=result["name"])
+            return item
 
+        return await asyncio.gather(*(send(file) for file in files))
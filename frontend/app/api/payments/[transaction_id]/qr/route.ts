@@ -0,0 +1,57 @@
+// NOTE: Nếu chưa `npm install` thì TypeScript có thể báo thiếu typings của Next/Node.
+// Những khai báo dưới đây chỉ để giảm noise trong editor; khi cài deps đầy đủ sẽ không cần.
+// @ts-ignore
+import { NextRequest, NextResponse } from 'next/server';
+
+declare const process: { env: Record<string, string | undefined> };
+
+// Ảnh VietQR của đơn (PNG mặc định, ?format=svg) do backend render; giữ nguyên
+// Cache-Control/ETag để trình duyệt cache và trả 304 khi gửi lại If-None-Match
+export async function GET(
+  request: NextRequest,
+  context: { params: { transaction_id: string } },
+) {
+  try {
+    const transactionId = context.params.transaction_id;
+
+    const backendUrl =
+      process.env.NEXT_PUBLIC_BACKEND_URL ||
+      process.env.BACKEND_URL ||
+      'http://localhost:8000';
+
+    const format = new URL(request.url).searchParams.get('format') || 'png';
+    const headers: Record<string, string> = {};
+    const ifNoneMatch = request.headers.get('if-none-match');
+    if (ifNoneMatch) {
+      headers['If-None-Match'] = ifNoneMatch;
+    }
+
+    const response = await fetch(
+      `${backendUrl}/api/payments/${encodeURIComponent(transactionId)}/qr?format=${encodeURIComponent(format)}`,
+      { method: 'GET', headers, cache: 'no-store' },
+    );
+
+    if (response.status !== 200 && response.status !== 304) {
+      const data = await response.json();
+      return NextResponse.json(data, { status: response.status });
+    }
+
+    const passthrough: Record<string, string> = {};
+    for (const name of ['content-type', 'cache-control', 'etag']) {
+      const value = response.headers.get(name);
+      if (value) {
+        passthrough[name] = value;
+      }
+    }
+
+    if (response.status === 304) {
+      return new NextResponse(null, { status: 304, headers: passthrough });
+    }
+    return new NextResponse(await response.arrayBuffer(), { status: 200, headers: passthrough });
+  } catch (error: any) {
+    return NextResponse.json(
+      { message: error?.message || 'Internal server error' },
+      { status: 500 },
+    );
+  }
+}
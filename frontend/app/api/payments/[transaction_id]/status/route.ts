@@ -6,7 +6,7 @@ import { NextRequest, NextResponse } from 'next/server';
 declare const process: { env: Record<string, string | undefined> };
 
 export async function GET(
-  _request: NextRequest,
+  request: NextRequest,
   context: { params: { transaction_id: string } },
 ) {
   try {
@@ -17,9 +17,15 @@ export async function GET(
       process.env.BACKEND_URL ||
       'http://localhost:8000';
 
+    // ?wait=N -> backend long-poll (returns as soon as the status changes)
+    const wait = new URL(request.url).searchParams.get('wait');
+    const path = wait
+      ? `wait?timeout=${encodeURIComponent(wait)}`
+      : 'status';
+
     const response = await fetch(
-      `${backendUrl}/api/payments/${encodeURIComponent(transactionId)}/status`,
-      { method: 'GET' },
+      `${backendUrl}/api/payments/${encodeURIComponent(transactionId)}/${path}`,
+      { method: 'GET', cache: 'no-store' },
     );
 
     const data = await response.json();
@@ -0,0 +1,44 @@
+// NOTE: Nếu chưa `npm install` thì TypeScript có thể báo thiếu typings của Next/Node.
+// Những khai báo dưới đây chỉ để giảm noise trong editor; khi cài deps đầy đủ sẽ không cần.
+// @ts-ignore
+import { NextRequest, NextResponse } from 'next/server';
+
+declare const process: { env: Record<string, string | undefined> };
+
+// Huỷ job chưa chạy (409 nếu đã chạy/xong) và hoàn credits
+export async function POST(
+  request: NextRequest,
+  context: { params: { job_id: string } },
+) {
+  try {
+    const jobId = context.params.job_id;
+    const { user_id: userId } = await request.json();
+
+    if (!userId) {
+      return NextResponse.json({ message: 'Missing user_id' }, { status: 400 });
+    }
+
+    const backendUrl =
+      process.env.NEXT_PUBLIC_BACKEND_URL ||
+      process.env.BACKEND_URL ||
+      'http://localhost:8000';
+
+    const response = await fetch(
+      `${backendUrl}/api/render/jobs/${encodeURIComponent(jobId)}/cancel?user_id=${encodeURIComponent(userId)}`,
+      { method: 'POST' },
+    );
+
+    const data = await response.json();
+
+    if (!response.ok) {
+      return NextResponse.json(data, { status: response.status });
+    }
+
+    return NextResponse.json(data);
+  } catch (error: any) {
+    return NextResponse.json(
+      { message: error?.message || 'Internal server error' },
+      { status: 500 },
+    );
+  }
+}
@@ -0,0 +1,39 @@
+// NOTE: Nếu chưa `npm install` thì TypeScript có thể báo thiếu typings của Next/Node.
+// Những khai báo dưới đây chỉ để giảm noise trong editor; khi cài deps đầy đủ sẽ không cần.
+// @ts-ignore
+import { NextRequest, NextResponse } from 'next/server';
+
+declare const process: { env: Record<string, string | undefined> };
+
+// Trạng thái job render: queued | running | succeeded | failed | cancelled
+export async function GET(
+  _request: NextRequest,
+  context: { params: { job_id: string } },
+) {
+  try {
+    const jobId = context.params.job_id;
+
+    const backendUrl =
+      process.env.NEXT_PUBLIC_BACKEND_URL ||
+      process.env.BACKEND_URL ||
+      'http://localhost:8000';
+
+    const response = await fetch(
+      `${backendUrl}/api/render/jobs/${encodeURIComponent(jobId)}`,
+      { method: 'GET', cache: 'no-store' },
+    );
+
+    const data = await response.json();
+
+    if (!response.ok) {
+      return NextResponse.json(data, { status: response.status });
+    }
+
+    return NextResponse.json(data);
+  } catch (error: any) {
+    return NextResponse.json(
+      { message: error?.message || 'Internal server error' },
+      { status: 500 },
+    );
+  }
+}
@@ -0,0 +1,33 @@
+// NOTE: Nếu chưa `npm install` thì TypeScript có thể báo thiếu typings của Next/Node.
+// Những khai báo dưới đây chỉ để giảm noise trong editor; khi cài deps đầy đủ sẽ không cần.
+// @ts-ignore
+import { NextRequest, NextResponse } from 'next/server';
+
+declare const process: { env: Record<string, string | undefined> };
+
+// Gửi job render: backend giữ credits ngay (402 nếu không đủ), hoàn lại nếu job lỗi/bị huỷ
+export async function POST(request: NextRequest) {
+  try {
+    const body = await request.json();
+
+    const backendUrl =
+      process.env.NEXT_PUBLIC_BACKEND_URL ||
+      process.env.BACKEND_URL ||
+      'http://localhost:8000';
+
+    const response = await fetch(`${backendUrl}/api/render/jobs`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(body),
+    });
+
+    const data = await response.json();
+
+    return NextResponse.json(data, { status: response.status });
+  } catch (error: any) {
+    return NextResponse.json(
+      { message: error?.message || 'Internal server error' },
+      { status: 500 },
+    );
+  }
+}
@@ -0,0 +1,40 @@
+import { NextRequest, NextResponse } from 'next/server';
+
+export async function POST(request: NextRequest) {
+  try {
+    const formData = await request.formData();
+    const files = formData.getAll('files');
+
+    if (files.length === 0) {
+      return NextResponse.json({ message: 'Missing files' }, { status: 400 });
+    }
+
+    const backendUrl =
+      process.env.NEXT_PUBLIC_BACKEND_URL ||
+      process.env.BACKEND_URL ||
+      'http://localhost:8000';
+
+    const backendFormData = new FormData();
+    for (const file of files) {
+      backendFormData.append('files', file);
+    }
+
+    const response = await fetch(`${backendUrl}/api/upload/batch`, {
+      method: 'POST',
+      body: backendFormData,
+    });
+
+    const data = await response.json();
+
+    if (!response.ok) {
+      return NextResponse.json(data, { status: response.status });
+    }
+
+    return NextResponse.json(data);
+  } catch (error: any) {
+    return NextResponse.json(
+      { message: error.message || 'Internal server error' },
+      { status: 500 },
+    );
+  }
+}
@@ -9,6 +9,7 @@ type CreateOrderResponse = {
   transfer_content?: string;
   bank_name?: string;
   account_number?: string;
+  account_name?: string;
   amount?: number;
   amount_vnd?: number;
   coins?: number;
@@ -17,7 +18,7 @@ type CreateOrderResponse = {
 
 type PaymentStatusResponse = {
   transaction_id: string;
-  status: 'pending' | 'completed' | 'failed' | string;
+  status: 'pending' | 'completed' | 'failed' | 'expired' | string;
   amount?: number;
   coins?: number;
   credits?: number;
@@ -37,7 +38,7 @@ export function QRPaymentModal(props: {
   const [status, setStatus] = useState<PaymentStatusResponse | null>(null);
   const [message, setMessage] = useState<string | null>(null);
 
-  const intervalRef = useRef<number | null>(null);
+  const abortRef = useRef<AbortController | null>(null);
 
   const transactionId = order?.transaction_id;
   const normalizedStatus = (status?.status || order?.status || 'pending').toLowerCase();
@@ -52,9 +53,9 @@ export function QRPaymentModal(props: {
   }, [order?.amount, order?.amount_vnd, amountVnd]);
 
   const clearPolling = () => {
-    if (intervalRef.current) {
-      window.clearInterval(intervalRef.current);
-      intervalRef.current = null;
+    if (abortRef.current) {
+      abortRef.current.abort();
+      abortRef.current = null;
     }
   };
 
@@ -98,59 +99,64 @@ export function QRPaymentModal(props: {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [open]);
 
-  // Polling every 3s when we have a transaction id
+  // Long-poll when we have a transaction id: the backend holds each request
+  // until the status changes (or ~25s), then we immediately ask again
   useEffect(() => {
     if (!open) return;
     if (!transactionId) return;
 
-    const pollOnce = async () => {
-      const res = await fetch(`/api/payments/${encodeURIComponent(transactionId)}/status`, {
-        method: 'GET',
-      });
+    clearPolling();
+    const controller = new AbortController();
+    abortRef.current = controller;
+
+    const pollOnce = async (wait: number) => {
+      const res = await fetch(
+        `/api/payments/${encodeURIComponent(transactionId)}/status?wait=${wait}`,
+        { method: 'GET', signal: controller.signal },
+      );
       const data = (await res.json()) as any;
       if (!res.ok) throw new Error(data?.detail || data?.message || 'Status check failed');
       setStatus(data as PaymentStatusResponse);
       return data as PaymentStatusResponse;
     };
 
-    let cancelled = false;
+    const sleep = (ms: number) => new Promise((resolve) => window.setTimeout(resolve, ms));
 
     const start = async () => {
-      try {
-        // First call immediately
-        const first = await pollOnce();
-        const st = (first.status || '').toLowerCase();
-        if (st === 'completed' || st === 'failed') return;
-      } catch {
-        // ignore first error; will try again in interval
-      }
-
-      if (cancelled) return;
-      clearPolling();
-      intervalRef.current = window.setInterval(async () => {
+      // First call returns immediately
+      let wait = 0;
+      while (!controller.signal.aborted) {
         try {
-          const s = await pollOnce();
+          const s = await pollOnce(wait);
           const st = (s.status || '').toLowerCase();
           if (st === 'completed') {
-            clearPolling();
-            setMessage('Thanh toán thành công! Đang cập nhật...');
-            window.setTimeout(() => window.location.reload(), 2000);
+            if (wait > 0) {
+              setMessage('Thanh toán thành công! Đang cập nhật...');
+              window.setTimeout(() => window.location.reload(), 2000);
+            }
+            return;
           } else if (st === 'failed') {
-            clearPolling();
-            setMessage('Thanh toán thất bại. Vui lòng thử lại.');
+            // A late transfer can still settle it: keep listening
+            if (wait > 0) setMessage('Thanh toán thất bại. Vui lòng thử lại.');
+          } else if (st === 'expired') {
+            if (wait > 0) setMessage('Mã QR đã hết hạn. Vui lòng tạo đơn mới.');
           }
+          wait = 25;
         } catch (e: any) {
+          if (controller.signal.aborted) return;
           // network errors: keep polling but show a lightweight message
-          setMessage(e?.message || 'Lỗi mạng khi kiểm tra trạng thái.');
+          if (wait > 0) setMessage(e?.message || 'Lỗi mạng khi kiểm tra trạng thái.');
+          wait = 25;
+          await sleep(3000);
         }
-      }, 3000);
+      }
     };
 
     start();
 
     return () => {
-      cancelled = true;
-      clearPolling();
+      controller.abort();
+      if (abortRef.current === controller) abortRef.current = null;
     };
   }, [open, transactionId]);
 
@@ -236,6 +242,9 @@ export function QRPaymentModal(props: {
                   <div>
                     <b>Số tài khoản:</b> {order.account_number || '113366668888'}
                   </div>
+                  <div>
+                    <b>Chủ tài khoản:</b> {order.account_name || 'RENDERTOOL'}
+                  </div>
                   <div>
                     <b>Số tiền:</b> {amountText}
                   </div>
@@ -251,7 +260,9 @@ export function QRPaymentModal(props: {
                       ? 'Thành công'
                       : normalizedStatus === 'failed'
                         ? 'Thất bại'
-                        : 'Đang chờ thanh toán...'}
+                        : normalizedStatus === 'expired'
+                          ? 'Hết hạn'
+                          : 'Đang chờ thanh toán...'}
                   </div>
                   {message ? <div style={{ marginTop: 6, opacity: 0.85 }}>{message}</div> : null}
                 </div>